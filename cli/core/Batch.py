@@ -0,0 +1,199 @@
+# -*- coding=utf-8
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .File import File
+from .Session import Session
+from .Upload import UploadJob
+from .Copy import CopyJob, CopyScope
+from .Exception import CliException, CliKeyError
+from .utilities.BandwidthUtils import BandwidthJob
+from .utilities.ConcurrencyUtils import LimiterJob, RetryPolicy
+from .utilities.PathUtils import NormalizePath, KeySplit
+from .utilities.CompressUtils import Compression
+from .uploader.Registry import GetUploader
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRunner:
+    """
+    Run a manifest of operations in one process, buckets and credentials shared through the session.
+    """
+
+    # operation -> arguments required, named as the options of the commands
+    OPERATIONS = {
+        "upload": ("file", "bucket", "path"),
+        "cp": ("bucket", "src", "dst"),
+        "mv": ("bucket", "src", "dst"),
+        "rm": ("bucket", "file"),
+        "mkdir": ("bucket", "fullpath"),
+    }
+
+    def __init__(self, session: Session, workers=8, callbackResult=None):
+        """
+        Initiate the runner.
+        :param session: Session object shared by the operations
+        :param workers: operations run at the same time
+        :param callbackResult: callback function called with the result dict of each operation when it finishes
+        """
+        self.session = session
+        self.workers = workers
+        self.callbackResult = callbackResult
+
+    def run(self, operations: list) -> list:
+        """
+        Run the operations, an operation waits for the ones in its "after" list and is skipped if any failed.
+        :param operations: list of dict like {"id": "b", "op": "mv", "bucket": "x", "src": "a", "dst": "b", "after": ["a"]}
+        :return: list of result dict, in the order they finished
+        """
+        # lines which aren't objects fail on their own, as operations of their index
+        operations = [self._validate(operation, index) for index, operation in enumerate(operations)]
+        byId = {operation["id"]: operation for operation in operations}
+        if len(byId) != len(operations):
+            # an id given twice, or equal to the index of a line without one, would never finish all its operations
+            ids = [operation["id"] for operation in operations]
+            raise CliKeyError({"data": f"ids {', '.join(sorted({x for x in ids if ids.count(x) > 1}))} are repeated"})
+        waiting = {operation["id"]: set(map(str, operation.get("after", []) or [])) for operation in operations}
+        dependents = {}
+        for _id, after in waiting.items():
+            for dependency in after:
+                dependents.setdefault(dependency, []).append(_id)
+
+        results = []
+        failed = set()
+        unreachable = set()
+        lock = threading.Lock()
+        done = threading.Condition(lock)
+        remaining = [len(byId)]
+        # the pool once it's up, operations finished before it, in cycles, have nothing ready to submit
+        executor = None
+
+        def submit(_id: str):
+            executor.submit(execute, _id)
+
+        def finish(result: dict):
+            with lock:
+                results.append(result)
+                if not result["ok"]:
+                    failed.add(result["id"])
+                remaining[0] -= 1
+                ready = []
+                for dependent in dependents.get(result["id"], []):
+                    waiting[dependent].discard(result["id"])
+                    if not waiting[dependent] and dependent not in unreachable:
+                        ready.append(dependent)
+                done.notify_all()
+            if self.callbackResult:
+                self.callbackResult(result)
+            for _id in ready:
+                submit(_id)
+
+        def execute(_id: str):
+            operation = byId[_id]
+            start = time.monotonic()
+            result = {"id": _id, "op": operation.get("op"), "ok": False, "error": "interrupted"}
+            skippedFor = [dependency for dependency in operation.get("after", []) or [] if str(dependency) in failed]
+            try:
+                if skippedFor:
+                    raise CliKeyError({"data": f"dependency {', '.join(map(str, skippedFor))} failed"})
+                # operations share the bandwidth in turn, however many parts each has in flight, and retry on budgets
+                # of their own
+                with BandwidthJob(f"batch-{_id}"), LimiterJob(retry=RetryPolicy()):
+                    result = {"id": _id, "op": operation.get("op"), "ok": True, "result": self._execute(operation)}
+            except (CliException, OSError) as e:
+                result = {"id": _id, "op": operation.get("op"), "ok": False, "error": str(e)}
+            except Exception as e:
+                # anything else fails the operation alone, the run still waits for every operation to finish
+                logger.exception(e)
+                result = {"id": _id, "op": operation.get("op"), "ok": False, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                result["seconds"] = round(time.monotonic() - start, 3)
+                finish(result)
+
+        # unknown dependencies are never going to finish, nor are cycles and what depends on them
+        for _id, after in waiting.items():
+            for dependency in [dependency for dependency in after if dependency not in byId]:
+                after.discard(dependency)
+                failed.add(dependency)
+        unreachable.update(byId)
+        indegree = {_id: len(after) for _id, after in waiting.items()}
+        ordered = [_id for _id, degree in indegree.items() if degree == 0]
+        while ordered:
+            _id = ordered.pop()
+            unreachable.discard(_id)
+            for dependent in dependents.get(_id, []):
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ordered.append(dependent)
+        for _id in unreachable:
+            finish({"id": _id, "op": byId[_id].get("op"), "ok": False, "error": "dependency cycle", "seconds": 0})
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _id in [_id for _id, after in waiting.items() if not after and _id not in unreachable]:
+                submit(_id)
+            with lock:
+                while remaining[0]:
+                    done.wait()
+        return results
+
+    @staticmethod
+    def _validate(operation, index: int) -> dict:
+        """
+        Operation with its id, one failing with the reason if it isn't an object or its "after" isn't a list.
+        """
+        if not isinstance(operation, dict):
+            return {"id": str(index), "malformed": f"operation {operation!r} is not a JSON object"}
+        operation = dict(operation, id=str(operation.get("id", index)))
+        if not isinstance(operation.get("after", []) or [], list):
+            return {"id": operation["id"], "op": operation.get("op"), "malformed": "after is not a list of ids"}
+        return operation
+
+    def _execute(self, operation: dict):
+        if "malformed" in operation:
+            raise CliKeyError({"data": operation["malformed"]})
+        op = operation.get("op")
+        if op not in self.OPERATIONS:
+            raise CliKeyError({"data": f"unknown operation {op}"})
+        missing = [key for key in self.OPERATIONS[op] if not operation.get(key)]
+        if missing:
+            raise CliKeyError({"data": f"{op} needs {', '.join(missing)}"})
+
+        if op == "upload":
+            if not os.path.exists(operation["file"]):
+                raise CliKeyError({"data": f"file {operation['file']} doesn't exist."})
+            bucket = self.session.uploader(operation["bucket"], GetUploader(operation.get("uploader", "cos")),
+                                           operation["path"])
+            compression = Compression(operation["compress"], rules=operation.get("compress_type", None)) \
+                if operation.get("compress") else None
+            job = UploadJob(bucket, operation["file"], operation["path"], dedup=bool(operation.get("dedup", False)),
+                            workers=self.session.limiter.maximum, compression=compression)
+            result = job.run()
+            if result["failed"]:
+                raise CliKeyError({"data": f"failed to upload {', '.join(result['failed'])}"})
+            return result
+
+        if op == "cp":
+            source = self.session.uploader(operation["bucket"], path=CopyScope(operation["src"]))
+            destination = self.session.uploader(operation.get("dst_bucket") or operation["bucket"],
+                                                path=CopyScope(operation["dst"]))
+            result = CopyJob(source, destination, operation["src"], operation["dst"],
+                             workers=self.session.limiter.maximum).run()
+            if result["failed"]:
+                raise CliKeyError({"data": f"failed to copy {', '.join(result['failed'])}"})
+            return result
+
+        bucket = self.session.bucket(operation["bucket"])
+        if op == "mv":
+            bucket.move(str(operation["src"]).lstrip("/"), str(operation["dst"]).lstrip("/"))
+        elif op == "rm":
+            path, name = KeySplit(operation["file"])
+            name = NormalizePath(name) if str(operation["file"]).endswith("/") else name
+            bucket.remove([File(name=name, _type="folder" if name.endswith("/") else "file",
+                                path=NormalizePath(path).lstrip("/"))])
+        elif op == "mkdir":
+            bucket.mkdir(str(operation["fullpath"]).strip("/").strip())
+        return None
@@ -0,0 +1,220 @@
+# -*- coding=utf-8
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx as requests
+
+from .File import File
+from .Exception import CliException
+from .utilities.PathUtils import NormalizePath
+from .utilities.BandwidthUtils import WithJob
+from .uploader import TransferSettings
+
+logger = logging.getLogger(__name__)
+
+
+def Percentile(values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile.
+    :param values: list of numbers
+    :param fraction: 0.5 for the median, 0.99 for p99
+    :return: the percentile, 0 if no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class BenchJob:
+    """
+    Measure uploads of synthetic objects by backend, size and concurrency, then listing and removing them.
+    Everything is put under a folder of the run, removed once done whatever happened.
+    """
+
+    SIZES = (64 * 1024, 1024 * 1024, 8 * 1024 * 1024, 32 * 1024 * 1024)
+    CONCURRENCIES = (1, 8, 32)
+    # bytes uploaded by a combination at most, it still uploads as many objects as its concurrency
+    BUDGET = 64 * 1024 * 1024
+    MAX_OBJECTS = 200
+
+    def __init__(self, client, bucket: str, backends: list, sizes=None, concurrencies=None, partSize=None,
+                 budget=None, path="/.peg-bench", callbackResult=None):
+        """
+        Initiate the job.
+        :param client: PegClient object the bucket and its uploaders are got from, its limiter tuned as it goes
+        :param bucket: bucket name
+        :param backends: names of the uploader backends to measure
+        :param sizes: bytes of the objects, SIZES if None
+        :param concurrencies: uploads in flight, CONCURRENCIES if None
+        :param partSize: bytes of a part of multipart uploads, the uploader's if None
+        :param budget: bytes a combination uploads at most, BUDGET if None
+        :param path: folder in the bucket the run folder is made in
+        :param callbackResult: callback function called with the result dict of each measure as it's done
+        """
+        self.client = client
+        self.bucket = bucket
+        self.backends = list(backends)
+        self.sizes = list(sizes or self.SIZES)
+        self.concurrencies = list(concurrencies or self.CONCURRENCIES)
+        self.partSize = partSize
+        self.budget = budget or self.BUDGET
+        self.callbackResult = callbackResult
+        self.root = f"{NormalizePath(path)}{uuid.uuid4().hex[:12]}/".lstrip("/")
+
+        # folder of a combination -> keys uploaded to it
+        self.uploaded = {}
+
+    def count(self, size: int, concurrency: int) -> int:
+        """
+        Objects a combination uploads, enough to keep every slot busy a few times within the budget.
+        """
+        return max(concurrency, min(self.MAX_OBJECTS, self.budget // size))
+
+    def run(self) -> list:
+        """
+        Run every combination, then list and remove what they uploaded.
+        :return: list of result dict like {"op", "backend", "size", "concurrency", "objects", "failed", "seconds",
+        "MBps", "objectsPerSecond", "p50", "p99"}, latencies in milliseconds
+        """
+        results = []
+        directory = tempfile.mkdtemp(prefix="peg-bench-")
+        bucket = self.client.bucket(self.bucket)
+        try:
+            files = self._prepare(directory)
+            for backend in self.backends:
+                bucket = self.client.uploader(self.bucket, backend, self.root)
+                for size in self.sizes:
+                    for concurrency in self.concurrencies:
+                        results.append(self._report(self._upload(bucket, backend, size, concurrency, files[size])))
+            results.append(self._report(self._list(bucket)))
+            results += [self._report(result) for result in self._remove(bucket)]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+            try:
+                bucket.remove([File(name=self.root, path="", _type="folder")])
+            except (CliException, requests.TransportError) as e:
+                logger.warning(f"Failed to remove /{self.root}, {e}")
+        return results
+
+    def _prepare(self, directory: str) -> dict:
+        """
+        Local files of every size, one written with random bytes and the others linked to it.
+        :return: dict of size -> list of File object
+        """
+        files = {}
+        for size in self.sizes:
+            count = max([self.count(size, concurrency) for concurrency in self.concurrencies])
+            folder = os.path.join(directory, str(size))
+            os.makedirs(folder)
+            source = os.path.join(folder, "0")
+            with open(source, "wb") as file:
+                file.write(os.urandom(size))
+            for index in range(1, count):
+                try:
+                    os.link(source, os.path.join(folder, str(index)))
+                except OSError:
+                    shutil.copyfile(source, os.path.join(folder, str(index)))
+            files[size] = [File(name=str(index), path=f"{folder}{os.sep}", _type="file", fileSize=size)
+                           for index in range(count)]
+        return files
+
+    def _upload(self, bucket, backend: str, size: int, concurrency: int, files: list) -> dict:
+        files = files[:self.count(size, concurrency)]
+        folder = f"{self.root}{backend}-{size}-{concurrency}/"
+        # the limiter would search for the concurrency itself, it's held where the combination says
+        self.client.tune(initial=concurrency, maximum=concurrency)
+
+        latencies = []
+        failed = []
+
+        def upload(file: File):
+            start = time.monotonic()
+            try:
+                bucket.upload(file, folder)
+            except (CliException, OSError, requests.TransportError) as e:
+                logger.debug(f"Bench upload of {folder}{file.name} failed, {e}")
+                failed.append(file.name)
+                return
+            latencies.append(time.monotonic() - start)
+
+        start = time.monotonic()
+        with TransferSettings(threads=concurrency, partSize=self.partSize), \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(WithJob(upload), file) for file in files]:
+                future.result()
+        seconds = time.monotonic() - start
+        self.uploaded[folder] = [f"{folder}{file.name}" for file in files if file.name not in failed]
+        return {"op": "upload", "backend": backend, "size": size, "concurrency": concurrency,
+                "objects": len(latencies), "failed": len(failed), "bytes": len(latencies) * size,
+                "seconds": seconds, "latencies": latencies}
+
+    def _list(self, bucket) -> dict:
+        """
+        List every folder of the run a page each, a request per folder.
+        """
+        latencies = []
+        objects = 0
+        start = time.monotonic()
+        for folder in self.uploaded:
+            begin = time.monotonic()
+            objects += len(bucket.list(limit=1000, path=folder))
+            latencies.append(time.monotonic() - begin)
+        return {"op": "list", "backend": "-", "size": 0, "concurrency": 1, "objects": objects, "failed": 0,
+                "bytes": 0, "seconds": time.monotonic() - start, "latencies": latencies}
+
+    def _remove(self, bucket) -> list:
+        """
+        Remove the folders of the run by turns, keys in batches through delete.json or the folder at once.
+        """
+        measures = {
+            "delete": {"latencies": [], "objects": 0, "failed": 0, "seconds": 0.0},
+            "delete-folder": {"latencies": [], "objects": 0, "failed": 0, "seconds": 0.0}
+        }
+        for index, (folder, keys) in enumerate(self.uploaded.items()):
+            if index % 2 == 0:
+                measure = measures["delete"]
+                batches = [[File(name=key, path="", _type="file") for key in keys[x:x + 1000]]
+                             for x in range(0, len(keys), 1000)]
+            else:
+                measure = measures["delete-folder"]
+                batches = [[File(name=folder, path="", _type="folder")]]
+            for files in batches:
+                start = time.monotonic()
+                try:
+                    bucket.remove(files)
+                except (CliException, requests.TransportError) as e:
+                    logger.debug(f"Bench remove in {folder} failed, {e}")
+                    measure["failed"] += len(keys) if files[0].type == "folder" else len(files)
+                    continue
+                elapsed = time.monotonic() - start
+                measure["latencies"].append(elapsed)
+                measure["seconds"] += elapsed
+                measure["objects"] += len(keys) if files[0].type == "folder" else len(files)
+        return [dict({"op": op, "backend": "-", "size": 0, "concurrency": 1}, **measure, bytes=0)
+                for op, measure in measures.items() if measure["latencies"] or measure["failed"]]
+
+    def _report(self, measure: dict) -> dict:
+        """
+        Turn a measure into its result, rates and latency percentiles, and hand it to the callback.
+        """
+        latencies = measure.pop("latencies")
+        sent = measure.pop("bytes")
+        seconds = max(measure["seconds"], 1e-6)
+        result = dict(
+            measure,
+            seconds=round(measure["seconds"], 3),
+            MBps=round(sent / seconds / 1024 / 1024, 2),
+            objectsPerSecond=round(measure["objects"] / seconds, 2),
+            p50=round(Percentile(latencies, 0.5) * 1000, 1),
+            p99=round(Percentile(latencies, 0.99) * 1000, 1)
+        )
+        if self.callbackResult:
+            self.callbackResult(result)
+        return result
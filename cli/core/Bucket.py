@@ -1,11 +1,16 @@
 import base64
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import httpx as requests
 
 from .User import User
-from .File import File
+from .File import File, FileBatch
 from .uploader import Uploader
 from .utilities.PathUtils import NormalizePath
+from .utilities.ConcurrencyUtils import AdaptiveLimiter, RaiseForRetry
+from .utilities.BandwidthUtils import BandwidthLimiter, WithJob
 from .Exception import CliRequestError, CliKeyError
 
 logger = logging.getLogger(__name__)
@@ -16,16 +21,20 @@ class Bucket:
     OSS Bucket
     """
 
-    def __init__(self, name: str, user: User, uploader=None):
+    def __init__(self, name: str, user: User, uploader=None, limiter=None, bandwidth=None):
         """
         Initiate an OSS Bucket.
         :param name: name of OSS bucket without suffix, as imagebutter
         :param user: User object with token in it
         :param uploader: FileUploader object, core.uploader
+        :param limiter: AdaptiveLimiter shared with other jobs on the account, a private one if None
+        :param bandwidth: BandwidthLimiter shared by the transfers of the process, unlimited if None
         """
         self.name = name
         self.user = user
         self.uploader = uploader
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        self.bandwidth = bandwidth if bandwidth is not None else BandwidthLimiter()
 
         self.session = requests.Client(
             base_url="https://api.dogecloud.com/oss/",
@@ -34,7 +43,7 @@ class Bucket:
             cookies={"token": self.user.token},
             headers={"authorization": "COOKIE"}
         )
-        response = self.session.post(
+        response = self._post(
             url="/bucket/info.json",
             data={"name": self.name}
         )
@@ -61,10 +70,131 @@ class Bucket:
         :param _continue: continue from the item index and fetch a LIMIT quantity of item
         :return: List of File object
         """
+        return self._listPage(limit, path, _continue)[0]
 
+    def iterate(self, path="/", limit=1000):
+        """
+        List a bucket file directory page by page, only a page is held at a time.
+        :param path: directory to list
+        :param limit: quantity of the list items fetched in a request
+        :return: generator of File object
+        """
+        _continue = ""
+        while True:
+            files, nextContinue = self._listPage(limit, path, _continue)
+            yield from files
+            if not files or not nextContinue or nextContinue == _continue:
+                return
+            _continue = nextContinue
+
+    def walk(self, path="/", limit=1000, workers=1):
+        """
+        List a bucket file directory recursively, a folder is yielded before its content.
+        :param path: directory to list
+        :param limit: quantity of the list items fetched in a request
+        :param workers: folders listed at the same time, every folder found is a new task for them
+        :return: generator of File object, in the order they arrive if more than one worker
+        """
+        if workers > 1:
+            yield from self._walkParallel(NormalizePath(path), limit, workers)
+            return
+
+        pending = [NormalizePath(path)]
+        seen = set(pending)
+        while pending:
+            current = pending.pop()
+            for file in self.iterate(current, limit):
+                if file.type == "folder":
+                    folder = NormalizePath(file.name)
+                    if folder in seen:
+                        continue
+                    seen.add(folder)
+                    pending.append(folder)
+                yield file
+
+    def listBatch(self, path="/", recursive=False, workers=1, limit=1000) -> FileBatch:
+        """
+        List a bucket file directory into a columnar FileBatch, for listings of millions of entries.
+        :param path: directory to list
+        :param recursive: list sub directories as well
+        :param workers: folders listed at the same time if recursive
+        :param limit: quantity of the list items fetched in a request
+        :return: FileBatch object
+        """
         path = NormalizePath(path)
+        files = self.walk(path, limit, workers) if recursive else self.iterate(path, limit)
+        return FileBatch.FromFiles(files, path)
+
+    def _walkParallel(self, path: str, limit: int, workers: int):
+        """
+        Walk with a pool of workers listing a folder each, results bounded so a slow consumer holds them back.
+        """
+        folders = queue.Queue()
+        results = queue.Queue(maxsize=workers * limit)
+        stop = threading.Event()
+        lock = threading.Lock()
+        seen = {path}
+        outstanding = [1]
+        folders.put(path)
 
-        response = self.session.post(
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def work():
+            while not stop.is_set():
+                try:
+                    current = folders.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    for file in self.iterate(current, limit):
+                        if file.type == "folder":
+                            folder = NormalizePath(file.name)
+                            with lock:
+                                # a folder can be listed as an entry more than once, list it only once
+                                if folder in seen:
+                                    continue
+                                seen.add(folder)
+                                outstanding[0] += 1
+                            folders.put(folder)
+                        put(file)
+                except BaseException as e:
+                    put(e)
+                with lock:
+                    outstanding[0] -= 1
+                    if outstanding[0] == 0:
+                        put(None)
+
+        threads = [threading.Thread(target=WithJob(work), daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _listPage(self, limit: int, path: str, _continue: str) -> tuple:
+        """
+        List a page of a bucket file directory.
+        :param limit: quantity of the list items return in a time
+        :param path: directory to list
+        :param _continue: continue from the item index and fetch a LIMIT quantity of item
+        :return: tuple(list of File object, continue of the next page)
+        """
+        path = NormalizePath(path)
+
+        response = self._post(
             url="/file/list.json",
             data={
                 "bucket": self.name,
@@ -85,14 +215,15 @@ class Bucket:
             _time=file.get("time", ""),
             _type=file.get("type", ""),
             path=path
-        ) for file in data.get("data", {}).get("files", {})]
+        ) for file in data.get("data", {}).get("files", {})], data.get("data", {}).get("continue", "")
 
-    def upload(self, file: File, path: str, callbackProgress=None):
+    def upload(self, file: File, path: str, callbackProgress=None, compression=None):
         """
         Upload file to the bucket.
         :param file: File object with local path in it.
         :param path: bucket file path.
         :param callbackProgress: callback progress indicator, default None
+        :param compression: Compression object for the files it applies to, default None
         :return: uploading object
         """
 
@@ -101,7 +232,38 @@ class Bucket:
         if self.uploader is None:
             raise CliKeyError({"data": "No uploader set."})
 
-        return self.uploader.upload(file, path, callbackProgress)
+        return self.uploader.upload(file, path, callbackProgress, compression=compression)
+
+    def uploadStream(self, stream, path: str, name: str, callbackProgress=None):
+        """
+        Upload a stream of unknown length to the bucket, like stdin.
+        :param stream: binary file-like object
+        :param path: bucket file path.
+        :param name: object name
+        :param callbackProgress: callback progress indicator, default None
+        :return: uploading object
+        """
+        path = NormalizePath(path)
+
+        if self.uploader is None:
+            raise CliKeyError({"data": "No uploader set."})
+
+        return self.uploader.uploadStream(stream, path if path != "/" else "", name, callbackProgress)
+
+    def copy(self, src: str, dst: str, size=0, source=None):
+        """
+        Copy file from source to destination server side.
+        :param src: source file path
+        :param dst: destination file path
+        :param size: bytes of the source, large ones copied in parts
+        :param source: Bucket object the source is in, this one if None, with uploader set
+        :return: copying object
+        """
+        if self.uploader is None or (source is not None and source.uploader is None):
+            raise CliKeyError({"data": "No uploader set."})
+
+        return self.uploader.copy(src.lstrip("/"), dst.lstrip("/"), size,
+                                  source.uploader if source is not None else None)
 
     def remove(self, files: [File], callbackProgress=None) -> None:
         """
@@ -112,48 +274,38 @@ class Bucket:
         """
         # split folders and files into different array
         folders = []
+        keys = []
         for file in files:
             if file.type == "folder":
                 folders.append(base64.b64encode(f"{file.path}{file.name}".encode()).decode()
                                .translate(str.maketrans("+/=", "-_ ")).strip())
             else:
-                files.append(f"{file.path}{file.name}")
-            files.remove(file)
+                keys.append(f"{file.path}{file.name}")
 
-        logger.debug(files)
+        logger.debug(keys)
         logger.debug(folders)
 
         if callbackProgress:
             callbackProgress("prepared", 0)
 
-        # remove folders separately.
+        # remove folders separately, as many in flight as the limiter allows.
         if folders:
-            for folder in folders:
-                logger.debug(f"removed folder {folder}")
-                response = self.session.post(
-                    url="/file/folderdelete.json",
-                    params={
-                        "bucket": self.name,
-                        "key": folder
-                    }
-                )
-                data = response.json()
-                logger.debug(response.request)
-                logger.debug(data)
-                if response.status_code != 200 or data.get("code") != 200:
-                    raise CliRequestError(response)
-
-                if callbackProgress:
-                    callbackProgress(folder, folders.index(folder) + 1 / (len(folders) + len(files)))
+            with ThreadPoolExecutor(max_workers=self.limiter.maximum) as executor:
+                futures = [executor.submit(WithJob(self._removeFolder), folder) for folder in folders]
+                for index, future in enumerate(as_completed(futures)):
+                    folder = future.result()
+                    logger.debug(f"removed folder {folder}")
+                    if callbackProgress:
+                        callbackProgress(folder, (index + 1) / (len(folders) + (1 if keys else 0)))
 
         # remove file in a time using an array.
-        if len(files) > 0:
-            response = self.session.post(
+        if len(keys) > 0:
+            response = self._post(
                 url="/file/delete.json",
                 params={
                     "bucket": self.name,
                 },
-                json=files
+                json=keys
             )
             data = response.json()
 
@@ -164,7 +316,22 @@ class Bucket:
                 raise CliRequestError(response)
 
             if callbackProgress:
-                callbackProgress(str(files), 1)
+                callbackProgress(str(keys), 1)
+
+    def _removeFolder(self, folder: str) -> str:
+        response = self._post(
+            url="/file/folderdelete.json",
+            params={
+                "bucket": self.name,
+                "key": folder
+            }
+        )
+        data = response.json()
+        logger.debug(response.request)
+        logger.debug(data)
+        if response.status_code != 200 or data.get("code") != 200:
+            raise CliRequestError(response)
+        return folder
 
     def move(self, src: str, dst: str) -> None:
         """
@@ -173,7 +340,9 @@ class Bucket:
         :param dst: destination file path
         :return: error raises if failed
         """
-        response = self.session.post(
+        # a move done but not answered would fail when sent again, or move what took the place of the source since
+        response = self._post(
+            idempotent=False,
             url="/file/move.json",
             params={
                 "src": base64.b64encode(f"{self.name}:{src}".encode()).decode(),
@@ -203,7 +372,7 @@ class Bucket:
         """
         fullPath = NormalizePath(fullPath)
 
-        response = self.session.post(
+        response = self._post(
             url="/upload/put.json",
             params={
                 "bucket": self.name,
@@ -216,13 +385,31 @@ class Bucket:
         if response.status_code != 200 or data.get("code") != 200:
             raise CliRequestError(response)
 
-    def setUploader(self, uploader: Uploader) -> bool:
+    def setUploader(self, uploader: Uploader, path="") -> bool:
         """
         Set an uploader for the bucket.
         :param uploader: uploader object
+        :param path: key prefix the credentials of the uploader are scoped to, the whole bucket if empty
         :return: false if failed
         """
         if not isinstance(uploader, Uploader):
             return False
         self.uploader = uploader
+        self.uploader.setLimiter(self.limiter)
+        self.uploader.setBandwidth(self.bandwidth)
+        self.uploader.prepare(self, path)
         return True
+
+    def _post(self, idempotent=True, **kwargs) -> requests.Response:
+        """
+        Post to the API within the limiter, requests failing transiently are sent again after waiting.
+        :param idempotent: false if sending it twice may do it twice, it's then only sent again if not processed
+        :param kwargs: arguments of httpx.Client.post
+        :return: response which is not a throttling or server error one
+        """
+        def send():
+            response = self.session.post(**kwargs)
+            RaiseForRetry(response)
+            return response
+
+        return self.limiter.run(send, idempotent=idempotent)
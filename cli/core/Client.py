@@ -0,0 +1,396 @@
+# -*- coding=utf-8
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .User import User
+from .File import File
+from .Bucket import Bucket
+from .Session import Session
+from .Upload import UploadJob, FanOutJob
+from .Copy import CopyJob, CopyScope
+from .Pull import PullJob
+from .Prune import PruneJob
+from .Bench import BenchJob
+from .Snapshot import Snapshot, SnapshotJob, DiffSnapshots
+from .Shard import ShardOf, WriteManifest
+from .Exception import CliException, CliKeyError
+from .utilities.PathUtils import NormalizePath, KeySplit
+from .utilities.BandwidthUtils import WithJob
+from .uploader.Registry import GetUploader, UPLOADERS
+
+logger = logging.getLogger(__name__)
+
+# config file the token and the transfer settings are kept in
+CONFIG_PATH = (Path.home() / ".peg.config.json").as_posix()
+
+
+class PegClient:
+    """
+    Library API of peg for embedding, the token, buckets, credentials and connections kept for its lifetime.
+    Use as a context manager, everything it opened is closed on exit.
+    """
+
+    def __init__(self, token: str, uploader="cos", transfer=None, session=None, bandwidth=None):
+        """
+        Initiate the client.
+        :param token: user token, as peg login keeps in the config file
+        :param uploader: backend name uploads go through unless given per call, auto for the fastest probed
+        :param transfer: dict of threads, partSize and threshold in bytes, the uploader's defaults if None
+        :param session: Session object to share, a new one of the token if None
+        :param bandwidth: BandwidthLimiter to share with other clients of the process, a new one if None
+        """
+        if not token:
+            raise CliKeyError({"data": "No token given, login first."})
+        self.session = session or Session(User(token), bandwidth=bandwidth)
+        self.uploaderName = uploader
+        self.transfer = dict(transfer or {})
+
+    @classmethod
+    def fromConfig(cls, path=None, **kwargs):
+        """
+        Client of the token and transfer settings in the config file peg login writes.
+        :param path: config file path, ~/.peg.config.json if None
+        :return: PegClient object
+        """
+        try:
+            with open(path or CONFIG_PATH, "r") as file:
+                config = json.load(file)
+        except (OSError, ValueError):
+            config = {}
+        return cls(config.get("token", None), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the connections and the part pools of the buckets used.
+        """
+        self.session.close()
+
+    def tune(self, initial=None, maximum=None, callbackDecision=None, retry=None) -> None:
+        """
+        Adjust the concurrency and retries of the requests from now on.
+        :param initial: in-flight requests allowed, kept if None
+        :param maximum: upper bound of in-flight requests, kept if None
+        :param callbackDecision: callback function called with (old, new, reason) when the limit changes
+        :param retry: RetryPolicy with the budget of the job, kept if None
+        """
+        self.session.limiter.tune(initial=initial, maximum=maximum, callbackDecision=callbackDecision, retry=retry)
+
+    def limitRate(self, rate=None, schedule=None) -> None:
+        """
+        Limit the bytes per second of every transfer of the client, jobs running at the same time share it fairly.
+        :param rate: bytes per second, no limit if None
+        :param schedule: list of tuple(first minute, end minute, bytes per second) of ParseSchedule, over rate in them
+        """
+        self.session.bandwidth.configure(rate, schedule)
+
+    def configure(self, threads=None, partSize=None, threshold=None) -> None:
+        """
+        Transfer settings of the uploaders, None keeps the current one.
+        :param threads: parts in flight at most, shared by all the files
+        :param partSize: bytes of a part of multipart uploads
+        :param threshold: bytes of files above which multipart upload is used
+        """
+        for key, value in (("threads", threads), ("partSize", partSize), ("threshold", threshold)):
+            if value is not None:
+                self.transfer[key] = value
+        for bucket in self.session.buckets():
+            if bucket.uploader is not None:
+                bucket.uploader.configure(**self.transfer)
+
+    def bucket(self, name: str) -> Bucket:
+        """
+        Bucket of the name, created once.
+        :param name: bucket name as same as ls shows
+        :return: Bucket object
+        """
+        return self.session.bucket(name)
+
+    def uploader(self, name: str, uploader=None, path="/") -> Bucket:
+        """
+        Bucket of the name with upload credentials, renewed when expiring, and the transfer settings.
+        :param name: bucket name as same as ls shows
+        :param uploader: backend name, the client's if None
+        :param path: path from the / of bucket the credentials are scoped to, the whole bucket if /
+        :return: Bucket object with uploader
+        """
+        bucket = self.session.uploader(name, GetUploader(uploader or self.uploaderName), path)
+        if self.transfer:
+            bucket.uploader.configure(**self.transfer)
+        return bucket
+
+    def uploadTree(self, local: str, bucket, path: str, progress=None, dedup=False, compression=None, uploader=None,
+                   workers=None, shard=None, shardMode="hash", manifest=None) -> dict:
+        """
+        Upload a file or a folder.
+        :param local: local file/folder path
+        :param bucket: bucket name, or list of them to upload to every one reading the files once
+        :param path: path from the / of bucket to where the FILE should located
+        :param progress: Progress object the transfers are reported to, nothing reported if None
+        :param dedup: skip files identical to the objects in the bucket, one bucket only
+        :param compression: Compression object, files it applies to are uploaded compressed
+        :param uploader: backend name, the client's if None
+        :param workers: files uploaded at the same time, the maximum concurrency if None
+        :param shard: tuple(i, N) to upload only the i-th of N disjoint shares of the files
+        :param shardMode: hash or size, how the shares are split
+        :param manifest: folder the completion manifest of the shard is written to
+        :return: dict of files scanned and counts uploaded and keys failed, per bucket under buckets if several
+        """
+        names = [bucket] if isinstance(bucket, str) else list(dict.fromkeys(bucket))
+        if len(names) > 1 and dedup:
+            raise CliKeyError({"data": "Uploading to several buckets doesn't support dedup."})
+        if not os.path.exists(local):
+            raise CliKeyError({"data": f"file {local} doesn't exist."})
+
+        targets = [self.uploader(name, uploader, path) for name in names]
+        if len(targets) > 1:
+            job = FanOutJob(targets, local, path, progress=progress, compression=compression)
+        else:
+            job = UploadJob(targets[0], local, path, progress=progress, dedup=dedup,
+                            workers=workers or self.session.limiter.maximum, compression=compression)
+        files = job.scan()
+        if not files:
+            return {"files": 0, "uploaded": 0, "failed": []}
+
+        if shard:
+            index, count = shard
+            entries = [(job.remoteKey(localPath, filename), size) for localPath, filename, size in files]
+            shards = ShardOf(entries, count, shardMode)
+            files = [entry for entry, (key, _) in zip(files, entries) if shards[key] == index]
+
+        result = job.run(files)
+        if len(targets) > 1:
+            result = {
+                "buckets": result,
+                "uploaded": min([counts["uploaded"] for counts in result.values()]),
+                "failed": sorted({key for counts in result.values() for key in counts["failed"]})
+            }
+        result["files"] = len(files)
+
+        if shard:
+            result["manifest"] = WriteManifest(
+                manifest or (Path.home() / ".peg" / "shards").as_posix(),
+                index,
+                count,
+                shardMode,
+                entries,
+                [(key, size) for key, size in entries if shards[key] == index and key not in result["failed"]],
+                result["failed"]
+            )
+        return result
+
+    def uploadStream(self, stream, bucket: str, key: str, progress=None, uploader=None) -> dict:
+        """
+        Upload a stream of unknown length, like stdin, as an object.
+        :param stream: binary file-like object
+        :param bucket: bucket name
+        :param key: key of the object from the / of bucket, with filename
+        :param progress: Progress object, nothing reported if None
+        :param uploader: backend name, the client's if None
+        :return: dict of counts uploaded, bytes, and keys failed
+        """
+        directory, name = KeySplit(key)
+        if not name or str(key).endswith("/"):
+            raise CliKeyError({"data": f"{key} has no filename."})
+        return UploadJob(self.uploader(bucket, uploader, directory), "-", directory,
+                         progress=progress).runStream(stream, name)
+
+    def iterList(self, bucket: str, path="/", recursive=False, workers=1):
+        """
+        List a directory page by page.
+        :param bucket: bucket name
+        :param path: directory from the / of bucket
+        :param recursive: list sub directories as well
+        :param workers: folders listed at the same time if recursive
+        :return: generator of File object
+        """
+        bucket = self.bucket(bucket)
+        if recursive:
+            return bucket.walk(path, workers=workers)
+        return bucket.iterate(NormalizePath(path))
+
+    def removeMany(self, bucket: str, keys: list, callbackProgress=None) -> int:
+        """
+        Remove files and folders, keys of folders ending with /.
+        :param bucket: bucket name
+        :param keys: keys from the / of bucket
+        :param callbackProgress: callback function called with (what was removed, fraction done)
+        :return: count of keys removed
+        """
+        files = []
+        for key in keys:
+            path, name = KeySplit(key)
+            name = NormalizePath(name) if str(key).endswith("/") else name
+            files.append(File(name=name, _type="folder" if name.endswith("/") else "file",
+                              path=NormalizePath(path).lstrip("/")))
+        if files:
+            self.bucket(bucket).remove(files, callbackProgress)
+        return len(files)
+
+    def moveMany(self, bucket: str, moves: list, workers=8, callbackResult=None) -> dict:
+        """
+        Move files concurrently.
+        :param bucket: bucket name
+        :param moves: list of tuple(source key, destination key), files only
+        :param workers: files moved at the same time
+        :param callbackResult: callback function called with (source key, destination key, error) per file
+        :return: dict of count moved and source keys failed
+        """
+        bucket = self.bucket(bucket)
+        moves = [(str(src).lstrip("/"), str(dst).lstrip("/")) for src, dst in moves]
+        for src, dst in moves:
+            if src.endswith("/") or dst.endswith("/"):
+                raise CliKeyError({"data": f"{src} -> {dst}, move files only."})
+        failed = []
+
+        def move(src: str, dst: str):
+            try:
+                bucket.move(src, dst)
+                error = None
+            except CliException as e:
+                failed.append(src)
+                error = e
+            if callbackResult:
+                callbackResult(src, dst, error)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(WithJob(move), src, dst) for src, dst in moves]:
+                future.result()
+        return {"moved": len(moves) - len(failed), "failed": failed}
+
+    def copy(self, bucket: str, src: str, dst: str, dstBucket=None, workers=16, callbackResult=None) -> dict:
+        """
+        Copy a key, or a prefix ending with /, server side within or across buckets.
+        :param bucket: bucket name copied from
+        :param src: key or prefix in the bucket
+        :param dst: key or prefix in the destination bucket
+        :param dstBucket: bucket name copied to, the same bucket if None
+        :param workers: objects copied at the same time
+        :param callbackResult: callback function called with (source key, destination key, size, error) per object
+        :return: dict of counts copied, bytes, and source keys failed
+        """
+        source = self.uploader(bucket, path=CopyScope(src))
+        destination = self.uploader(dstBucket or bucket, path=CopyScope(dst))
+        return CopyJob(source, destination, src, dst, workers=workers, callbackResult=callbackResult).run()
+
+    def pull(self, bucket: str, path: str, local: str, delete=False, workers=8, progress=None,
+             callbackResult=None) -> dict:
+        """
+        Mirror a path of a bucket to a local folder, downloading only what is missing or changed.
+        :param bucket: bucket name
+        :param path: path from the / of bucket
+        :param local: local folder
+        :param delete: remove local files whose objects are gone
+        :param workers: objects downloaded at the same time
+        :param progress: Progress object of the downloads, nothing reported if None
+        :param callbackResult: callback function called with (action, key, error) per object downloaded or deleted
+        :return: dict of counts downloaded, bytes, skipped, deleted, and keys failed
+        """
+        return PullJob(self.bucket(bucket), path, local, delete=delete, workers=workers, progress=progress,
+                       callbackResult=callbackResult).run()
+
+    def prune(self, bucket: str, path: str, olderThan=None, keepLatest=0, keepPer="dir", match=None, minSize=None,
+              maxSize=None, dryRun=False, workers=8, callbackResult=None) -> dict:
+        """
+        Remove the objects under a path older than a time, beyond the latest ones kept, in batches as they are listed.
+        :param bucket: bucket name
+        :param path: path from the / of bucket, pruned recursively
+        :param olderThan: epoch seconds, only objects modified before it are removed, any age if None
+        :param keepLatest: newest objects matched kept whatever their age
+        :param keepPer: dir to keep the latest of every directory, all of the whole path
+        :param match: list of globs on the filename, or on the key under the path if with /, all if None
+        :param minSize: objects smaller in bytes are left alone
+        :param maxSize: objects larger in bytes are left alone
+        :param dryRun: report the objects without removing them
+        :param workers: folders listed and delete requests sent at the same time
+        :param callbackResult: callback function called with (File, error) per object removed, or to be if dry run
+        :return: dict of counts matched, kept, deleted, bytes freed, and keys failed
+        """
+        return PruneJob(self.bucket(bucket), path, olderThan=olderThan, keepLatest=keepLatest, keepPer=keepPer,
+                        match=match, minSize=minSize, maxSize=maxSize, dryRun=dryRun, workers=workers,
+                        callbackResult=callbackResult).run()
+
+    def bench(self, bucket: str, backends=None, sizes=None, concurrencies=None, partSize=None, budget=None,
+              callbackResult=None) -> list:
+        """
+        Measure uploads of synthetic objects, listing and removing against a bucket, cleaned up afterwards.
+        The concurrency of the client is left at the last one measured.
+        :param bucket: bucket name
+        :param backends: uploader backend names, all the registered ones if None
+        :param sizes: bytes of the objects, BenchJob.SIZES if None
+        :param concurrencies: uploads in flight, BenchJob.CONCURRENCIES if None
+        :param partSize: bytes of a part of multipart uploads, the uploader's if None
+        :param budget: bytes uploaded by a combination of size and concurrency at most
+        :param callbackResult: callback function called with the result dict of each measure
+        :return: list of result dict with MBps, objectsPerSecond, p50 and p99 in milliseconds
+        """
+        return BenchJob(self, bucket, backends or list(UPLOADERS), sizes=sizes, concurrencies=concurrencies,
+                        partSize=partSize, budget=budget, callbackResult=callbackResult).run()
+
+    def snapshot(self, bucket: str, path: str, output: str, workers=8, callbackProgress=None) -> dict:
+        """
+        Write a sorted, compressed listing of the objects under a path, to diff against later.
+        :param bucket: bucket name
+        :param path: path from the / of bucket, listed recursively
+        :param output: file path of the snapshot
+        :param workers: folders listed at the same time
+        :param callbackProgress: callback function called with the objects listed so far
+        :return: dict of bucket, path, time, count and bytes of the snapshot
+        """
+        return SnapshotJob(self.bucket(bucket), path, output, workers=workers,
+                           callbackProgress=callbackProgress).run()
+
+    def diff(self, old: str, new=None, bucket=None, path=None, workers=8):
+        """
+        Changes from a snapshot to another, or to the bucket as it is now, in key order.
+        :param old: file path of the snapshot compared from
+        :param new: file path of the snapshot compared to, the bucket listed now if None
+        :param bucket: bucket name listed if new is None, the one of the old snapshot if None
+        :param path: path listed if new is None, the one of the old snapshot if None
+        :param workers: folders listed at the same time
+        :return: generator of dict like {"change": "added", "key", "size", "time", "hash"}, changed ones with "old"
+        """
+        with Snapshot(old) as before:
+            if new is not None:
+                with Snapshot(new) as after:
+                    yield from DiffSnapshots(before, after)
+                return
+
+            # the bucket is snapshot first, so both sides are joined in key order whatever order it's listed in
+            directory = tempfile.mkdtemp(prefix="peg-diff-")
+            try:
+                live = os.path.join(directory, "live.pegsnap")
+                self.snapshot(bucket or before.meta["bucket"], path or before.meta["path"], live, workers=workers)
+                with Snapshot(live) as after:
+                    yield from DiffSnapshots(before, after)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def mkdir(self, bucket: str, path: str) -> None:
+        """
+        Make a directory.
+        :param bucket: bucket name
+        :param path: path from the / of bucket
+        """
+        self.bucket(bucket).mkdir(str(path).strip("/").strip())
+
+    def link(self, bucket: str, key: str, isSecure=True) -> str:
+        """
+        URL of an object.
+        :param bucket: bucket name
+        :param key: key from the / of bucket
+        :param isSecure: https or http
+        """
+        path, name = KeySplit(key)
+        return self.bucket(bucket).link(File(name=name, path=NormalizePath(path).lstrip("/"), _type="file"),
+                                       isSecure)
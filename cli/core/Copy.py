@@ -0,0 +1,92 @@
+# -*- coding=utf-8
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .Bucket import Bucket
+from .Exception import CliKeyError
+from .utilities.PathUtils import NormalizePath, KeySplit
+from .utilities.BandwidthUtils import WithJob
+
+logger = logging.getLogger(__name__)
+
+
+def CopyScope(key: str) -> str:
+    """
+    Folder a key or a prefix of a copy is in, what the credentials of the copy are scoped to.
+    :param key: key, or prefix ending with /, from the / of bucket
+    :return: path from the / of bucket, empty for the whole bucket
+    """
+    key = str(key).lstrip("/")
+    return key if key == "" or key.endswith("/") else KeySplit(key)[0]
+
+
+class CopyJob:
+    """
+    Copy a key or a prefix server side, within a bucket or across buckets, objects copied concurrently.
+    """
+
+    def __init__(self, source: Bucket, destination: Bucket, src: str, dst: str, workers=16, callbackResult=None):
+        """
+        Initiate the job.
+        :param source: Bucket object copied from, with uploader set
+        :param destination: Bucket object copied to, with uploader set, the same object as source within a bucket
+        :param src: key, or prefix ending with / to copy everything under it, from the / of the source bucket
+        :param dst: key, or prefix ending with / to copy into, from the / of the destination bucket
+        :param workers: objects copied at the same time
+        :param callbackResult: callback function called with (source key, destination key, size, error) per object
+        """
+        self.source = source
+        self.destination = destination
+        self.src = str(src).lstrip("/")
+        self.dst = str(dst).lstrip("/")
+        self.workers = workers
+        self.callbackResult = callbackResult
+
+        self.failed = []
+
+    def plan(self) -> list:
+        """
+        Find the objects to copy.
+        :return: list of tuple(source key, destination key, size)
+        """
+        if self.src == "" or self.src.endswith("/"):
+            prefix = NormalizePath(self.src).lstrip("/")
+            target = NormalizePath(self.dst).lstrip("/")
+            return [(file.name, f"{target}{file.name[len(prefix):]}", file.fileSize)
+                    for file in self.source.walk(prefix or "/", workers=8) if file.type == "file"]
+
+        path, name = KeySplit(self.src)
+        size = next((file.fileSize for file in self.source.iterate(NormalizePath(path))
+                     if file.type == "file" and file.name == self.src), None)
+        if size is None:
+            raise CliKeyError({"data": f"{self.src} doesn't exist."})
+        return [(self.src, f"{self.dst}{name}" if self.dst == "" or self.dst.endswith("/") else self.dst, size)]
+
+    def run(self, entries=None) -> dict:
+        """
+        Copy the objects.
+        :param entries: list of tuple(source key, destination key, size), planned if None
+        :return: dict of counts copied, bytes, and source keys failed
+        """
+        entries = self.plan() if entries is None else entries
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(WithJob(self._copy), *entry) for entry in entries]:
+                future.result()
+
+        return {
+            "copied": len(entries) - len(self.failed),
+            "bytes": sum([size for key, _, size in entries if key not in self.failed]),
+            "failed": self.failed
+        }
+
+    def _copy(self, src: str, dst: str, size: int):
+        try:
+            self.destination.copy(src, dst, size, None if self.source is self.destination else self.source)
+        except Exception as e:
+            # whatever the SDK raises fails the object alone, the others are still copied
+            self.failed.append(src)
+            error = e
+        else:
+            error = None
+        if self.callbackResult:
+            self.callbackResult(src, dst, size, error)
@@ -0,0 +1,197 @@
+# -*- coding=utf-8
+import contextvars
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+from .Exception import CliKeyError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = (Path.home() / ".peg.sock").as_posix()
+
+
+def SocketPath() -> str:
+    """
+    Unix socket the daemon listens on, PEG_SOCKET or ~/.peg.sock.
+    """
+    return os.environ.get("PEG_SOCKET", DEFAULT_SOCKET)
+
+
+class ContextStream(io.TextIOBase):
+    """
+    Text stream writing to whatever the current context redirected it to, the original stream otherwise.
+    The context follows the functions bound with WithJob, so pool threads of a request write to its client too.
+    """
+
+    def __init__(self, original, name: str):
+        super(ContextStream, self).__init__()
+        self.original = original
+        self._target = contextvars.ContextVar(f"peg-{name}", default=None)
+
+    def redirect(self, target) -> None:
+        """
+        Redirect the writes of the current context.
+        :param target: text stream, None to write to the original again
+        """
+        self._target.set(target)
+
+    @property
+    def target(self):
+        return self._target.get() or self.original
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+    def isatty(self):
+        return self.target.isatty()
+
+    def writable(self):
+        return True
+
+    @property
+    def encoding(self):
+        return getattr(self.target, "encoding", "utf-8")
+
+
+class _ReplyStream(io.TextIOBase):
+    """
+    Writes of a forwarded command, sent back to the client as {"stream": "...", "data": "..."} lines.
+    """
+
+    def __init__(self, connection, name: str, lock: threading.Lock):
+        super(_ReplyStream, self).__init__()
+        self.connection = connection
+        self.name = name
+        self.lock = lock
+
+    def write(self, text):
+        if text:
+            with self.lock:
+                self.connection.sendall((json.dumps({"stream": self.name, "data": text}) + "\n").encode())
+        return len(text)
+
+    def isatty(self):
+        return False
+
+    def writable(self):
+        return True
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server running forwarded commands in its own warm process, a thread each.
+    """
+    daemon_threads = True
+
+    def __init__(self, socketPath: str, handler):
+        """
+        Initiate the server.
+        :param socketPath: path of the unix socket, replaced if stale, CliKeyError raises if a daemon is on it
+        :param handler: function called with (argv, cwd) in the thread of the request, returning exit code
+        """
+        self.socketPath = socketPath
+        self.handler = handler
+        if os.path.exists(socketPath):
+            # a socket answering belongs to a daemon still running, only a stale one is replaced
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socketPath)
+            except OSError:
+                os.remove(socketPath)
+            else:
+                raise CliKeyError({"socket": socketPath, "message": "a daemon is already serving on it"})
+            finally:
+                probe.close()
+
+        # only the user is allowed to talk to a daemon holding the credentials
+        umask = os.umask(0o177)
+        try:
+            super(DaemonServer, self).__init__(socketPath, _RequestHandler)
+        finally:
+            os.umask(umask)
+
+        self.stdout = ContextStream(sys.stdout, "stdout")
+        self.stderr = ContextStream(sys.stderr, "stderr")
+
+    def serve(self) -> None:
+        """
+        Serve until interrupted, stdout and stderr of the process are redirected per request meanwhile.
+        """
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        try:
+            self.serve_forever()
+        finally:
+            sys.stdout, sys.stderr = self.stdout.original, self.stderr.original
+            self.server_close()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        lock = threading.Lock()
+        self.server.stdout.redirect(_ReplyStream(self.connection, "stdout", lock))
+        self.server.stderr.redirect(_ReplyStream(self.connection, "stderr", lock))
+        try:
+            code = self.server.handler(request.get("argv", []), request.get("cwd", None))
+        except BaseException as e:
+            logger.exception(e)
+            code = 1
+        finally:
+            self.server.stdout.redirect(None)
+            self.server.stderr.redirect(None)
+        try:
+            with lock:
+                self.connection.sendall((json.dumps({"exit": code}) + "\n").encode())
+        except OSError:
+            pass
+
+
+def Forward(argv: list, socketPath=None):
+    """
+    Run a command in the daemon, its output written here as it comes.
+    :param argv: arguments of peg, paths in them already absolute
+    :param socketPath: path of the unix socket, SocketPath() if None
+    :return: exit code of the command, None if no daemon is there to run it
+    """
+    socketPath = socketPath or SocketPath()
+    if not os.path.exists(socketPath):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socketPath)
+    except OSError:
+        # stale socket of a daemon gone
+        connection.close()
+        return None
+
+    with connection:
+        connection.sendall((json.dumps({"argv": argv, "cwd": os.getcwd()}) + "\n").encode())
+        for line in connection.makefile("r", encoding="utf-8"):
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if message.get("stream") == "stdout" else sys.stderr
+            stream.write(message.get("data", ""))
+            stream.flush()
+    return 1
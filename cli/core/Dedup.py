@@ -0,0 +1,79 @@
+# -*- coding=utf-8
+import logging
+import os
+
+from .utilities.UploadUtils import FileMD5, MatchesHash
+
+logger = logging.getLogger(__name__)
+
+
+class DedupPlan:
+    """
+    What an upload job has to do after duplicates are found.
+    """
+
+    def __init__(self):
+        # keys to upload
+        self.uploads = []
+        # tuple(key, key of the identical object uploaded in the job) to copy server side
+        self.copies = []
+        # keys identical to the remote object already there
+        self.skipped = []
+
+
+def PlanDedup(entries: list, remote=None) -> DedupPlan:
+    """
+    Find files identical to the remote objects and duplicates within the job.
+    :param entries: list of tuple(key, local file path, size)
+    :param remote: dict of key -> tuple(size, hash) listed from the bucket, None to not compare
+    :return: DedupPlan object
+    """
+    plan = DedupPlan()
+    hashCache = {}
+
+    # identical to what is in the bucket, sizes compared first so only candidates are hashed
+    pending = []
+    for key, filePath, size in entries:
+        remoteSize, remoteHash = remote.get(key, (None, None)) if remote else (None, None)
+        if remoteSize == size and MatchesHash(filePath, size, remoteHash, hashCache):
+            plan.skipped.append(key)
+        else:
+            pending.append((key, filePath, size))
+
+    # hard links are the same file, no need to read them
+    sources = {}
+    bySize = {}
+    for key, filePath, size in pending:
+        stat = os.stat(filePath)
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in sources:
+            plan.copies.append((key, sources[inode]))
+            continue
+        sources[inode] = key
+        bySize.setdefault(size, []).append((key, filePath))
+
+    # same size is the only case content could be the same, empty files are not worth a copy
+    for size, group in bySize.items():
+        if len(group) == 1 or size == 0:
+            plan.uploads += [key for key, _ in group]
+            continue
+        byHash = {}
+        for key, filePath in group:
+            if (filePath, 0) not in hashCache:
+                hashCache[(filePath, 0)] = FileMD5(filePath)
+            digest = hashCache[(filePath, 0)]
+            if digest in byHash:
+                plan.copies.append((key, byHash[digest]))
+            else:
+                byHash[digest] = key
+                plan.uploads.append(key)
+
+    # a copy can only be made from an object uploaded in the job, not from another copy
+    copyOf = dict(plan.copies)
+    for index, (key, source) in enumerate(plan.copies):
+        while source in copyOf:
+            source = copyOf[source]
+        plan.copies[index] = (key, source)
+
+    logger.debug(f"Upload {len(plan.uploads)}, copy {len(plan.copies)}, skip {len(plan.skipped)}")
+    return plan
@@ -15,6 +15,25 @@ class CliRequestError(CliException):
         self.message = f"Status code: {response.status_code}\n{response.text}"
 
 
+class CliThrottledError(CliException):
+    def __init__(self, status: int, text: str, retryAfter=None):
+        self.status = status
+        self.retryAfter = retryAfter
+        self.message = f"Throttled with status code: {status}, retry after: {retryAfter}\n{text}"
+
+
+class CliServerError(CliException):
+    def __init__(self, status: int, text: str):
+        self.status = status
+        self.message = f"Server error with status code: {status}\n{text}"
+
+
+class CliRejectedError(CliException):
+    def __init__(self, status: int, text: str):
+        self.status = status
+        self.message = f"Rejected with status code: {status}\n{text}"
+
+
 class CliKeyError(CliException):
     def __init__(self, data: dict):
         self.message = str(data)
@@ -1,8 +1,124 @@
+import sys
+from array import array
+
+from .utilities.FormatUtils import ParseTime
+
+
 class File:
+    __slots__ = ("name", "hash", "fileSize", "time", "type", "path")
+
     def __init__(self, name: str, path: str, _type: str, _hash=None, fileSize=0, _time=None):
         self.name = name
         self.hash = _hash
-        self.fileSize = fileSize
-        self.time = _time
-        self.type = _type
-        self.path = path
+        # listings give fsize as a string and time as a string or epoch, kept as int to compare and sum
+        self.fileSize = int(fileSize or 0)
+        self.time = ParseTime(_time)
+        # a handful of distinct types and directories are shared by millions of entries
+        self.type = sys.intern(_type)
+        self.path = sys.intern(path)
+
+    def __repr__(self):
+        return f"File({self.path!r}, {self.name!r}, {self.type}, {self.fileSize})"
+
+
+class FileBatch:
+    """
+    Columnar listing result, sizes and times in arrays and keys joined in one buffer.
+    """
+    TYPES = ["file", "folder"]
+
+    def __init__(self, path="/"):
+        """
+        Initiate an empty batch.
+        :param path: directory the batch is listed from, shared by every entry
+        """
+        self.path = sys.intern(path)
+        self.sizes = array("q")
+        self.times = array("q")
+        self.types = array("b")
+        self._keys = bytearray()
+        self._keyEnds = array("q")
+        self._hashes = bytearray()
+        self._hashEnds = array("q")
+
+    @classmethod
+    def FromFiles(cls, files, path="/"):
+        """
+        Collect File objects into a batch, the iterable is consumed lazily.
+        :param files: iterable of File object, such as Bucket.walk
+        :param path: directory the batch is listed from
+        :return: FileBatch object
+        """
+        batch = cls(path)
+        for file in files:
+            batch.append(file.name, file.hash, file.fileSize, file.time, file.type)
+        return batch
+
+    def append(self, key: str, _hash: str, fileSize: int, _time: int, _type: str) -> None:
+        """
+        Append an entry.
+        :param key: key of the entry from the root of the bucket
+        :param _hash: hash of the entry
+        :param fileSize: size in bytes
+        :param _time: epoch seconds
+        :param _type: "file" or "folder"
+        """
+        self._keys += key.encode()
+        self._keyEnds.append(len(self._keys))
+        self._hashes += (_hash or "").encode()
+        self._hashEnds.append(len(self._hashes))
+        self.sizes.append(int(fileSize or 0))
+        self.times.append(int(_time or 0))
+        self.types.append(self.TYPES.index(_type) if _type in self.TYPES else 0)
+
+    def __len__(self):
+        return len(self._keyEnds)
+
+    def key(self, index: int) -> str:
+        return self._keys[self._keyEnds[index - 1] if index else 0:self._keyEnds[index]].decode()
+
+    def hash(self, index: int) -> str:
+        return self._hashes[self._hashEnds[index - 1] if index else 0:self._hashEnds[index]].decode()
+
+    def type(self, index: int) -> str:
+        return self.TYPES[self.types[index]]
+
+    def __getitem__(self, index: int) -> File:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return File(name=self.key(index), _hash=self.hash(index), fileSize=self.sizes[index],
+                    _time=self.times[index], _type=self.type(index), path=self.path)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def select(self, minSize=None, maxSize=None, newer=None, older=None, _type=None) -> list:
+        """
+        Indices of entries matching, only the columns are scanned.
+        :param minSize: lower bound of size in bytes, inclusive
+        :param maxSize: upper bound of size in bytes, inclusive
+        :param newer: lower bound of time in epoch seconds, inclusive
+        :param older: upper bound of time in epoch seconds, exclusive
+        :param _type: "file" or "folder", None for both
+        :return: list of indices
+        """
+        code = self.TYPES.index(_type) if _type is not None else None
+        return [index for index in range(len(self))
+                if (minSize is None or self.sizes[index] >= minSize)
+                and (maxSize is None or self.sizes[index] <= maxSize)
+                and (newer is None or self.times[index] >= newer)
+                and (older is None or self.times[index] < older)
+                and (code is None or self.types[index] == code)]
+
+    def totalSize(self, indices=None) -> int:
+        """
+        Sum of sizes of the entries.
+        :param indices: indices to sum, all entries if None
+        :return: bytes
+        """
+        if indices is None:
+            return sum(self.sizes)
+        return sum(self.sizes[index] for index in indices)
@@ -0,0 +1,172 @@
+# -*- coding=utf-8
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from .Bucket import Bucket
+from .File import File
+from .utilities.PathUtils import NormalizePath
+from .utilities.FormatUtils import ParseTime
+
+logger = logging.getLogger(__name__)
+
+
+class BucketIndex:
+    """
+    Local SQLite mirror of a bucket listing, for queries without listing the bucket again.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        key TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        hash TEXT,
+        fsize INTEGER NOT NULL DEFAULT 0,
+        time INTEGER NOT NULL DEFAULT 0,
+        type TEXT NOT NULL,
+        generation INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS files_fsize ON files (fsize);
+    CREATE INDEX IF NOT EXISTS files_time ON files (time);
+    CREATE TABLE IF NOT EXISTS prefixes (
+        prefix TEXT PRIMARY KEY,
+        refreshed INTEGER NOT NULL,
+        count INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, bucket: str, database=None):
+        """
+        Open the index of a bucket, created if not exists.
+        :param bucket: bucket name
+        :param database: path of the SQLite database, ~/.peg/index/BUCKET.sqlite3 if None
+        """
+        self.bucket = bucket
+        self.database = database or (Path.home() / ".peg" / "index" / f"{bucket}.sqlite3").as_posix()
+        os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+
+        self._connection = sqlite3.connect(self.database)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def refresh(self, bucket: Bucket, prefix="/", callbackProgress=None, workers=8) -> tuple:
+        """
+        Mirror the listing under the prefix, entries no longer listed are dropped.
+        :param bucket: Bucket object to list
+        :param prefix: directory to refresh, "/" for the whole bucket
+        :param callbackProgress: callback function called with the count of entries indexed so far
+        :param workers: folders listed at the same time
+        :return: tuple(entries indexed, entries dropped)
+        """
+        prefix = _Prefix(prefix)
+        generation = time.time_ns()
+
+        count = 0
+        batch = []
+        for file in bucket.walk(prefix or "/", workers=workers):
+            batch.append(self._row(file, generation))
+            if len(batch) >= 5000:
+                count += self._upsert(batch)
+                batch = []
+                if callbackProgress:
+                    callbackProgress(count)
+        count += self._upsert(batch)
+        if callbackProgress:
+            callbackProgress(count)
+
+        # whatever under the prefix not seen in this walk has been removed remotely
+        with self._connection:
+            dropped = self._connection.execute(
+                "DELETE FROM files WHERE key > ? AND key < ? AND generation != ?",
+                (prefix, prefix + "\U0010ffff", generation)
+            ).rowcount
+            self._connection.execute(
+                "INSERT OR REPLACE INTO prefixes (prefix, refreshed, count) VALUES (?, ?, ?)",
+                (prefix, round(time.time()), count)
+            )
+        logger.debug(f"Indexed {count} entries under {prefix!r}, dropped {dropped}")
+        return count, dropped
+
+    def build(self, bucket: Bucket, callbackProgress=None, workers=8) -> tuple:
+        """
+        Mirror the whole bucket from scratch.
+        :param bucket: Bucket object to list
+        :param callbackProgress: callback function called with the count of entries indexed so far
+        :param workers: folders listed at the same time
+        :return: tuple(entries indexed, entries dropped)
+        """
+        with self._connection:
+            self._connection.execute("DELETE FROM files")
+            self._connection.execute("DELETE FROM prefixes")
+        return self.refresh(bucket, "/", callbackProgress, workers)
+
+    def find(self, prefix="/", pattern=None, minSize=None, maxSize=None, newer=None, older=None, _type="file",
+             limit=None):
+        """
+        Query the index.
+        :param prefix: directory the keys are under
+        :param pattern: glob the filename should match, as *.png
+        :param minSize: lower bound of fsize in bytes, inclusive
+        :param maxSize: upper bound of fsize in bytes, inclusive
+        :param newer: lower bound of time in epoch seconds, inclusive
+        :param older: upper bound of time in epoch seconds, exclusive
+        :param _type: "file", "folder", or None for both
+        :param limit: quantity of results at most
+        :return: generator of File object
+        """
+        prefix = _Prefix(prefix)
+        conditions = ["key >= ?", "key < ?"]
+        params = [prefix, prefix + "\U0010ffff"]
+        for condition, value in [("name GLOB ?", pattern), ("fsize >= ?", minSize), ("fsize <= ?", maxSize),
+                                 ("time >= ?", newer), ("time < ?", older), ("type = ?", _type)]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        sql = f"SELECT key, hash, fsize, time, type FROM files WHERE {' AND '.join(conditions)} ORDER BY key"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        logger.debug(f"{sql} {params}")
+
+        for key, _hash, fsize, _time, _type in self._connection.execute(sql, params):
+            yield File(name=key, _hash=_hash, fileSize=fsize, _time=_time, _type=_type, path=prefix)
+
+    def prefixes(self) -> list:
+        """
+        Prefixes refreshed so far.
+        :return: list of tuple(prefix, refreshed epoch seconds, count)
+        """
+        return self._connection.execute("SELECT prefix, refreshed, count FROM prefixes ORDER BY prefix").fetchall()
+
+    def _upsert(self, rows: list) -> int:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files (key, name, hash, fsize, time, type, generation) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    @staticmethod
+    def _row(file: File, generation: int) -> tuple:
+        key = file.name.lstrip("/")
+        return (key, key.rstrip("/").rpartition("/")[2], file.hash, int(file.fileSize or 0), ParseTime(file.time),
+                file.type, generation)
+
+
+def _Prefix(prefix: str) -> str:
+    """
+    Keys under the root have no leading "/", nor does the prefix.
+    """
+    prefix = NormalizePath(prefix)
+    return "" if prefix == "/" else prefix
@@ -0,0 +1,149 @@
+# -*- coding=utf-8
+import fnmatch
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx as requests
+
+from .Bucket import Bucket
+from .File import File
+from .Exception import CliException
+from .utilities.PathUtils import NormalizePath
+from .utilities.BandwidthUtils import WithJob
+
+logger = logging.getLogger(__name__)
+
+# what --keep-latest counts in, every directory or the whole path
+KEEP_SCOPES = ("dir", "all")
+
+
+class PruneJob:
+    """
+    Expire objects under a path by age, size and pattern, keeping the latest ones, as the listing streams in.
+    """
+
+    # keys removed by a delete.json request
+    BATCH_SIZE = 1000
+
+    def __init__(self, bucket: Bucket, path: str, olderThan=None, keepLatest=0, keepPer="dir", match=None,
+                 minSize=None, maxSize=None, dryRun=False, workers=8, batchSize=None, callbackResult=None):
+        """
+        Initiate the job.
+        :param bucket: Bucket object to prune
+        :param path: path from the / of bucket to prune under, recursively
+        :param olderThan: epoch seconds, only objects modified before it are removed, any age if None
+        :param keepLatest: newest objects matched kept whatever their age, in every directory or the whole path
+        :param keepPer: dir to keep the latest of every directory, all to keep the latest of the whole path
+        :param match: list of globs like *.zip on the filename, or on the key under the path if with /, all if None
+        :param minSize: objects smaller are left alone, bytes
+        :param maxSize: objects larger are left alone, bytes
+        :param dryRun: report what would be removed without removing it
+        :param workers: folders listed and delete requests sent at the same time
+        :param batchSize: keys of a delete request, BATCH_SIZE if None
+        :param callbackResult: callback function called with (File, error) for every object removed or to be
+        """
+        if keepPer not in KEEP_SCOPES:
+            raise ValueError(f"keep scope {keepPer} is not one of {', '.join(KEEP_SCOPES)}")
+        self.bucket = bucket
+        self.path = NormalizePath(path)
+        self.base = "" if self.path == "/" else self.path
+        self.olderThan = olderThan
+        self.keepLatest = max(0, keepLatest)
+        self.keepPer = keepPer
+        self.match = list(match or [])
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.dryRun = dryRun
+        self.workers = max(1, workers)
+        self.batchSize = max(1, batchSize or self.BATCH_SIZE)
+        self.callbackResult = callbackResult
+
+        self.matched = 0
+        self.deleted = 0
+        self.bytes = 0
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def run(self) -> dict:
+        """
+        Stream the listing, remove the candidates in batches as they are found.
+        :return: dict of counts matched, kept, deleted, bytes freed, and keys failed
+        """
+        # newest matched of every scope, a min-heap of (time, key, File) holding keepLatest at most
+        latest = {}
+        batch = []
+        # batches built but not sent yet are bounded, the listing waits for the deletes
+        pending = threading.BoundedSemaphore(self.workers * 2)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="peg-prune") as executor:
+            def flush():
+                pending.acquire()
+                executor.submit(WithJob(self._remove), list(batch), pending)
+                batch.clear()
+
+            for file in self.bucket.walk(self.path, workers=self.workers):
+                if file.type != "file" or file.name.endswith("/") or not self.matches(file):
+                    continue
+                self.matched += 1
+
+                candidate = file
+                if self.keepLatest:
+                    scope = file.name.rsplit("/", 1)[0] if self.keepPer == "dir" and "/" in file.name else ""
+                    heap = latest.setdefault(scope, [])
+                    if len(heap) < self.keepLatest:
+                        heapq.heappush(heap, (file.time, file.name, file))
+                        continue
+                    # the oldest of the ones kept so far gives way to a newer one
+                    candidate = heapq.heappushpop(heap, (file.time, file.name, file))[2]
+
+                if self.olderThan is not None and candidate.time >= self.olderThan:
+                    continue
+                batch.append(candidate)
+                if len(batch) >= self.batchSize:
+                    flush()
+            if batch:
+                flush()
+
+        return {
+            "matched": self.matched,
+            "kept": self.matched - self.deleted - len(self.failed),
+            "deleted": self.deleted,
+            "bytes": self.bytes,
+            "failed": self.failed
+        }
+
+    def matches(self, file: File) -> bool:
+        """
+        Whether an object is subject to pruning, by its pattern and size.
+        """
+        if self.minSize is not None and file.fileSize < self.minSize:
+            return False
+        if self.maxSize is not None and file.fileSize > self.maxSize:
+            return False
+        if not self.match:
+            return True
+        relative = file.name[len(self.base):] if file.name.startswith(self.base) else file.name
+        filename = relative.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatchcase(relative if "/" in pattern else filename, pattern) for pattern in self.match)
+
+    def _remove(self, files: list, pending: threading.BoundedSemaphore):
+        try:
+            error = None
+            if not self.dryRun:
+                try:
+                    self.bucket.remove([File(name=file.name, path="", _type="file") for file in files])
+                except (CliException, requests.TransportError) as e:
+                    logger.debug(f"Failed to remove a batch of {len(files)}, {e}")
+                    error = e
+            with self._lock:
+                if error is None:
+                    self.deleted += len(files)
+                    self.bytes += sum([file.fileSize for file in files])
+                else:
+                    self.failed += [file.name for file in files]
+            if self.callbackResult:
+                for file in files:
+                    self.callbackResult(file, error)
+        finally:
+            pending.release()
@@ -0,0 +1,277 @@
+# -*- coding=utf-8
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx as requests
+
+from .Bucket import Bucket
+from .File import File
+from .Exception import CliException, CliRequestError, CliKeyError
+from .utilities.BandwidthUtils import WithJob
+from .utilities.ConcurrencyUtils import RaiseForRetry
+from .utilities.PathUtils import NormalizePath
+from .utilities.ProgressUtils import Progress
+from .utilities.UploadUtils import MatchesHash
+
+logger = logging.getLogger(__name__)
+
+
+class PullJob:
+    """
+    Mirror a bucket path to a local folder, only objects missing or changed locally are downloaded.
+    """
+
+    # objects above it are downloaded as ranges of PART_SIZE concurrently
+    RANGE_THRESHOLD = 16 * 1024 * 1024
+    PART_SIZE = 8 * 1024 * 1024
+    # suffix of files being downloaded, renamed to the file once complete
+    PARTIAL_SUFFIX = ".peg-part"
+
+    def __init__(self, bucket: Bucket, path: str, local: str, delete=False, workers=8, cache=None, isSecure=True,
+                 progress=None, callbackResult=None):
+        """
+        Initiate the job.
+        :param bucket: Bucket object to pull from
+        :param path: path from the / of bucket to mirror
+        :param local: local folder the path is mirrored to
+        :param delete: remove local files whose objects are not in the bucket any more
+        :param workers: objects compared and downloaded at the same time
+        :param cache: file of sizes, modified times and hashes of the local files, one under ~/.peg/pull/ if None
+        :param isSecure: download with https or http
+        :param progress: Progress object of the downloads, nothing rendered if None
+        :param callbackResult: callback function called with (action, key, error) for every object downloaded or
+        local file deleted
+        """
+        self.bucket = bucket
+        self.path = NormalizePath(path)
+        self.base = "" if self.path == "/" else self.path
+        self.root = os.path.abspath(local)
+        self.delete = delete
+        self.workers = workers
+        self.isSecure = isSecure
+        self.progress = progress or Progress()
+        self.callbackResult = callbackResult
+
+        digest = hashlib.sha1(f"{self.root}\n{bucket.name}\n{self.path}".encode()).hexdigest()[:16]
+        self.cache = cache or (Path.home() / ".peg" / "pull" / f"{digest}.json").as_posix()
+        # path relative to the root -> [size, modified time in ns, hash of the object]
+        self.known = self._load()
+
+        self.downloaded = []
+        self.skipped = 0
+        self.deleted = []
+        self.failed = []
+        self._lock = threading.Lock()
+        self._hashCache = {}
+        self._client = requests.Client(timeout=60, follow_redirects=True)
+        self._ranges = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="peg-range")
+
+    def run(self) -> dict:
+        """
+        Stream the remote listing, download what differs, and remove what is gone if asked.
+        :return: dict of counts downloaded, bytes, skipped, deleted, and keys failed
+        """
+        remote = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = []
+                for file in self.bucket.walk(self.path, workers=8):
+                    if file.type != "file" or file.name.endswith("/"):
+                        continue
+                    relative = file.name[len(self.base):]
+                    remote.add(relative)
+                    futures.append(executor.submit(WithJob(self._sync), file, relative))
+                for future in futures:
+                    future.result()
+
+            # only once the listing completed, a partial one would remove what is still there
+            if self.delete:
+                self._prune(remote)
+        finally:
+            self._ranges.shutdown()
+            self._client.close()
+            self._save()
+            self.progress.close()
+
+        return {
+            "downloaded": len(self.downloaded),
+            "bytes": sum(self.downloaded),
+            "skipped": self.skipped,
+            "deleted": len(self.deleted),
+            "failed": self.failed
+        }
+
+    def localPath(self, relative: str) -> str:
+        """
+        Local path of an object, CliKeyError raises if the key points outside the root.
+        :param relative: key relative to the path mirrored
+        """
+        local = os.path.normpath(os.path.join(self.root, *relative.split("/")))
+        if not local.startswith(self.root + os.sep):
+            raise CliKeyError({"data": f"{relative} points outside {self.root}"})
+        return local
+
+    def _sync(self, file: File, relative: str):
+        try:
+            local = self.localPath(relative)
+            if self._matches(file, relative, local):
+                with self._lock:
+                    self.skipped += 1
+                return
+        except CliException as e:
+            self._result("download", file.name, e)
+            return
+
+        with self._lock:
+            self.progress.totalFiles += 1
+            self.progress.totalBytes += file.fileSize
+        self.progress.start(file.name, file.fileSize)
+        try:
+            self._download(file, relative, local)
+        except (CliException, OSError, requests.HTTPError, requests.TransportError) as e:
+            self.progress.finish(file.name, error=e)
+            self._result("download", file.name, e)
+            return
+        self.progress.finish(file.name)
+        with self._lock:
+            self.downloaded.append(file.fileSize)
+        self._result("download", file.name)
+
+    def _matches(self, file: File, relative: str, local: str) -> bool:
+        """
+        Whether the local file has the content of the object, hashed only if the cache can't tell.
+        """
+        try:
+            stat = os.stat(local)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != file.fileSize:
+            return False
+        with self._lock:
+            known = self.known.get(relative, None)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2] == file.hash
+        if not MatchesHash(local, stat.st_size, file.hash, self._hashCache):
+            return False
+        with self._lock:
+            self.known[relative] = [stat.st_size, stat.st_mtime_ns, file.hash]
+        return True
+
+    def _download(self, file: File, relative: str, local: str):
+        url = f"{'https' if self.isSecure else 'http'}://{self.bucket.domain}/{urllib.parse.quote(file.name)}"
+        partial = f"{local}{self.PARTIAL_SUFFIX}"
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+
+        if file.fileSize <= self.RANGE_THRESHOLD:
+            _, content = self._get(url, size=file.fileSize)
+            if len(content) != file.fileSize:
+                raise CliKeyError({"data": f"{file.name} got {len(content)} bytes of {file.fileSize}"})
+            with open(partial, "wb") as output:
+                output.write(content)
+            self.progress.update(file.name, len(content))
+        else:
+            done = [0]
+            writing = threading.Lock()
+            with open(partial, "wb") as output:
+                output.truncate(file.fileSize)
+
+                @WithJob
+                def fetch(first: int, last: int):
+                    response, content = self._get(url, {"range": f"bytes={first}-{last}"}, size=last - first + 1)
+                    if response.status_code != 206 or len(content) != last - first + 1:
+                        raise CliKeyError({"data": f"{file.name} got {len(content)} bytes of {first}-{last}, "
+                                                   f"status code {response.status_code}"})
+                    with writing:
+                        output.seek(first)
+                        output.write(content)
+                    with self._lock:
+                        done[0] += len(content)
+                        self.progress.update(file.name, done[0])
+
+                futures = [self._ranges.submit(fetch, start, min(start + self.PART_SIZE, file.fileSize) - 1)
+                           for start in range(0, file.fileSize, self.PART_SIZE)]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        # the modified time of the object, so the file looks as old as it is
+        if file.time:
+            os.utime(partial, (file.time, file.time))
+        os.replace(partial, local)
+        stat = os.stat(local)
+        with self._lock:
+            self.known[relative] = [stat.st_size, stat.st_mtime_ns, file.hash]
+
+    def _get(self, url: str, headers=None, size=0) -> tuple:
+        """
+        GET within the limiter once the bandwidth allows the bytes expected, sent again if failing transiently.
+        The body is read as stored, objects uploaded with --compress aren't decoded, so their sizes, ranges and hashes
+        are the ones of the listing and the file mirrors the object byte for byte.
+        :return: tuple(response, bytes of the body)
+        """
+        def send():
+            request = self._client.build_request("GET", url, headers={**(headers or {}), "accept-encoding": "identity"})
+            response = self._client.send(request, stream=True)
+            try:
+                if response.status_code not in (200, 206):
+                    response.read()
+                    RaiseForRetry(response)
+                    raise CliRequestError(response)
+                return response, b"".join(response.iter_raw())
+            finally:
+                response.close()
+
+        self.bucket.bandwidth.consume(size)
+        return self.bucket.limiter.run(send)
+
+    def _prune(self, remote: set):
+        """
+        Remove local files not in the listing, files being downloaded left alone.
+        """
+        for current, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(current, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if relative in remote or name.endswith(self.PARTIAL_SUFFIX):
+                    continue
+                try:
+                    os.remove(path)
+                    self.deleted.append(relative)
+                    self._result("delete", f"{self.base}{relative}")
+                except OSError as e:
+                    self._result("delete", f"{self.base}{relative}", e)
+        self.known = {relative: known for relative, known in self.known.items() if relative in remote}
+
+    def _result(self, action: str, key: str, error=None):
+        if error is not None:
+            with self._lock:
+                self.failed.append(key)
+        if self.callbackResult:
+            self.callbackResult(action, key, error)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache, "r") as file:
+                return json.load(file).get("files", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        """
+        Write the cache atomically, a crash never leaves it half written.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache)), exist_ok=True)
+        temporary = f"{self.cache}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({"root": self.root, "bucket": self.bucket.name, "path": self.path, "files": self.known}, file)
+        os.replace(temporary, self.cache)
@@ -0,0 +1,121 @@
+# -*- coding=utf-8
+import logging
+import os
+import threading
+import time
+
+from .User import User
+from .Bucket import Bucket
+from .uploader.CosUploader import CosUploader
+from .utilities.ConcurrencyUtils import AdaptiveLimiter
+from .utilities.BandwidthUtils import BandwidthLimiter
+from .utilities.PathUtils import NormalizePath
+from .Exception import CliRequestError
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    Token, buckets and upload credentials shared by every operation of a process.
+    """
+
+    # upload credentials are asked for this long, and renewed when less than the margin left
+    CREDENTIAL_LIFETIME = 10000
+    CREDENTIAL_MARGIN = 600
+
+    def __init__(self, user: User, limiter=None, bandwidth=None):
+        """
+        Initiate a session.
+        :param user: User object with token in it
+        :param limiter: AdaptiveLimiter shared by all the buckets, a new one if None
+        :param bandwidth: BandwidthLimiter of all the transfers, shareable with other sessions, a new one if None
+        """
+        self.user = user
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        self.bandwidth = bandwidth if bandwidth is not None else BandwidthLimiter()
+
+        self._buckets = {}
+        self._deadlines = {}
+        self._scopes = {}
+        self._lock = threading.Lock()
+        self._bucketLocks = {}
+
+    def bucket(self, name: str) -> Bucket:
+        """
+        Bucket of the name, created once and shared afterwards.
+        :param name: bucket name as same as ls shows
+        :return: Bucket object
+        """
+        with self._lock:
+            lock = self._bucketLocks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._buckets:
+                self._buckets[name] = Bucket(name, self.user, limiter=self.limiter, bandwidth=self.bandwidth)
+            return self._buckets[name]
+
+    def buckets(self) -> list:
+        """
+        Buckets created so far.
+        :return: list of Bucket object
+        """
+        with self._lock:
+            return list(self._buckets.values())
+
+    def close(self) -> None:
+        """
+        Close the connections of the buckets and the pools of their uploaders.
+        """
+        for bucket in self.buckets():
+            if bucket.uploader is not None:
+                bucket.uploader.close()
+            bucket.session.close()
+
+    def uploader(self, name: str, uploaderClass=CosUploader, path="/") -> Bucket:
+        """
+        Bucket of the name with an uploader set, upload credentials are asked for once and renewed when expiring.
+        Credentials are scoped to the path, widened to the prefix shared with the paths asked for before in the session,
+        as the uploader of a bucket is shared by the jobs using it.
+        :param name: bucket name as same as ls shows
+        :param uploaderClass: Uploader class to upload with
+        :param path: path from the / of bucket uploaded and copied under, the whole bucket if /
+        :return: Bucket object with uploader
+        """
+        prefix = NormalizePath(path).lstrip("/")
+        bucket = self.bucket(name)
+        with self._bucketLocks[name]:
+            deadline = self._deadlines.get((name, uploaderClass), 0)
+            scope = self._scopes.get(name, None)
+            if time.time() < deadline - self.CREDENTIAL_MARGIN and isinstance(bucket.uploader, uploaderClass) \
+                    and prefix.startswith(scope):
+                return bucket
+            if scope is not None:
+                prefix = os.path.commonprefix([scope, prefix])
+
+            deadline = round(time.time()) + self.CREDENTIAL_LIFETIME
+            response = bucket._post(
+                url="/upload/auth.json",
+                json={
+                    "scope": f"{bucket.name}:{prefix}*",
+                    "deadline": deadline
+                }
+            )
+            data = response.json()
+            logger.debug(response.request)
+            logger.debug(data)
+            if response.status_code != 200 or data.get("code", 0) != 200:
+                raise CliRequestError(response)
+
+            sessionToken, accessKeyId, secretAccessKey, info = tuple(data["data"]["uploadToken"].split(":"))
+            previous = bucket.uploader
+            expiry = self._deadlines.get((name, type(previous)), 0) - time.time()
+            bucket.setUploader(uploaderClass(sessionToken, accessKeyId, secretAccessKey, info), prefix)
+            if previous is not None and previous is not bucket.uploader:
+                # files still uploading with the one replaced go on until its credentials run out, then its
+                # pools are shut down, a long-running process would keep their threads otherwise
+                closing = threading.Timer(max(expiry, 0), previous.close)
+                closing.daemon = True
+                closing.start()
+            self._deadlines[(name, uploaderClass)] = deadline
+            self._scopes[name] = prefix
+            return bucket
@@ -0,0 +1,148 @@
+# -*- coding=utf-8
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+
+from .Exception import CliKeyError
+
+logger = logging.getLogger(__name__)
+
+# ways a file set is split, by the hash of keys or balancing the bytes
+SHARD_MODES = ("hash", "size")
+
+
+def ParseShard(shard: str) -> tuple:
+    """
+    Parse a shard like 2/4, the second of four.
+    :param shard: string i/N with 1 <= i <= N
+    :return: tuple(i, N)
+    """
+    try:
+        index, count = (int(x) for x in str(shard).split("/"))
+    except ValueError:
+        raise ValueError(f"shard {shard} is not like i/N")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"shard {shard} is out of 1/{max(count, 1)}..{max(count, 1)}/{max(count, 1)}")
+    return index, count
+
+
+def SetDigest(entries: list) -> str:
+    """
+    Digest of a whole file set, the same on every host listing it.
+    :param entries: list of tuple(key, size)
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for key, size in sorted(entries):
+        digest.update(f"{key}\n{size}\n".encode())
+    return digest.hexdigest()
+
+
+def ShardOf(entries: list, count: int, mode="hash") -> dict:
+    """
+    Split a file set into shards deterministically, every host given the same set gets the same split.
+    :param entries: list of tuple(key, size)
+    :param count: shards in total
+    :param mode: hash to split by the hash of keys, size to balance the bytes of shards
+    :return: dict of key -> shard from 1
+    """
+    if mode == "hash":
+        return {key: int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) % count + 1 for key, _ in entries}
+    if mode != "size":
+        raise ValueError(f"shard mode {mode} is not one of {', '.join(SHARD_MODES)}")
+
+    # largest first to the lightest shard, ties by key so the order never depends on how files were listed
+    loads = [0] * count
+    shards = {}
+    for key, size in sorted(entries, key=lambda x: (-x[1], x[0])):
+        lightest = min(range(count), key=lambda x: (loads[x], x))
+        loads[lightest] += size
+        shards[key] = lightest + 1
+    return shards
+
+
+def ManifestPath(directory: str, digest: str, index: int, count: int) -> str:
+    # named by the set as well, the folder is shared by the uploads of every data set
+    return os.path.join(directory, f"shard-{digest[:16]}-{index}-of-{count}.json")
+
+
+def WriteManifest(directory: str, index: int, count: int, mode: str, entries: list, uploaded: list,
+                  failed: list) -> str:
+    """
+    Write the completion manifest of a shard atomically.
+    :param directory: folder of the manifests, shared by the hosts or collected afterwards
+    :param index: shard from 1
+    :param count: shards in total
+    :param mode: way the set was split
+    :param entries: list of tuple(key, size) of the whole set
+    :param uploaded: list of tuple(key, size) the shard uploaded
+    :param failed: keys of the shard failed
+    :return: path of the manifest
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = SetDigest(entries)
+    path = ManifestPath(directory, digest, index, count)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump({
+            "shard": index,
+            "count": count,
+            "mode": mode,
+            "set": digest,
+            "total": len(entries),
+            "files": dict(uploaded),
+            "failed": failed,
+            "time": round(time.time())
+        }, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    return path
+
+
+def MergeManifests(directory: str, remote=None) -> dict:
+    """
+    Confirm the shards of a set all arrived from their manifests.
+    :param directory: folder of the manifests
+    :param remote: set of keys listed from the bucket to check against, not checked if None
+    :return: dict of shards missing, keys failed, keys missing in the bucket, and counts of files and bytes
+    """
+    manifests = []
+    for path in sorted(glob.glob(os.path.join(directory, "shard-*-of-*.json"))):
+        try:
+            with open(path, "r") as file:
+                manifests.append(json.load(file))
+        except (OSError, ValueError) as e:
+            logger.debug(f"Failed to read {path}, {e}")
+    if not manifests:
+        raise CliKeyError({"data": f"No manifests in {directory}."})
+
+    # manifests of another split or another set are left from other runs
+    latest = max(manifests, key=lambda x: x.get("time", 0))
+    manifests = [x for x in manifests if x["count"] == latest["count"] and x["set"] == latest["set"]]
+    if len({x["mode"] for x in manifests}) > 1:
+        raise CliKeyError({"data": f"Manifests in {directory} were split in different modes."})
+
+    files = {}
+    failed = []
+    for manifest in manifests:
+        files.update(manifest["files"])
+        failed += manifest["failed"]
+    present = {x["shard"] for x in manifests}
+    missingShards = [x for x in range(1, latest["count"] + 1) if x not in present]
+    # sizes in the bucket differ from the local ones for files compressed, only keys are checked
+    missing = [key for key in files if remote is not None and key not in remote]
+
+    return {
+        "shards": latest["count"],
+        "missingShards": missingShards,
+        "failed": failed,
+        "missing": missing,
+        "files": len(files),
+        "total": latest["total"],
+        "bytes": sum(files.values()),
+        "complete": not missingShards and not failed and not missing and len(files) == latest["total"]
+    }
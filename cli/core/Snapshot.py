@@ -0,0 +1,302 @@
+# -*- coding=utf-8
+import bisect
+import heapq
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+from .Bucket import Bucket
+from .Exception import CliKeyError
+from .utilities.PathUtils import NormalizePath
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PEGSNAP1"
+# an entry is (bytes shared with the previous key, suffix length, size, time, hash length), then suffix and hash
+ENTRY = struct.Struct("<HHQqB")
+# footer length and magic closing the file, the footer is found from the end
+TRAILER = struct.Struct("<Q8s")
+
+
+class SnapshotWriter:
+    """
+    Write entries in key order into blocks compressed one by one, with an index of the blocks as the footer.
+    Keys in a block share their prefix with the previous one, a block decodes on its own.
+    """
+
+    # entries of a block, a block is what a reader holds decompressed at a time
+    BLOCK_ENTRIES = 4096
+
+    def __init__(self, path: str, meta=None):
+        """
+        Initiate the writer, the snapshot appears at path only once closed.
+        :param path: file path of the snapshot
+        :param meta: dict kept in the footer, like the bucket and path listed
+        """
+        self.path = path
+        self.meta = dict(meta or {})
+        self.count = 0
+        self.bytes = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._temporary = f"{path}.tmp"
+        self._file = open(self._temporary, "wb")
+        self._file.write(MAGIC)
+        self._blocks = []
+        self._block = bytearray()
+        self._blockCount = 0
+        self._blockFirst = None
+        self._previous = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, key: str, size: int, _time: int, _hash: str) -> None:
+        """
+        Append an entry, keys must come in ascending order, a key repeated is skipped.
+        :param key: object key from the root of the bucket
+        :param size: bytes of the object
+        :param _time: epoch seconds of the object
+        :param _hash: hash of the object, empty if unknown
+        """
+        encoded = key.encode()
+        if self._previous is not None and encoded <= self._previous:
+            if encoded == self._previous:
+                return
+            raise ValueError(f"{key} comes after {self._previous.decode()}, keys must be sorted")
+
+        shared = 0
+        if self._blockCount:
+            limit = min(len(encoded), len(self._previous), 0xFFFF)
+            while shared < limit and encoded[shared] == self._previous[shared]:
+                shared += 1
+        else:
+            self._blockFirst = key
+        hashed = (_hash or "").encode()[:0xFF]
+        self._block += ENTRY.pack(shared, len(encoded) - shared, int(size or 0), int(_time or 0), len(hashed))
+        self._block += encoded[shared:]
+        self._block += hashed
+
+        self._previous = encoded
+        self._blockCount += 1
+        self.count += 1
+        self.bytes += int(size or 0)
+        if self._blockCount >= self.BLOCK_ENTRIES:
+            self._flush()
+
+    def _flush(self):
+        if not self._blockCount:
+            return
+        data = zlib.compress(bytes(self._block))
+        self._blocks.append([self._file.tell(), len(data), self._blockCount, self._blockFirst])
+        self._file.write(data)
+        self._block = bytearray()
+        self._blockCount = 0
+
+    def close(self) -> None:
+        """
+        Write the last block and the footer, and move the snapshot in place.
+        """
+        self._flush()
+        footer = zlib.compress(json.dumps({
+            "meta": dict(self.meta, count=self.count, bytes=self.bytes),
+            "blocks": self._blocks
+        }).encode())
+        self._file.write(footer)
+        self._file.write(TRAILER.pack(len(footer), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._temporary, self.path)
+
+    def abort(self) -> None:
+        """
+        Drop what was written, no snapshot is left.
+        """
+        self._file.close()
+        if os.path.exists(self._temporary):
+            os.remove(self._temporary)
+
+
+class Snapshot:
+    """
+    Snapshot file memory-mapped, entries decoded a block at a time as they are iterated.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open a snapshot.
+        :param path: file path of the snapshot
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise CliKeyError({"snapshot": path, "message": "not a peg snapshot"})
+        try:
+            if len(self._map) < len(MAGIC) + TRAILER.size:
+                raise ValueError(len(self._map))
+            length, magic = TRAILER.unpack_from(self._map, len(self._map) - TRAILER.size)
+            if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+                raise ValueError(magic)
+            start = len(self._map) - TRAILER.size - length
+            footer = json.loads(zlib.decompress(self._map[start:start + length]))
+        except (struct.error, ValueError, zlib.error):
+            self.close()
+            raise CliKeyError({"snapshot": path, "message": "not a peg snapshot"})
+        self.meta = footer["meta"]
+        self.blocks = footer["blocks"]
+        self._firstKeys = [block[3] for block in self.blocks]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.meta.get("count", 0)
+
+    def __iter__(self):
+        return self.iterate()
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def iterate(self, prefix=""):
+        """
+        Entries in key order, from the block the prefix would be in.
+        :param prefix: only keys starting with it, all if empty
+        :return: generator of tuple(key, size, time, hash)
+        """
+        index = max(0, bisect.bisect_right(self._firstKeys, prefix) - 1) if prefix else 0
+        for offset, length, count, _ in self.blocks[index:]:
+            for entry in self._decode(offset, length, count):
+                if entry[0] < prefix:
+                    continue
+                if not entry[0].startswith(prefix):
+                    return
+                yield entry
+
+    def _decode(self, offset: int, length: int, count: int):
+        data = zlib.decompress(self._map[offset:offset + length])
+        position = 0
+        previous = b""
+        for _ in range(count):
+            shared, suffix, size, _time, hashed = ENTRY.unpack_from(data, position)
+            position += ENTRY.size
+            key = previous[:shared] + data[position:position + suffix]
+            position += suffix
+            _hash = data[position:position + hashed].decode()
+            position += hashed
+            previous = key
+            yield key.decode(), size, _time, _hash
+
+
+class SnapshotJob:
+    """
+    Snapshot the objects under a path of a bucket, sorted in runs spilled to disk so millions of keys fit.
+    """
+
+    # entries sorted in memory at a time, more are sorted in runs merged afterwards
+    RUN_SIZE = 200000
+
+    def __init__(self, bucket: Bucket, path: str, output: str, workers=8, runSize=None, callbackProgress=None):
+        """
+        Initiate the job.
+        :param bucket: Bucket object to list
+        :param path: path from the / of bucket to snapshot, recursively
+        :param output: file path the snapshot is written to
+        :param workers: folders listed at the same time
+        :param runSize: entries sorted in memory at a time, RUN_SIZE if None
+        :param callbackProgress: callback function called with the objects listed so far
+        """
+        self.bucket = bucket
+        self.path = NormalizePath(path)
+        self.output = output
+        self.workers = max(1, workers)
+        self.runSize = max(1, runSize or self.RUN_SIZE)
+        self.callbackProgress = callbackProgress
+
+    def run(self) -> dict:
+        """
+        List, sort and write the snapshot.
+        :return: dict of the meta of the snapshot, with count and bytes
+        """
+        meta = {"bucket": self.bucket.name, "path": self.path, "time": round(time.time())}
+        os.makedirs(os.path.dirname(os.path.abspath(self.output)), exist_ok=True)
+        directory = tempfile.mkdtemp(prefix=".peg-snapshot-", dir=os.path.dirname(os.path.abspath(self.output)))
+        try:
+            runs = []
+            entries = []
+            listed = 0
+            for file in self.bucket.walk(self.path, workers=self.workers):
+                if file.type != "file" or file.name.endswith("/"):
+                    continue
+                entries.append((file.name, file.fileSize, file.time or 0, file.hash or ""))
+                listed += 1
+                if len(entries) >= self.runSize:
+                    runs.append(self._spill(entries, os.path.join(directory, f"run-{len(runs)}")))
+                    entries = []
+                if self.callbackProgress and listed % 10000 == 0:
+                    self.callbackProgress(listed)
+
+            entries.sort()
+            readers = [Snapshot(run) for run in runs]
+            try:
+                with SnapshotWriter(self.output, meta) as writer:
+                    for entry in heapq.merge(entries, *readers):
+                        writer.add(*entry)
+            finally:
+                for reader in readers:
+                    reader.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return dict(meta, count=writer.count, bytes=writer.bytes)
+
+    @staticmethod
+    def _spill(entries: list, path: str) -> str:
+        entries.sort()
+        with SnapshotWriter(path) as writer:
+            for entry in entries:
+                writer.add(*entry)
+        return path
+
+
+def DiffSnapshots(old, new):
+    """
+    Merge-join two listings in key order, in one pass holding an entry of each.
+    Objects of the same key differ if their sizes or hashes do, or their times when hashes are unknown.
+    :param old: iterable of tuple(key, size, time, hash) in key order, like a Snapshot
+    :param new: iterable of tuple(key, size, time, hash) in key order
+    :return: generator of dict like {"change": "added", "key", "size", "time", "hash"}, changed ones with "old"
+    """
+    old, new = iter(old), iter(new)
+    before, after = next(old, None), next(new, None)
+    while before is not None or after is not None:
+        if after is None or (before is not None and before[0] < after[0]):
+            yield {"change": "removed", "key": before[0], "size": before[1], "time": before[2], "hash": before[3]}
+            before = next(old, None)
+        elif before is None or after[0] < before[0]:
+            yield {"change": "added", "key": after[0], "size": after[1], "time": after[2], "hash": after[3]}
+            after = next(new, None)
+        else:
+            if before[1] != after[1] or (before[3] != after[3] if before[3] and after[3] else before[2] != after[2]):
+                yield {"change": "changed", "key": after[0], "size": after[1], "time": after[2], "hash": after[3],
+                       "old": {"size": before[1], "time": before[2], "hash": before[3]}}
+            before, after = next(old, None), next(new, None)
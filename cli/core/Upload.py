@@ -0,0 +1,357 @@
+# -*- coding=utf-8
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .Bucket import Bucket
+from .File import File
+from .Dedup import PlanDedup
+from .Exception import CliException
+from .utilities.BandwidthUtils import WithJob
+from .utilities.MimeUtils import GuessMime
+from .utilities.PathUtils import NormalizePath
+from .utilities.ProgressUtils import Progress
+
+logger = logging.getLogger(__name__)
+
+
+class UploadJob:
+    """
+    Upload a file or a folder to a bucket path, files uploaded concurrently.
+    """
+
+    def __init__(self, bucket: Bucket, local: str, path: str, progress=None, dedup=False, workers=32,
+                 compression=None):
+        """
+        Initiate the job.
+        :param bucket: Bucket object with uploader set
+        :param local: local file/folder path
+        :param path: path from the / of bucket to where the FILE should located
+        :param progress: Progress object, nothing rendered if None
+        :param dedup: skip files identical to the objects in the bucket, copy duplicates in the job server side
+        :param workers: files uploaded at the same time
+        :param compression: Compression object, files it applies to are uploaded compressed
+        """
+        self.bucket = bucket
+        self.local = Path(local)
+        self.path = NormalizePath(path)
+        self.progress = progress
+        self.dedup = dedup
+        self.workers = workers
+        self.compression = compression
+
+        self.skipped = []
+        self.copies = []
+        self.failed = []
+
+    def scan(self) -> list:
+        """
+        Find the files to upload.
+        :return: list of tuple(path based on the uploading folder, filename, size)
+        """
+        file = self.local
+        if os.path.isdir(file):
+            rootDirAbsPath = NormalizePath(file.absolute().as_posix())
+
+            # find all the files recursively, get the path based on the uploading folder(not including) and filename.
+            files = [(
+                _file.absolute().as_posix().rpartition(_file.name)[0].partition(rootDirAbsPath)[2],
+                _file.name
+            ) for _file in file.resolve().glob('**/*') if _file.is_file()]
+
+            # if --no-root-folder not enabled, append the folder name to the upload path.
+            # selfDirPath = NormalizePath(Path(file).resolve().name)
+        else:
+            # fallback single file to merge the upload action
+            files = [("", file.name)]
+
+        return [(localPath, filename, os.path.getsize(f"{self.localFile(localPath, filename).path}{filename}"))
+                for localPath, filename in files]
+
+    def localFile(self, localPath: str, filename: str) -> File:
+        """
+        File object of a file to upload, with local path as its path.
+        """
+        return File(
+            name=filename,
+            path=NormalizePath(Path(os.path.join(self.local, localPath)).absolute().as_posix())
+            if localPath != ""
+            else NormalizePath(self.local.parent.absolute().as_posix()),
+            _type="file"
+        )
+
+    def remoteKey(self, localPath: str, filename: str) -> str:
+        """
+        Key of a file to upload from the root of bucket.
+        """
+        return f"{NormalizePath(f'{self.path}/{localPath}').lstrip('/')}{filename}"
+
+    def run(self, files=None) -> dict:
+        """
+        Upload the files.
+        :param files: list of tuple(path based on the uploading folder, filename, size), scanned if None
+        :return: dict of counts uploaded, copied, skipped, and keys failed
+        """
+        files = self.scan() if files is None else files
+
+        if self.dedup:
+            entries = {self.remoteKey(localPath, filename): (localPath, filename, size)
+                       for localPath, filename, size in files}
+            remote = {_file.name: (_file.fileSize, _file.hash) for _file in self.bucket.walk(self.path, workers=8)
+                      if _file.type == "file"}
+            plan = PlanDedup([(key, f"{self.localFile(localPath, filename).path}{filename}", size)
+                              for key, (localPath, filename, size) in entries.items()], remote)
+            files = [entries[key] for key in plan.uploads]
+            # duplicates are as large as what they copy from, large ones are copied in parts
+            self.copies = [(key, source, entries[key][2]) for key, source in plan.copies]
+            self.skipped = plan.skipped
+
+        progress = self.progress or Progress()
+        progress.totalFiles = len(files) + len(self.copies)
+        progress.totalBytes = sum([size for _, _, size in files])
+
+        # files are uploaded concurrently, requests they send are bounded by the limiter.
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(WithJob(self._upload), progress, *entry) for entry in files]:
+                future.result()
+            # duplicates are copied once what they copy from is there
+            for future in [executor.submit(WithJob(self._copy), progress, *entry) for entry in self.copies]:
+                future.result()
+        progress.close()
+
+        copied = {key for key, _, _ in self.copies}
+        return {
+            "uploaded": len(files) - len([key for key in self.failed if key not in copied]),
+            "copied": len(self.copies) - len([key for key in self.failed if key in copied]),
+            "skipped": len(self.skipped),
+            "failed": self.failed
+        }
+
+    def runStream(self, stream, name: str) -> dict:
+        """
+        Upload a stream of unknown length, like stdin, as an object of the path.
+        :param stream: binary file-like object
+        :param name: object name
+        :return: dict of counts uploaded, bytes, and keys failed
+        """
+        progress = self.progress or Progress()
+        progress.totalFiles = 1
+        progress.start(name, 0)
+        uploaded = [0]
+
+        def callbackProgress(consumed: int, total):
+            uploaded[0] = consumed
+            progress.update(name, consumed)
+
+        try:
+            self.bucket.uploadStream(stream, self.path, name, callbackProgress)
+            progress.finish(name)
+        except (CliException, OSError) as e:
+            self.failed.append(f"{self.path.lstrip('/')}{name}")
+            progress.finish(name, error=e)
+        progress.close()
+
+        return {
+            "uploaded": 1 - len(self.failed),
+            "bytes": uploaded[0],
+            "failed": self.failed
+        }
+
+    def _upload(self, progress: Progress, localPath: str, filename: str, size: int):
+        name = f"{localPath}{filename}"
+        progress.start(name, size)
+        try:
+            self.bucket.upload(
+                file=self.localFile(localPath, filename),
+                path=f"{self.path}/{localPath}",
+                callbackProgress=progress.callback(name),
+                compression=self.compression
+            )
+            progress.finish(name)
+        except (CliException, OSError) as e:
+            # a file failing, rejected or unreadable, fails alone
+            self.failed.append(self.remoteKey(localPath, filename))
+            progress.finish(name, error=e)
+
+    def _copy(self, progress: Progress, key: str, source: str, size: int):
+        progress.start(key, 0)
+        if source in self.failed:
+            self.failed.append(key)
+            progress.finish(key, error=f"{source} failed to upload")
+            return
+        try:
+            self.bucket.copy(source, key, size)
+            progress.finish(key)
+        except CliException as e:
+            self.failed.append(key)
+            progress.finish(key, error=e)
+
+
+class FanOutJob(UploadJob):
+    """
+    Upload a file or a folder to the same path of several buckets, each part read once and put to every bucket.
+    Files not above the multipart threshold are put as one to each bucket instead.
+    """
+
+    def __init__(self, targets: list, local: str, path: str, progress=None, workers=4, window=4, compression=None):
+        """
+        Initiate the job.
+        :param targets: list of Bucket objects with uploader set, the same uploader class for all
+        :param local: local file/folder path
+        :param path: path from the / of buckets to where the FILE should located
+        :param progress: Progress object, each file of each bucket a transfer named bucket:key
+        :param workers: files uploaded at the same time
+        :param window: parts of a file in memory at most, a bucket falls behind the others by no more than it
+        :param compression: Compression object, files it applies to are compressed once for all the buckets
+        """
+        super(FanOutJob, self).__init__(targets[0], local, path, progress=progress, workers=workers,
+                                        compression=compression)
+        self.targets = targets
+        self.window = window
+
+        # bucket name -> keys failed
+        self.failed = {target.name: [] for target in targets}
+
+    def run(self, files=None) -> dict:
+        """
+        Upload the files to every bucket.
+        :param files: list of tuple(path based on the uploading folder, filename, size), scanned if None
+        :return: dict of bucket name -> dict of counts uploaded and keys failed
+        """
+        files = self.scan() if files is None else files
+
+        progress = self.progress or Progress()
+        progress.totalFiles = len(files) * len(self.targets)
+        progress.totalBytes = sum([size for _, _, size in files]) * len(self.targets)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(WithJob(self._fanOut), progress, *entry) for entry in files]:
+                future.result()
+        progress.close()
+
+        return {target.name: {
+            "uploaded": len(files) - len(self.failed[target.name]),
+            "failed": self.failed[target.name]
+        } for target in self.targets}
+
+    def _fanOut(self, progress: Progress, localPath: str, filename: str, size: int):
+        key = self.remoteKey(localPath, filename)
+        local = self.localFile(localPath, filename)
+        names = {target.name: f"{target.name}:{key}" for target in self.targets}
+        for name in names.values():
+            progress.start(name, size)
+
+        # files not above the threshold are put as one to each bucket, reading a small file again costs less
+        # than the initiate and complete requests of multipart uploads
+        targets = []
+        for target in self.targets:
+            if size > target.uploader.settings()[2]:
+                targets.append(target)
+                continue
+            try:
+                target.upload(
+                    file=local,
+                    path=f"{self.path}/{localPath}",
+                    callbackProgress=progress.callback(names[target.name]),
+                    compression=self.compression
+                )
+                progress.finish(names[target.name])
+            except Exception as e:
+                self.failed[target.name].append(key)
+                progress.finish(names[target.name], error=e)
+        if not targets:
+            return
+
+        # a multipart upload has 10000 parts at most
+        partSize = max([target.uploader.settings()[1] for target in targets] + [-(-size // 10000)])
+        uploads = {}
+        errors = {}
+        etags = {target.name: {} for target in targets}
+        done = {target.name: 0 for target in targets}
+        read = False
+        lock = threading.Lock()
+        window = threading.BoundedSemaphore(self.window)
+        futures = []
+
+        @WithJob
+        def put(target: Bucket, partNumber: int, body: bytes, fileBytes: int, remaining: list):
+            try:
+                if target.name in errors:
+                    return
+                etag = target.uploader.putPart(key, uploads[target.name], partNumber, body)
+                with lock:
+                    etags[target.name][partNumber] = etag
+                    done[target.name] += fileBytes
+                progress.update(names[target.name], done[target.name])
+            except Exception as e:
+                # a bucket failing is skipped for the rest of the file, the others go on
+                errors.setdefault(target.name, e)
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        window.release()
+
+        try:
+            with open(f"{local.path}{filename}", "rb") as bytesFile:
+                head = bytesFile.read(partSize)
+                contentType = GuessMime(filename, head)
+                stream, encoding = bytesFile, None
+                if self.compression is not None and self.compression.applies(filename, contentType, head):
+                    stream, encoding = self.compression.reader(bytesFile, head), self.compression.encoding
+                else:
+                    bytesFile.seek(0)
+
+                for target in targets:
+                    try:
+                        uploads[target.name] = target.uploader.initiate(key, contentType, encoding)
+                    except Exception as e:
+                        errors[target.name] = e
+
+                body = stream.read(partSize)
+                partNumber = 0
+                reported = 0
+                while True:
+                    live = [target for target in targets if target.name not in errors]
+                    if not live:
+                        break
+                    # one part is looked ahead to tell the last, whose progress covers the rest of the file
+                    following = stream.read(partSize) if len(body) == partSize else b""
+                    fileBytes = getattr(stream, "consumed", reported + len(body)) - reported
+                    reported += fileBytes
+                    window.acquire()
+                    partNumber += 1
+                    remaining = [len(live)]
+                    futures += [target.uploader.pool().submit(put, target, partNumber, body, fileBytes, remaining)
+                                for target in live]
+                    if not following:
+                        break
+                    body = following
+            read = True
+        except Exception as e:
+            # unreadable or failing to compress, the file fails in every bucket
+            for target in targets:
+                errors.setdefault(target.name, e)
+        finally:
+            # whatever stopped the reading, the uploads initiated are completed or aborted, none is left behind
+            for future in futures:
+                future.result()
+
+            for target in targets:
+                name = target.name
+                if read and name not in errors:
+                    try:
+                        target.uploader.complete(key, uploads[name], [etags[name][x] for x in sorted(etags[name])])
+                        progress.finish(names[name])
+                        continue
+                    except Exception as e:
+                        errors[name] = e
+                if name in uploads:
+                    try:
+                        target.uploader.abort(key, uploads[name])
+                    except Exception as e:
+                        logger.debug(f"Failed to abort {names[name]}, {e}")
+                self.failed[name].append(key)
+                progress.finish(names[name], error=errors.get(name, "interrupted"))
@@ -0,0 +1,66 @@
+# -*- coding=utf-8
+import logging
+
+from .Bucket import Bucket
+from .utilities.PathUtils import NormalizePath
+
+logger = logging.getLogger(__name__)
+
+
+class DiskUsage:
+    """
+    Storage accounting of a bucket directory, sizes and object counts totaled per directory level.
+    """
+
+    def __init__(self, bucket: Bucket, path="/", depth=1, workers=8):
+        """
+        Initiate the accounting.
+        :param bucket: Bucket object to list
+        :param path: directory to account for
+        :param depth: directory levels under the path totaled separately, deeper ones fold into their ancestor
+        :param workers: directories listed at the same time
+        """
+        self.bucket = bucket
+        self.path = NormalizePath(path)
+        self.base = "" if self.path == "/" else self.path
+        self.depth = max(0, depth)
+        self.workers = max(1, workers)
+
+        # directory relative to the path -> [bytes, objects], only levels within depth are kept
+        self.totals = {"": [0, 0]}
+
+    def run(self, callbackProgress=None) -> dict:
+        """
+        Stream the listing and total it up.
+        :param callbackProgress: callback function called with the objects counted so far
+        :return: dict of directory relative to the path -> [bytes, objects]
+        """
+        for file in self.bucket.walk(self.path, workers=self.workers):
+            if file.type == "folder":
+                self._touch(file.name)
+            else:
+                self._add(file.name, int(file.fileSize or 0), callbackProgress)
+        return self.totals
+
+    def _levels(self, key: str) -> list:
+        """
+        Directories within depth a key counts towards, the path itself included.
+        """
+        key = key.lstrip("/")
+        relative = key[len(self.base):] if key.startswith(self.base) else key
+        tokens = [token for token in relative.split("/") if token]
+        if not relative.endswith("/"):
+            tokens = tokens[:-1]
+        return [""] + ["/".join(tokens[:level]) + "/" for level in range(1, min(len(tokens), self.depth) + 1)]
+
+    def _touch(self, folder: str):
+        for level in self._levels(NormalizePath(folder)):
+            self.totals.setdefault(level, [0, 0])
+
+    def _add(self, key: str, size: int, callbackProgress=None):
+        for level in self._levels(key):
+            total = self.totals.setdefault(level, [0, 0])
+            total[0] += size
+            total[1] += 1
+        if callbackProgress and self.totals[""][1] % 10000 == 0:
+            callbackProgress(self.totals[""][1])
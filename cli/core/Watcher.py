@@ -0,0 +1,339 @@
+# -*- coding=utf-8
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from stat import S_ISREG
+
+from .File import File
+from .Session import Session
+from .Exception import CliException
+from .utilities.PathUtils import NormalizePath
+from .utilities.BandwidthUtils import WithJob
+from .utilities.ConcurrencyUtils import LimiterJob, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class PollingWatcher:
+    """
+    Watch a folder by comparing snapshots of sizes and modified times.
+    """
+
+    def __init__(self, root: str, interval=2.0):
+        """
+        Initiate the watcher.
+        :param root: folder to watch
+        :param interval: seconds between snapshots
+        """
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self._snapshot = Snapshot(self.root)
+
+    def wait(self, timeout: float):
+        """
+        Wait for changes.
+        :param timeout: seconds to wait at most
+        :return: set of paths relative to the root changed, None if everything needs a rescan
+        """
+        time.sleep(min(timeout, self.interval))
+        snapshot = Snapshot(self.root)
+        changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(path) != self._snapshot.get(path)}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Watch a folder recursively with inotify of Linux.
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, root: str):
+        """
+        Initiate the watcher, OSError raises if inotify is not available.
+        :param root: folder to watch
+        """
+        self.root = os.path.abspath(root)
+        name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(name, use_errno=True) if name else None
+        if self._libc is None or not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self._addTree(self.root)
+
+    def _add(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            logger.debug(f"Failed to watch {directory}, errno {ctypes.get_errno()}")
+            return
+        self._watches[wd] = directory
+
+    def _addTree(self, directory: str) -> set:
+        """
+        Watch a directory and everything under it.
+        :return: set of files under it, relative to the root, created before they were watched
+        """
+        found = set()
+        for current, _, files in os.walk(directory):
+            self._add(current)
+            found.update(os.path.relpath(os.path.join(current, file), self.root) for file in files)
+        return found
+
+    def wait(self, timeout: float):
+        """
+        Wait for changes.
+        :param timeout: seconds to wait at most
+        :return: set of paths relative to the root changed, None if everything needs a rescan
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            buffer = os.read(self._fd, 1024 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = struct.unpack_from("iIII", buffer, offset)
+            name = buffer[offset + 16:offset + 16 + length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += 16 + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd, None)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed.update(self._addTree(path))
+                elif mask & self.IN_MOVED_FROM:
+                    # what was under it is gone from here
+                    return None
+                continue
+            changed.add(os.path.relpath(path, self.root))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def Snapshot(root: str) -> dict:
+    """
+    Sizes and modified times of the files under a folder.
+    :param root: folder to scan
+    :return: dict of path relative to the root -> [size, modified time in ns]
+    """
+    snapshot = {}
+    for current, _, files in os.walk(root):
+        for file in files:
+            path = os.path.join(current, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[os.path.relpath(path, root)] = [stat.st_size, stat.st_mtime_ns]
+    return snapshot
+
+
+class WatchJob:
+    """
+    Upload what changes in a folder continuously, the state uploaded is kept in a file so nothing is missed
+    between runs.
+    """
+
+    def __init__(self, session: Session, bucket: str, root: str, path: str, state=None, delete=False, debounce=1.0,
+                 workers=8, poll=False, callbackEvent=None):
+        """
+        Initiate the job.
+        :param session: Session object
+        :param bucket: bucket name
+        :param root: local folder to watch
+        :param path: path from the / of bucket the folder is uploaded to
+        :param state: state file path, one under ~/.peg/watch/ for the folder and target if None
+        :param delete: remove objects whose local files are removed
+        :param debounce: seconds of quiet before a burst of events is handled
+        :param workers: files uploaded at the same time
+        :param poll: poll instead of inotify
+        :param callbackEvent: callback function called with (action, key, error) for every file handled
+        """
+        self.session = session
+        self.bucket = bucket
+        self.root = os.path.abspath(root)
+        self.path = NormalizePath(path)
+        self.delete = delete
+        self.debounce = debounce
+        self.workers = workers
+        self.poll = poll
+        self.callbackEvent = callbackEvent
+
+        digest = hashlib.sha1(f"{self.root}\n{bucket}\n{self.path}".encode()).hexdigest()[:16]
+        self.state = state or (Path.home() / ".peg" / "watch" / f"{digest}.json").as_posix()
+        self.uploaded = self._load()
+        self._stop = threading.Event()
+
+    def run(self) -> None:
+        """
+        Watch until stop() is called, what changed while not watching is handled first.
+        """
+        try:
+            watcher = PollingWatcher(self.root) if self.poll else InotifyWatcher(self.root)
+        except OSError as e:
+            logger.debug(f"Fallback to polling, {e}")
+            watcher = PollingWatcher(self.root)
+
+        try:
+            self.reconcile()
+            pending = set()
+            first = None
+            while not self._stop.is_set():
+                changed = watcher.wait(self.debounce if pending else 1.0)
+                if changed is None:
+                    self.reconcile()
+                    pending.clear()
+                    continue
+                if changed:
+                    first = first or time.monotonic()
+                    pending.update(changed)
+                    # keep merging while the burst goes on, but not forever
+                    if time.monotonic() - first < self.debounce * 10:
+                        continue
+                if pending:
+                    self.handle(pending)
+                    pending = set()
+                    first = None
+        finally:
+            watcher.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def reconcile(self) -> None:
+        """
+        Handle every file differing from the state uploaded.
+        """
+        snapshot = Snapshot(self.root)
+        self.handle({path for path in snapshot.keys() | self.uploaded.keys()
+                     if snapshot.get(path) != self.uploaded.get(path)}, snapshot)
+
+    def handle(self, paths: set, snapshot=None) -> None:
+        """
+        Upload the files created or changed and remove the ones removed if asked.
+        :param paths: paths relative to the root
+        :param snapshot: dict of path -> [size, modified time in ns] already scanned, stat again if None
+        """
+        uploads = []
+        removes = []
+        for path in sorted(paths):
+            if snapshot is not None:
+                current = snapshot.get(path, None)
+            else:
+                try:
+                    stat = os.stat(os.path.join(self.root, path))
+                    current = [stat.st_size, stat.st_mtime_ns] if S_ISREG(stat.st_mode) else None
+                except OSError:
+                    current = None
+            if current is None:
+                if path in self.uploaded:
+                    removes.append(path)
+            elif current != self.uploaded.get(path, None):
+                uploads.append((path, current))
+        if not uploads and not removes:
+            return
+
+        # a round of changes retries on a budget of its own, a watch running for weeks doesn't spend one up
+        with LimiterJob(retry=RetryPolicy()):
+            self._handle(uploads, removes)
+
+    def _handle(self, uploads: list, removes: list) -> None:
+        bucket = self.session.uploader(self.bucket, path=self.path)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(WithJob(self._upload), bucket, path, current) for path, current in uploads]:
+                future.result()
+
+        if removes and self.delete:
+            try:
+                bucket.remove([File(name=name, path=self._remoteDirectory(directory), _type="file")
+                               for directory, name in map(os.path.split, removes)])
+                for path in removes:
+                    self.uploaded.pop(path, None)
+                    self._event("remove", path)
+            except CliException as e:
+                for path in removes:
+                    self._event("remove", path, e)
+        elif removes:
+            for path in removes:
+                self.uploaded.pop(path, None)
+        self._save()
+
+    def _upload(self, bucket, path: str, current: list):
+        directory, name = os.path.split(path)
+        try:
+            bucket.upload(
+                file=File(name=name, path=os.path.join(self.root, directory, ""), _type="file"),
+                path=self._remoteDirectory(directory)
+            )
+        except Exception as e:
+            # a file failing is reported and tried again on its next change, the watch goes on
+            self._event("upload", path, e)
+            return
+        self.uploaded[path] = current
+        self._event("upload", path)
+
+    def _remoteDirectory(self, directory: str) -> str:
+        return NormalizePath(f"{self.path}/{directory.replace(os.sep, '/')}").lstrip("/")
+
+    def _event(self, action: str, path: str, error=None):
+        if self.callbackEvent:
+            self.callbackEvent(action, f"{self._remoteDirectory(os.path.dirname(path))}{os.path.basename(path)}",
+                               error)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.state, "r") as file:
+                return json.load(file).get("uploaded", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        """
+        Write the state atomically, a crash never leaves it half written.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.state)), exist_ok=True)
+        temporary = f"{self.state}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({"root": self.root, "bucket": self.bucket, "path": self.path, "uploaded": self.uploaded}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.state)
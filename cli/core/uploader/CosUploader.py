@@ -1,12 +1,20 @@
 # -*- coding=utf-8
+import logging
+import os
 from qcloud_cos import CosS3Client, CosConfig
+from qcloud_cos.cos_exception import CosClientError, CosServiceError
 from ..uploader import Uploader
 from ..File import File
+from ..Exception import CliThrottledError, CliServerError, CliRejectedError
+from ..utilities.ConcurrencyUtils import THROTTLE_STATUS, RETRY_STATUS
+from ..utilities.MimeUtils import GuessMime
+
+logger = logging.getLogger(__name__)
 
 
 class CosUploader(Uploader):
     """
-    COS SDK uploader, multi-thread.
+    COS SDK uploader, parts of all the files put in a shared pool.
     """
     def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str):
         """
@@ -28,17 +36,142 @@ class CosUploader(Uploader):
             )
         )
 
-    def upload(self, file: File, path: str, callbackProgress=None):
+    def upload(self, file: File, path: str, callbackProgress=None, compression=None):
         """
-        Upload file use COS SDK, multi-thread.
+        Upload file use COS SDK, put as one if not above the threshold, multipart otherwise.
         :param file: File object with local file path as File.path
         :param path: path in the bucket for the file
-        :param callbackProgress: callback function for the progress
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, total bytes)
+        :param compression: Compression object, the file is compressed as it's read if it applies
         :return: uploading object of the COS
         """
-        return self._uploader.upload_file(
-            Bucket=self.bucket,
-            LocalFilePath=f"{file.path}{file.name}",
-            Key=f"{self.prefix}/{path}{file.name}",
-            progress_callback=callbackProgress
-        )
+        key = f"{path}{file.name}"
+        size = os.path.getsize(f"{file.path}{file.name}")
+        _, partSize, threshold = self.settings()
+        with open(f"{file.path}{file.name}", "rb") as bytesFile:
+            head = bytesFile.read(partSize)
+            contentType = GuessMime(file.name, head)
+            if compression is not None and compression.applies(file.name, contentType, head):
+                return self._uploadStream(compression.reader(bytesFile, head), key, size, callbackProgress,
+                                          contentType=contentType, contentEncoding=compression.encoding)
+
+            if size <= threshold:
+                response = self._limited(self._call, self._uploader.put_object, Bucket=self.bucket,
+                                         Key=f"{self.prefix}/{key}", Body=head + bytesFile.read(), ContentType=contentType, size=size)
+                if callbackProgress:
+                    callbackProgress(size, size)
+                return response
+
+            bytesFile.seek(0)
+            return self._uploadStream(bytesFile, key, size, callbackProgress, contentType=contentType)
+
+    def uploadStream(self, stream, path: str, name: str, callbackProgress=None):
+        """
+        Upload a stream of unknown length use COS SDK multipart upload.
+        :param stream: binary file-like object
+        :param path: path in the bucket for the object
+        :param name: object name
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, None)
+        :return: completing object of the COS
+        """
+        return self._uploadStream(stream, f"{path}{name}", None, callbackProgress,
+                                  contentType=GuessMime(name, b""))
+
+    def _uploadStream(self, stream, key: str, size, callbackProgress=None, contentType=None,
+                      contentEncoding=None):
+        """
+        Upload a stream with multipart upload, parts cut as it's read and put in the shared pool.
+        :param stream: binary file-like object
+        :param key: key from the root of bucket
+        :param size: size of the file streamed, None if unknown
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, total bytes)
+        :param contentType: content type of the object
+        :param contentEncoding: content encoding of the object
+        :return: completing object of the COS
+        """
+        uploadId = self.initiate(key, contentType, contentEncoding)
+        try:
+            etags = self._putParts(
+                stream,
+                size,
+                lambda partNumber, body: self.putPart(key, uploadId, partNumber, body),
+                callbackProgress
+            )
+            return self.complete(key, uploadId, etags)
+        except BaseException:
+            self.abort(key, uploadId)
+            raise
+
+    def initiate(self, key: str, contentType=None, contentEncoding=None) -> str:
+        headers = {"ContentType": contentType} if contentType else {}
+        if contentEncoding:
+            headers["ContentEncoding"] = contentEncoding
+        return self._limited(self._call, self._uploader.create_multipart_upload, Bucket=self.bucket,
+                             Key=f"{self.prefix}/{key}", **headers)["UploadId"]
+
+    def putPart(self, key: str, uploadId: str, partNumber: int, body: bytes) -> str:
+        return self._limited(self._call, self._uploader.upload_part, Bucket=self.bucket, Key=f"{self.prefix}/{key}",
+                             Body=body, PartNumber=partNumber, UploadId=uploadId, size=len(body))["ETag"]
+
+    def complete(self, key: str, uploadId: str, etags: list):
+        return self._limited(self._call, self._uploader.complete_multipart_upload, Bucket=self.bucket,
+                             Key=f"{self.prefix}/{key}", UploadId=uploadId, MultipartUpload={
+                                 "Part": [{"PartNumber": x + 1, "ETag": etag} for x, etag in enumerate(etags)]
+                             }, idempotent=False)
+
+    def abort(self, key: str, uploadId: str) -> None:
+        # called on the way out of a failure, its own error mustn't hide the one failing the upload
+        try:
+            self._call(self._uploader.abort_multipart_upload, Bucket=self.bucket, Key=f"{self.prefix}/{key}",
+                       UploadId=uploadId)
+        except Exception as e:
+            logger.debug(f"Failed to abort the upload of {key}, {e}")
+
+    def copy(self, src: str, dst: str, size=0, source=None):
+        """
+        Copy an object server side use COS SDK, large ones with UploadPartCopy concurrently.
+        :param src: source key from the root of the bucket copied from
+        :param dst: destination key from the root of bucket
+        :param size: bytes of the object
+        :param source: Uploader of the bucket copied from, this one if None
+        :return: copying object of the COS
+        """
+        source = source or self
+        copySource = {
+            "Bucket": source.bucket,
+            "Key": f"{source.prefix}/{src}",
+            "Region": source.region
+        }
+        if size <= self.COPY_THRESHOLD:
+            return self._limited(self._call, self._uploader.copy_object, Bucket=self.bucket,
+                                 Key=f"{self.prefix}/{dst}", CopySource=copySource)
+
+        uploadId = self.initiate(dst)
+        try:
+            etags = self._copyParts(size, lambda partNumber, first, last: self._call(
+                self._uploader.upload_part_copy, Bucket=self.bucket, Key=f"{self.prefix}/{dst}",
+                PartNumber=partNumber, UploadId=uploadId, CopySource=copySource,
+                CopySourceRange=f"bytes={first}-{last}"
+            )["ETag"])
+            return self.complete(dst, uploadId, etags)
+        except BaseException:
+            self.abort(dst, uploadId)
+            raise
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        """
+        Call the SDK, throttling errors raise as CliThrottledError, server errors as CliServerError and the others,
+        like 403 or 400, as CliRejectedError. Errors of the SDK sending the request raise as ConnectionError.
+        """
+        try:
+            return func(*args, **kwargs)
+        except CosClientError as e:
+            # the SDK wraps the transport errors of requests, transient like the ones of httpx
+            raise ConnectionError(f"COS client error, {e}") from e
+        except CosServiceError as e:
+            if e.get_status_code() in THROTTLE_STATUS:
+                raise CliThrottledError(e.get_status_code(), e.get_error_msg())
+            if e.get_status_code() in RETRY_STATUS:
+                raise CliServerError(e.get_status_code(), e.get_error_msg())
+            raise CliRejectedError(e.get_status_code(), f"{e.get_error_code()}: {e.get_error_msg()}")
@@ -1,10 +1,12 @@
 # -*- coding=utf-8
 import logging
 import os
-import magic
+import urllib.parse
 import httpx as requests
 from cli.core.Exception import CliRequestError
 from cli.core.utilities import UploadUtils
+from cli.core.utilities.MimeUtils import GuessMime
+from cli.core.utilities.ConcurrencyUtils import RaiseForRetry
 from cli.core.uploader import Uploader
 from cli.core.File import File
 
@@ -13,58 +15,222 @@ logger = logging.getLogger(__name__)
 
 class MockCosUploader(Uploader):
     """
-    COS SDK mock uploader, single thread and 2MB file slice.
+    COS SDK mock uploader, 2MB file slice put concurrently.
     """
-    def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str, endpoint: str):
+
+    # files up to 5MB are put as a single slice
+    PART_SIZE = 2 * 1024 * 1024
+    THRESHOLD = 5 * 1024 * 1024
+
+    def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str, endpoint=None):
         """
         Initiate the uploader.
         :param sessionToken: token
         :param accessKeyId: secretId
         :param secretAccessKey: secretKey
         :param info: bucket info given by DogeCloud
-        :param endpoint: endpoint as COS'
+        :param endpoint: endpoint as COS', the one of the bucket and region if None
         """
         super(MockCosUploader, self).__init__(sessionToken, accessKeyId, secretAccessKey, info)
-        self.endpoint = endpoint
+        self.endpoint = endpoint or f"https://{self.bucket}.cos.{self.region}.myqcloud.com"
         logger.debug(f"Token: {self.sessionToken}, accessKeyId: {self.accessKeyId}, endpoint: {self.endpoint}")
 
-    def upload(self, file: File, path: str, callbackProgress=None) -> str:
+    def upload(self, file: File, path: str, callbackProgress=None, compression=None) -> str:
         """
-        Upload file with slice of 2MB, single thread.
+        Upload file with slices of the part size, slices put concurrently within the limiter.
         :param file: File object with local path as its path
         :param path: path in the bucket for the file
-        :param callbackProgress: callback function for the progress
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, total bytes)
+        :param compression: Compression object, the file is compressed as it's read if it applies
+        :return: final upload status
+        """
+        file.fileSize = os.path.getsize(f"{file.path}{file.name}")
+        _, partSize, threshold = self.settings()
+
+        # the first slice is read ahead, the content type is sniffed from it instead of opening the file again
+        with open(f"{file.path}{file.name}", "rb") as bytesFile:
+            firstSlice = bytesFile.read(partSize)
+            contentType = GuessMime(file.name, firstSlice)
+            compressed = compression is not None and compression.applies(file.name, contentType, firstSlice)
+
+            response = self._limited(
+                self._send,
+                "get",
+                url=self.endpoint,
+                params={
+                    "uploads": "",
+                    "prefix": f"{self.prefix}/{path}{file.name}"
+                },
+                headers={
+                    "content-type": contentType,
+                    "authorization": UploadUtils.GetAuth(
+                        secretId=self.accessKeyId,
+                        secretKey=self.secretAccessKey,
+                        method="get",
+                        params={
+                         "uploads": "",
+                         "prefix": f"{self.prefix}/{path}{file.name}"
+                        },
+                        headers={},
+                        ),
+                    "x-cos-security-token": self.sessionToken,
+                    "x-cos-storage-class": "Standard"
+                })
+            data = response.text
+            logger.debug(response.request)
+            logger.debug(data)
+            if response.status_code != 200:
+                raise CliRequestError(response)
+
+            uploadId = self.initiate(f"{path}{file.name}", contentType,
+                                     compression.encoding if compressed else None)
+
+            # slices are put in the pool shared by all the files, as many in flight as the limiter allows
+            try:
+                if compressed:
+                    stream, partSize = compression.reader(bytesFile, firstSlice), None
+                else:
+                    bytesFile.seek(0)
+                    stream, partSize = bytesFile, (max(file.fileSize, 1) if file.fileSize <= threshold else None)
+                etags = self._putParts(
+                    stream,
+                    file.fileSize,
+                    lambda partNumber, uploadFileBytes: self.putPart(
+                        f"{path}{file.name}", uploadId, partNumber, uploadFileBytes
+                    ),
+                    callbackProgress,
+                    partSize
+                )
+                return self.complete(f"{path}{file.name}", uploadId, etags)
+            except BaseException:
+                self._abandon(f"{path}{file.name}", uploadId)
+                raise
+
+    def uploadStream(self, stream, path: str, name: str, callbackProgress=None) -> str:
+        """
+        Upload a stream of unknown length, slices of the part size put concurrently as it's read.
+        :param stream: binary file-like object
+        :param path: path in the bucket for the object
+        :param name: object name
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, None)
         :return: final upload status
         """
-        response = requests.get(
-            url=self.endpoint,
+        key = f"{path}{name}"
+        uploadId = self.initiate(key, GuessMime(name, b""))
+        try:
+            etags = self._putParts(
+                stream,
+                None,
+                lambda partNumber, uploadFileBytes: self.putPart(key, uploadId, partNumber, uploadFileBytes),
+                callbackProgress
+            )
+            return self.complete(key, uploadId, etags)
+        except BaseException:
+            self._abandon(key, uploadId)
+            raise
+
+    def copy(self, src: str, dst: str, size=0, source=None) -> str:
+        """
+        Copy an object server side with x-cos-copy-source, large ones in ranges concurrently.
+        :param src: source key from the root of the bucket copied from
+        :param dst: destination key from the root of bucket
+        :param size: bytes of the object
+        :param source: Uploader of the bucket copied from, this one if None
+        :return: copy result
+        """
+        source = source or self
+        host = urllib.parse.urlparse(source.endpoint).netloc if getattr(source, "endpoint", None) \
+            else f"{source.bucket}.cos.{source.region}.myqcloud.com"
+        copySource = f"{host}/{source.prefix}/{urllib.parse.quote(src)}"
+        if size > self.COPY_THRESHOLD:
+            uploadId = self.initiate(dst)
+            etags = self._copyParts(size, lambda partNumber, first, last: self._copyPart(
+                dst, uploadId, partNumber, copySource, first, last
+            ))
+            return self.complete(dst, uploadId, etags)
+
+        response = self._limited(
+            self._send,
+            "put",
+            url=f"{self.endpoint}/{self.prefix}/{dst}",
+            headers={
+                "authorization": UploadUtils.GetAuth(
+                    secretId=self.accessKeyId,
+                    secretKey=self.secretAccessKey,
+                    method="put",
+                    params={},
+                    headers={},
+                    pathname=f"/{self.prefix}/{dst}"
+                    ),
+                "x-cos-copy-source": copySource,
+                "x-cos-security-token": self.sessionToken,
+            })
+        data = response.text
+        logger.debug(response.request)
+        logger.debug(data)
+        if response.status_code != 200 or "<Error>" in data:
+            raise CliRequestError(response)
+
+        return response.content.decode()
+
+    def _copyPart(self, key: str, uploadId: str, partNumber: int, copySource: str, first: int, last: int) -> str:
+        """
+        Copy a range of an object as a slice of the multipart upload.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        :param partNumber: number of the slice, from 1
+        :param copySource: x-cos-copy-source of the object
+        :param first: first byte of the range
+        :param last: last byte of the range, included
+        :return: etag of the slice
+        """
+        response = self._send(
+            "put",
+            url=f"{self.endpoint}/{self.prefix}/{key}",
             params={
-                "uploads": "",
-                "prefix": f"{self.prefix}/{path}{file.name}"
+                "partnumber": partNumber,
+                "uploadid": uploadId
             },
             headers={
-                "content-type": magic.from_file(file.path, mime=True),
                 "authorization": UploadUtils.GetAuth(
                     secretId=self.accessKeyId,
                     secretKey=self.secretAccessKey,
-                    method="get",
+                    method="put",
                     params={
-                     "uploads": "",
-                     "prefix": f"{self.prefix}/{path}{file.name}"
+                     "partnumber": partNumber,
+                     "uploadid": uploadId
                     },
                     headers={},
+                    pathname=f"/{self.prefix}/{key}"
                     ),
+                "x-cos-copy-source": copySource,
+                "x-cos-copy-source-range": f"bytes={first}-{last}",
                 "x-cos-security-token": self.sessionToken,
-                "x-cos-storage-class": "Standard"
             })
         data = response.text
         logger.debug(response.request)
         logger.debug(data)
-        if response.status_code != 200:
+        if response.status_code != 200 or "<ETag>" not in data:
             raise CliRequestError(response)
 
-        response = requests.post(
-            url=f"{self.endpoint}/{self.prefix}/{path}{file.name}",
+        return data.partition("<ETag>")[2].partition("</ETag>")[0].replace("&quot;", "").strip('"')
+
+    def initiate(self, key: str, contentType=None, contentEncoding=None) -> str:
+        """
+        Initiate a multipart upload.
+        :param key: key from the root of bucket
+        :param contentType: content type of the object
+        :param contentEncoding: content encoding of the object, like gzip
+        :return: id of the multipart upload
+        """
+        headers = {"content-type": contentType} if contentType else {}
+        if contentEncoding:
+            headers["content-encoding"] = contentEncoding
+
+        response = self._limited(
+            self._send,
+            "post",
+            url=f"{self.endpoint}/{self.prefix}/{key}",
             params={
                 "uploads": ""
             },
@@ -79,8 +245,9 @@ class MockCosUploader(Uploader):
                     headers={
                      "x-cos-storage-class": "Standard"
                     },
-                    pathname=f"/{self.prefix}/{path}{file.name}"
+                    pathname=f"/{self.prefix}/{key}"
                     ),
+                **headers,
                 "x-cos-security-token": self.sessionToken,
                 "x-cos-storage-class": "Standard"
             })
@@ -91,63 +258,29 @@ class MockCosUploader(Uploader):
             raise CliRequestError(response)
 
         index = response.content.decode().index("<UploadId>")
-        uploadId = response.content.decode()[index + 10:index + 84]
-
-        bytesFile = open(f"{file.path}", "rb")
-        file.fileSize = os.path.getsize(file.path)
-        fileSlice = round(file.fileSize / 1024 / 1024 / 2)
-        fileSlice = 1 if fileSlice <= 2 else fileSlice
-
-        etagXml = ""
-
-        # put slices
-        for x in range(fileSlice):
-            if x == fileSlice - 1:
-                uploadFileBytes = bytesFile.read()
-            else:
-                uploadFileBytes = bytesFile.read(1024 * 1024 * 2)
-            response = requests.put(
-                url=f"{self.endpoint}/{self.prefix}/{path}{file.name}",
-                params={
-                    "partnumber": x + 1,
-                    "uploadid": uploadId
-                },
-                headers={
-                    "authorization": UploadUtils.GetAuth(
-                        secretId=self.accessKeyId,
-                        secretKey=self.secretAccessKey,
-                        method="put",
-                        params={
-                         "partnumber": x + 1,
-                         "uploadid": uploadId
-                        },
-                        headers={
-                         "content-length": len(uploadFileBytes)
-                        },
-                        pathname=f"/{self.prefix}/{path}{file.name}"
-                        ),
-                    "x-cos-security-token": self.sessionToken,
-                }, data=uploadFileBytes)
-            data = response.text
-            logger.debug(response.request)
-            logger.debug(data)
-            if response.status_code != 200:
-                raise CliRequestError(response)
+        return response.content.decode()[index + 10:index + 84]
 
-            etag = response.headers["Etag"][1:-1]
-            etagXml += f"<Part><PartNumber>{x + 1}</PartNumber><ETag>&quot;{etag}&quot;</ETag></Part>"
-            logger.debug(etagXml)
+    def complete(self, key: str, uploadId: str, etags: list) -> str:
+        """
+        Concat slices, complete the multipart upload.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        :param etags: etags of the slices in order
+        :return: final upload status
+        """
+        etagXml = "".join([f"<Part><PartNumber>{x + 1}</PartNumber><ETag>&quot;{etag}&quot;</ETag></Part>"
+                           for x, etag in enumerate(etags)])
+        logger.debug(etagXml)
 
-            if callbackProgress:
-                callbackProgress(etag, (x + 1) / fileSlice)
         data = f"""
         <?xml version="1.0" encoding="UTF-8" standalone="yes"?>
         <CompleteMultipartUpload>{etagXml}</CompleteMultipartUpload>
         """.encode()
 
-        # concat slices, complete file uploading
-        response = requests.post(
-            url=f"{self.endpoint}/{self.prefix}/{path}{file.name}",
+        response = self._limited(
+            self._send,
+            "post",
+            url=f"{self.endpoint}/{self.prefix}/{key}",
             params={
                 "uploadid": uploadId
             },
@@ -164,10 +297,10 @@ class MockCosUploader(Uploader):
                     headers={
                      "content-md5": f"{UploadUtils.MD5(data)}"
                     },
-                    pathname=f"/{self.prefix}/{path}{file.name}"
+                    pathname=f"/{self.prefix}/{key}"
                     ),
                 "x-cos-security-token": self.sessionToken,
-            }, data=data)
+            }, data=data, idempotent=False)
         data = response.text
         logger.debug(response.request)
         logger.debug(data)
@@ -176,3 +309,93 @@ class MockCosUploader(Uploader):
 
         return response.content.decode()
 
+    def abort(self, key: str, uploadId: str) -> None:
+        """
+        Abort a multipart upload, slices put are dropped.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        """
+        response = self._limited(
+            self._send,
+            "delete",
+            url=f"{self.endpoint}/{self.prefix}/{key}",
+            params={
+                "uploadid": uploadId
+            },
+            headers={
+                "authorization": UploadUtils.GetAuth(
+                    secretId=self.accessKeyId,
+                    secretKey=self.secretAccessKey,
+                    method="delete",
+                    params={
+                     "uploadid": uploadId
+                    },
+                    headers={},
+                    pathname=f"/{self.prefix}/{key}"
+                    ),
+                "x-cos-security-token": self.sessionToken,
+            })
+        logger.debug(response.request)
+        logger.debug(response.text)
+        if response.status_code not in (200, 204):
+            raise CliRequestError(response)
+
+    def _abandon(self, key: str, uploadId: str) -> None:
+        # aborting on the way out of a failure, its own error mustn't hide the one failing the upload
+        try:
+            self.abort(key, uploadId)
+        except Exception as e:
+            logger.debug(f"Failed to abort the upload of {key}, {e}")
+
+    def putPart(self, key: str, uploadId: str, partNumber: int, uploadFileBytes: bytes) -> str:
+        """
+        Put a slice of the multipart upload.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        :param partNumber: number of the slice, from 1
+        :param uploadFileBytes: bytes of the slice
+        :return: etag of the slice
+        """
+        response = self._limited(
+            self._send,
+            "put",
+            url=f"{self.endpoint}/{self.prefix}/{key}",
+            params={
+                "partnumber": partNumber,
+                "uploadid": uploadId
+            },
+            headers={
+                "authorization": UploadUtils.GetAuth(
+                    secretId=self.accessKeyId,
+                    secretKey=self.secretAccessKey,
+                    method="put",
+                    params={
+                     "partnumber": partNumber,
+                     "uploadid": uploadId
+                    },
+                    headers={
+                     "content-length": len(uploadFileBytes)
+                    },
+                    pathname=f"/{self.prefix}/{key}"
+                    ),
+                "x-cos-security-token": self.sessionToken,
+            }, data=uploadFileBytes, size=len(uploadFileBytes))
+        data = response.text
+        logger.debug(response.request)
+        logger.debug(data)
+        if response.status_code != 200:
+            raise CliRequestError(response)
+
+        return response.headers["Etag"][1:-1]
+
+    @staticmethod
+    def _send(method: str, **kwargs) -> requests.Response:
+        """
+        Send a request to COS, throttling and server error responses raise.
+        :param method: request method like "get"
+        :param kwargs: arguments of httpx.request
+        :return: response which is not a throttling or server error one
+        """
+        response = requests.request(method, **kwargs)
+        RaiseForRetry(response)
+        return response
@@ -0,0 +1,222 @@
+# -*- coding=utf-8
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx as requests
+
+from . import Uploader
+from .CosUploader import CosUploader
+from .S3Uploader import S3Uploader
+from .MockCosUploader import MockCosUploader
+from ..File import File
+from ..Exception import CliException, CliUploaderOptionError
+
+logger = logging.getLogger(__name__)
+
+# backends selectable by name, each constructed with (sessionToken, accessKeyId, secretAccessKey, info)
+UPLOADERS = {
+    "cos": CosUploader,
+    "s3": S3Uploader,
+    "mock": MockCosUploader,
+}
+
+
+def RegisterUploader(name: str, uploaderClass) -> None:
+    """
+    Make a backend selectable by name, and a candidate of auto.
+    :param name: name given to --uploader
+    :param uploaderClass: Uploader subclass constructed with (sessionToken, accessKeyId, secretAccessKey, info)
+    """
+    if not issubclass(uploaderClass, Uploader):
+        raise CliUploaderOptionError(uploaderClass, {"name": name})
+    UPLOADERS[name] = uploaderClass
+
+
+def GetUploader(name: str):
+    """
+    Backend class of a name, auto for the one probed fastest.
+    :param name: name given to --uploader
+    :return: Uploader subclass
+    """
+    if name == "auto":
+        return AutoUploader
+    if name not in UPLOADERS:
+        raise CliUploaderOptionError(name, {"available": ["auto", *UPLOADERS]})
+    return UPLOADERS[name]
+
+
+class AutoUploader(Uploader):
+    """
+    Uploader delegating to the backend probed fastest for the bucket, small and large files chosen separately.
+    """
+
+    # files above it are uploaded by the backend fastest for the large probe
+    LARGE_SIZE = 4 * 1024 * 1024
+    PROBE_SIZES = {
+        "small": 64 * 1024,
+        "large": 8 * 1024 * 1024,
+    }
+    PROBE_PATH = ".peg-probe/"
+    # choices are probed again after this long, networks and backends change
+    CACHE_LIFETIME = 7 * 24 * 3600
+
+    _cacheLock = threading.Lock()
+
+    def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str, cache=None):
+        """
+        Initiate the uploader, every backend available is constructed.
+        :param sessionToken: token
+        :param accessKeyId: secretId
+        :param secretAccessKey: secretKey
+        :param info: bucket info given by DogeCloud
+        :param cache: file of the choices per bucket, ~/.peg/uploaders.json if None
+        """
+        super(AutoUploader, self).__init__(sessionToken, accessKeyId, secretAccessKey, info)
+        self.cache = cache or (Path.home() / ".peg" / "uploaders.json").as_posix()
+        self.backends = {}
+        for name, uploaderClass in UPLOADERS.items():
+            try:
+                self.backends[name] = uploaderClass(sessionToken, accessKeyId, secretAccessKey, info)
+            except (CliException, ImportError, ValueError) as e:
+                logger.debug(f"Uploader {name} unavailable, {e}")
+        self.choice = {}
+
+    def setLimiter(self, limiter) -> None:
+        super(AutoUploader, self).setLimiter(limiter)
+        for backend in self.backends.values():
+            backend.setLimiter(limiter)
+
+    def setBandwidth(self, bandwidth) -> None:
+        super(AutoUploader, self).setBandwidth(bandwidth)
+        for backend in self.backends.values():
+            backend.setBandwidth(bandwidth)
+
+    def configure(self, threads=None, partSize=None, threshold=None) -> None:
+        super(AutoUploader, self).configure(threads, partSize, threshold)
+        for backend in self.backends.values():
+            backend.configure(threads, partSize, threshold)
+
+    def close(self) -> None:
+        super(AutoUploader, self).close()
+        for backend in self.backends.values():
+            backend.close()
+
+    def prepare(self, bucket, path="") -> None:
+        """
+        Choose the backends, from the cache or probing them, probe objects are removed afterwards.
+        :param bucket: Bucket object the uploader is set to
+        :param path: key prefix the credentials are scoped to, the probes are put under it
+        """
+        self.choice = self._load()
+        if self.choice:
+            return
+        # credentials scoped to a path can't put anything outside it
+        probePath = f"{path}{self.PROBE_PATH}"
+        try:
+            self.choice = self.probe(probePath)
+        finally:
+            try:
+                bucket.remove([File(name=f"{name}-{kind}", path=probePath, _type="file")
+                               for name in self.backends for kind in self.PROBE_SIZES])
+            except (CliException, requests.TransportError) as e:
+                logger.debug(f"Failed to remove the probes in /{probePath}, {e}")
+        self._save(self.choice)
+
+    def probe(self, path=PROBE_PATH) -> dict:
+        """
+        Upload a small and a large object with each backend and time them.
+        :param path: path in the bucket the probe objects are put in
+        :return: dict of size kind -> name of the backend fastest
+        """
+        timings = {kind: {} for kind in self.PROBE_SIZES}
+        with tempfile.TemporaryDirectory() as directory:
+            for kind, size in self.PROBE_SIZES.items():
+                for name, backend in self.backends.items():
+                    probeFile = File(name=f"{name}-{kind}", path=f"{directory}{os.sep}", _type="file")
+                    with open(f"{probeFile.path}{probeFile.name}", "wb") as file:
+                        file.write(os.urandom(size))
+                    start = time.monotonic()
+                    try:
+                        backend.upload(probeFile, path)
+                    except (CliException, OSError) as e:
+                        logger.debug(f"Probe of {name} failed, {e}")
+                        continue
+                    timings[kind][name] = time.monotonic() - start
+
+        logger.debug(f"Probed {timings}")
+        if not any(timings.values()):
+            raise CliUploaderOptionError("auto", {"error": "no backend succeeded to upload the probe"})
+        fallback = min(timings["large"] or timings["small"], key=(timings["large"] or timings["small"]).get)
+        return {kind: min(timings[kind], key=timings[kind].get) if timings[kind] else fallback
+                for kind in self.PROBE_SIZES}
+
+    def choose(self, size: int) -> Uploader:
+        """
+        Backend to upload a file of the size with.
+        :param size: file size in bytes
+        :return: Uploader object
+        """
+        kind = "large" if size > self.LARGE_SIZE else "small"
+        name = self.choice.get(kind, None)
+        return self.backends[name] if name in self.backends else next(iter(self.backends.values()))
+
+    def upload(self, file: File, path: str, callbackProgress=None, compression=None):
+        """
+        Upload file with the backend chosen for its size.
+        :param file: File object with local file path as File.path
+        :param path: path in the bucket for the file
+        :param callbackProgress: callback function for the progress
+        :param compression: Compression object for the files it applies to
+        :return: what the backend returns
+        """
+        size = os.path.getsize(f"{file.path}{file.name}")
+        return self.choose(size).upload(file, path, callbackProgress, compression=compression)
+
+    def uploadStream(self, stream, path: str, name: str, callbackProgress=None):
+        return self.choose(self.LARGE_SIZE + 1).uploadStream(stream, path, name, callbackProgress)
+
+    def initiate(self, key: str, contentType=None, contentEncoding=None) -> str:
+        # parts of a multipart upload all go to the backend it's initiated by, the large one
+        return self.choose(self.LARGE_SIZE + 1).initiate(key, contentType, contentEncoding)
+
+    def putPart(self, key: str, uploadId: str, partNumber: int, body: bytes) -> str:
+        return self.choose(self.LARGE_SIZE + 1).putPart(key, uploadId, partNumber, body)
+
+    def complete(self, key: str, uploadId: str, etags: list):
+        return self.choose(self.LARGE_SIZE + 1).complete(key, uploadId, etags)
+
+    def abort(self, key: str, uploadId: str) -> None:
+        self.choose(self.LARGE_SIZE + 1).abort(key, uploadId)
+
+    def copy(self, src: str, dst: str, size=0, source=None):
+        return self.choose(size).copy(src, dst, size, source.choose(size) if isinstance(source, AutoUploader)
+                                      else source)
+
+    def _load(self) -> dict:
+        with self._cacheLock:
+            try:
+                with open(self.cache, "r") as file:
+                    entry = json.load(file).get(f"{self.region}/{self.bucket}", {})
+            except (OSError, ValueError):
+                return {}
+        if time.time() - entry.get("time", 0) > self.CACHE_LIFETIME:
+            return {}
+        choice = entry.get("choice", {})
+        return choice if all(name in self.backends for name in choice.values()) else {}
+
+    def _save(self, choice: dict) -> None:
+        with self._cacheLock:
+            try:
+                with open(self.cache, "r") as file:
+                    entries = json.load(file)
+            except (OSError, ValueError):
+                entries = {}
+            entries[f"{self.region}/{self.bucket}"] = {"choice": choice, "time": round(time.time())}
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache)), exist_ok=True)
+            with open(self.cache, "w") as file:
+                json.dump(entries, file)
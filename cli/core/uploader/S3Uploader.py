@@ -1,21 +1,33 @@
 # -*- coding=utf-8
+import os
+import threading
 import boto3
+from boto3.s3.transfer import TransferConfig, ProgressCallbackInvoker, create_transfer_manager
+from botocore.exceptions import ClientError
 from cli.core.uploader import Uploader
 from cli.core.File import File
+from cli.core.Exception import CliThrottledError, CliServerError, CliRejectedError
+from cli.core.utilities.ConcurrencyUtils import THROTTLE_STATUS, RETRY_STATUS, RetryAfter, RetryPolicy
+from cli.core.utilities.BandwidthUtils import CURRENT_JOB, WithJob
+from cli.core.utilities.CompressUtils import SAMPLE_SIZE
+from cli.core.utilities.MimeUtils import GuessMime
+
+# a whole stream handed to the transfer manager can't be sent again once read, its parts are retried by the SDK
+NO_RETRY = RetryPolicy(attempts=1)
 
 
 class S3Uploader(Uploader):
     """
-    S3 SDK uploader, multi-thread.
+    S3 SDK uploader, parts of all the files put by a shared transfer manager.
     """
-    def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str, endpoint: str):
+    def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str, endpoint=None):
         """
         Initiate the uploader.
         :param sessionToken: token
         :param accessKeyId: secretId
         :param secretAccessKey: secretKey
         :param info: bucket info given by DogeCloud
-        :param endpoint: endpoint as COS'
+        :param endpoint: endpoint as COS', the S3 compatible one of the region if None
         """
         super(S3Uploader, self).__init__(sessionToken, accessKeyId, secretAccessKey, info)
 
@@ -24,20 +36,187 @@ class S3Uploader(Uploader):
             aws_access_key_id=accessKeyId,
             aws_secret_access_key=secretAccessKey,
             aws_session_token=sessionToken,
-            endpoint_url=endpoint
+            endpoint_url=endpoint or f"https://cos.{self.region}.myqcloud.com"
         )
+        # transfer managers by their settings, created once each
+        self._transfers = {}
+
+    def close(self) -> None:
+        super(S3Uploader, self).close()
+        with self._poolLock:
+            transfers, self._transfers = list(self._transfers.values()), {}
+        for transfer in transfers:
+            transfer.shutdown()
+
+    def transfer(self):
+        """
+        Transfer manager of the SDK the files of the settings of the current job go through, its threads shared by
+        their parts.
+        """
+        threads, partSize, threshold = self.settings()
+        with self._poolLock:
+            if (threads, partSize, threshold) not in self._transfers:
+                self._transfers[(threads, partSize, threshold)] = create_transfer_manager(
+                    self._uploader, TransferConfig(
+                        multipart_threshold=threshold,
+                        multipart_chunksize=partSize,
+                        max_concurrency=threads
+                    ))
+            return self._transfers[(threads, partSize, threshold)]
 
-    def upload(self, file: File, path: str, callbackProgress=None):
+    def upload(self, file: File, path: str, callbackProgress=None, compression=None):
         """
-        Upload file use S3 SDK, multi-thread.
+        Upload file use S3 SDK, parts of all the files put by the shared transfer manager.
         :param file: File object with local file path as File.path
         :param path: path in the bucket for the file
-        :param callbackProgress: callback function for the progress
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, total bytes)
+        :param compression: Compression object, the file is compressed as it's read if it applies
+        :return: uploading object of the S3
+        """
+        size = os.path.getsize(f"{file.path}/{file.name}")
+        with open(f"{file.path}/{file.name}", "rb") as bytesFile:
+            stream = bytesFile
+            extraArgs = {}
+            if compression is not None:
+                head = bytesFile.read(SAMPLE_SIZE)
+                contentType = GuessMime(file.name, head)
+                if compression.applies(file.name, contentType, head):
+                    stream = compression.reader(bytesFile, head)
+                    extraArgs = {"ContentType": contentType, "ContentEncoding": compression.encoding}
+                else:
+                    bytesFile.seek(0)
+
+            # the SDK reports bytes of each chunk, the callback takes the total
+            uploaded = [0]
+            lock = threading.Lock()
+            charge = self._charge()
+
+            def progress(transferred: int):
+                charge(transferred)
+                if callbackProgress:
+                    with lock:
+                        uploaded[0] += transferred
+                        callbackProgress(uploaded[0], size)
+
+            # the file is read again from the start by every attempt, a compressed stream only once
+            start = bytesFile.tell() if stream is bytesFile else None
+
+            def attempt():
+                if start is not None:
+                    bytesFile.seek(start)
+                    with lock:
+                        uploaded[0] = 0
+                return self.transfer().upload(
+                    stream,
+                    self.bucket,
+                    f"{self.prefix}/{path}{file.name}",
+                    extra_args=extraArgs,
+                    subscribers=[ProgressCallbackInvoker(WithJob(progress))] if callbackProgress or self.bandwidth else None
+                ).result()
+
+            return self._limited(self._call, attempt, size=size, metered=False,
+                                 retry=None if start is not None else NO_RETRY)
+
+    def uploadStream(self, stream, path: str, name: str, callbackProgress=None):
+        """
+        Upload a stream of unknown length use S3 SDK, the transfer manager buffers the parts.
+        :param stream: binary file-like object
+        :param path: path in the bucket for the object
+        :param name: object name
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, None)
         :return: uploading object of the S3
         """
-        return self._uploader.upload_fileobj(
-            open(f"{file.path}/{file.name}", "rb"),
-            self.prefix,
-            f"{path}{file.name}",
-            Callback=callbackProgress
+        uploaded = [0]
+        lock = threading.Lock()
+        charge = self._charge()
+
+        def progress(transferred: int):
+            charge(transferred)
+            if callbackProgress:
+                with lock:
+                    uploaded[0] += transferred
+                    callbackProgress(uploaded[0], None)
+
+        return self._limited(
+            self._call,
+            lambda: self.transfer().upload(
+                stream,
+                self.bucket,
+                f"{self.prefix}/{path}{name}",
+                extra_args={"ContentType": GuessMime(name, b"")},
+                subscribers=[ProgressCallbackInvoker(WithJob(progress))] if callbackProgress or self.bandwidth else None
+            ).result(),
+            metered=False,
+            retry=NO_RETRY
         )
+
+    def initiate(self, key: str, contentType=None, contentEncoding=None) -> str:
+        headers = {"ContentType": contentType} if contentType else {}
+        if contentEncoding:
+            headers["ContentEncoding"] = contentEncoding
+        return self._limited(self._call, self._uploader.create_multipart_upload, Bucket=self.bucket,
+                             Key=f"{self.prefix}/{key}", **headers)["UploadId"]
+
+    def putPart(self, key: str, uploadId: str, partNumber: int, body: bytes) -> str:
+        return self._limited(self._call, self._uploader.upload_part, Bucket=self.bucket, Key=f"{self.prefix}/{key}",
+                             Body=body, PartNumber=partNumber, UploadId=uploadId, size=len(body))["ETag"]
+
+    def complete(self, key: str, uploadId: str, etags: list):
+        return self._limited(self._call, self._uploader.complete_multipart_upload, Bucket=self.bucket,
+                             Key=f"{self.prefix}/{key}", UploadId=uploadId, MultipartUpload={
+                                 "Parts": [{"PartNumber": x + 1, "ETag": etag} for x, etag in enumerate(etags)]
+                             }, idempotent=False)
+
+    def abort(self, key: str, uploadId: str) -> None:
+        self._call(self._uploader.abort_multipart_upload, Bucket=self.bucket, Key=f"{self.prefix}/{key}",
+                   UploadId=uploadId)
+
+    def copy(self, src: str, dst: str, size=0, source=None):
+        """
+        Copy an object server side use S3 SDK, the transfer manager copies large ones in parts.
+        :param src: source key from the root of the bucket copied from
+        :param dst: destination key from the root of bucket
+        :param size: bytes of the object
+        :param source: Uploader of the bucket copied from, this one if None
+        :return: copying object of the S3
+        """
+        source = source or self
+        copySource = {
+            "Bucket": source.bucket,
+            "Key": f"{source.prefix}/{src}"
+        }
+        if size <= self.COPY_THRESHOLD:
+            return self._limited(self._call, self._uploader.copy_object, Bucket=self.bucket,
+                                 Key=f"{self.prefix}/{dst}", CopySource=copySource)
+        return self._limited(self._call, lambda: self.transfer().copy(
+            copySource, self.bucket, f"{self.prefix}/{dst}"
+        ).result())
+
+    def _charge(self):
+        """
+        Function charging the chunks the SDK reports sent to the bandwidth, from its threads, to the job of the caller.
+        """
+        bandwidth, job = self.bandwidth, CURRENT_JOB.get()
+
+        def charge(transferred: int):
+            if bandwidth is not None:
+                bandwidth.consume(transferred, job)
+
+        return charge
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        """
+        Call the SDK, throttling errors raise as CliThrottledError, server errors as CliServerError and the others,
+        like 403 or 400, as CliRejectedError.
+        """
+        try:
+            return func(*args, **kwargs)
+        except ClientError as e:
+            metadata = e.response.get("ResponseMetadata", {})
+            if metadata.get("HTTPStatusCode") in THROTTLE_STATUS:
+                raise CliThrottledError(metadata.get("HTTPStatusCode"), str(e),
+                                        RetryAfter(metadata.get("HTTPHeaders", {})))
+            if metadata.get("HTTPStatusCode") in RETRY_STATUS:
+                raise CliServerError(metadata.get("HTTPStatusCode"), str(e))
+            raise CliRejectedError(metadata.get("HTTPStatusCode"), str(e))
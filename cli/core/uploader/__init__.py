@@ -1,16 +1,56 @@
 # -*- coding=utf-8
 import base64
+import contextlib
+import contextvars
 import json
 import logging
-from ..Exception import CliKeyError
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..Exception import CliKeyError, CliUploaderOptionError
+from ..utilities.BandwidthUtils import WithJob
 
 logger = logging.getLogger(__name__)
 
+# transfer settings of the job the current thread works for, over the ones configured on the uploaders
+CURRENT_TRANSFER = contextvars.ContextVar("peg-transfer", default=None)
+
+
+@contextlib.contextmanager
+def TransferSettings(threads=None, partSize=None, threshold=None):
+    """
+    Transfer settings of a job, for the uploads of the current thread and of the functions bound with WithJob in it.
+    Jobs sharing an uploader each keep their own, None keeps the one configured on the uploader.
+    :param threads: parts in flight at most, shared by all the files of the jobs with as many
+    :param partSize: bytes of a part of multipart uploads
+    :param threshold: bytes of files above which multipart upload is used
+    """
+    settings = {key: value for key, value in (("threads", threads), ("partSize", partSize), ("threshold", threshold))
+                if value is not None}
+    if settings.get("threads", 1) < 1 or settings.get("threshold", 0) < 0 \
+            or settings.get("partSize", Uploader.MINIMUM_PART_SIZE) < Uploader.MINIMUM_PART_SIZE:
+        raise CliUploaderOptionError("job", settings)
+    token = CURRENT_TRANSFER.set(dict(CURRENT_TRANSFER.get() or {}, **settings))
+    try:
+        yield
+    finally:
+        CURRENT_TRANSFER.reset(token)
+
 
 class Uploader:
     """
     Uploader for file uploading in different ways.
     """
+
+    # transfer settings unless configured, parts of every file share the pool of THREADS
+    THREADS = 8
+    PART_SIZE = 8 * 1024 * 1024
+    THRESHOLD = 16 * 1024 * 1024
+    # parts of a multipart upload can't be smaller, except the last one
+    MINIMUM_PART_SIZE = 1024 * 1024
+    # objects above it are copied as ranges in parts, concurrently
+    COPY_THRESHOLD = 1024 * 1024 * 1024
+    COPY_PART_SIZE = 256 * 1024 * 1024
+
     def __init__(self, sessionToken: str, accessKeyId: str, secretAccessKey: str, info: str):
         """
         Initiate the uploader.
@@ -22,6 +62,15 @@ class Uploader:
         self.sessionToken = sessionToken
         self.accessKeyId = accessKeyId
         self.secretAccessKey = secretAccessKey
+        self.limiter = None
+        self.bandwidth = None
+        self.threads = self.THREADS
+        self.partSize = self.PART_SIZE
+        self.threshold = self.THRESHOLD
+        # pools by their threads, jobs of other settings get their own rather than tearing a live one down
+        self._pools = {}
+        self._readAhead = {}
+        self._poolLock = threading.Lock()
 
         info = info + '=' * (4 - (len(info) % 4))
         info = json.loads(base64.b64decode(info))
@@ -34,3 +83,238 @@ class Uploader:
 
         if self.bucket is None or self.region is None or self.prefix == "":
             raise CliKeyError(info)
+
+    def copy(self, src: str, dst: str, size=0, source=None):
+        """
+        Copy an object server side, no content passes through here.
+        :param src: source key from the root of the bucket copied from, as images/a.png
+        :param dst: destination key from the root of bucket
+        :param size: bytes of the object, copied in parts concurrently above COPY_THRESHOLD
+        :param source: Uploader of the bucket copied from, this one if None, readable with the credentials of this one
+        :return: copying object
+        """
+        raise CliKeyError({"data": f"{self.__class__.__name__} doesn't support copy."})
+
+    def uploadStream(self, stream, path: str, name: str, callbackProgress=None):
+        """
+        Upload a stream of unknown length like stdin, parts built as it's read.
+        :param stream: binary file-like object
+        :param path: path in the bucket for the object
+        :param name: object name
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, None)
+        :return: uploading object
+        """
+        raise CliKeyError({"data": f"{self.__class__.__name__} doesn't support streams."})
+
+    def initiate(self, key: str, contentType=None, contentEncoding=None) -> str:
+        """
+        Initiate a multipart upload, its parts put by putPart and concat by complete.
+        :param key: key from the root of bucket
+        :param contentType: content type of the object
+        :param contentEncoding: content encoding of the object, like gzip
+        :return: id of the multipart upload
+        """
+        raise CliKeyError({"data": f"{self.__class__.__name__} doesn't support multipart upload."})
+
+    def putPart(self, key: str, uploadId: str, partNumber: int, body: bytes) -> str:
+        """
+        Put a part of a multipart upload, within the limiter.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        :param partNumber: number of the part, from 1
+        :param body: bytes of the part
+        :return: etag of the part
+        """
+        raise CliKeyError({"data": f"{self.__class__.__name__} doesn't support multipart upload."})
+
+    def complete(self, key: str, uploadId: str, etags: list):
+        """
+        Complete a multipart upload.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        :param etags: etags of the parts in order
+        :return: completing object
+        """
+        raise CliKeyError({"data": f"{self.__class__.__name__} doesn't support multipart upload."})
+
+    def abort(self, key: str, uploadId: str) -> None:
+        """
+        Abort a multipart upload, parts put are dropped.
+        :param key: key from the root of bucket
+        :param uploadId: id of the multipart upload
+        """
+        raise CliKeyError({"data": f"{self.__class__.__name__} doesn't support multipart upload."})
+
+    def setLimiter(self, limiter) -> None:
+        """
+        Set the AdaptiveLimiter requests of the uploader go through.
+        :param limiter: AdaptiveLimiter object, None to send without limit
+        """
+        self.limiter = limiter
+
+    def setBandwidth(self, bandwidth) -> None:
+        """
+        Set the BandwidthLimiter the bytes sent by the uploader are charged to.
+        :param bandwidth: BandwidthLimiter object, None to send without limit
+        """
+        self.bandwidth = bandwidth
+
+    def configure(self, threads=None, partSize=None, threshold=None) -> None:
+        """
+        Tune the transfer settings of the jobs without their own, None keeps the current one.
+        Parts in flight go on in the pool they were submitted to.
+        :param threads: parts in flight at most, shared by all the files
+        :param partSize: bytes of a part of multipart uploads
+        :param threshold: bytes of files above which multipart upload is used
+        """
+        threads = self.threads if threads is None else threads
+        partSize = self.partSize if partSize is None else partSize
+        threshold = self.threshold if threshold is None else threshold
+        if threads < 1 or partSize < self.MINIMUM_PART_SIZE or threshold < 0:
+            raise CliUploaderOptionError(self, {"threads": threads, "partSize": partSize, "threshold": threshold})
+        self.threads, self.partSize, self.threshold = threads, partSize, threshold
+
+    def settings(self) -> tuple:
+        """
+        Transfer settings in effect for the current job, its own over the configured ones.
+        :return: tuple(threads, partSize, threshold)
+        """
+        job = CURRENT_TRANSFER.get() or {}
+        return job.get("threads", self.threads), job.get("partSize", self.partSize), \
+            job.get("threshold", self.threshold)
+
+    def close(self) -> None:
+        """
+        Shut the part pools down once the parts submitted finish.
+        """
+        with self._poolLock:
+            pools, self._pools, self._readAhead = list(self._pools.values()), {}, {}
+        for pool in pools:
+            pool.shutdown()
+
+    def pool(self, threads=None) -> ThreadPoolExecutor:
+        """
+        Thread pool the parts of all the files are put in, one per count of threads, created once.
+        :param threads: threads of the pool, the ones of the current job if None
+        """
+        return self._pooled(threads or self.settings()[0])[0]
+
+    def _pooled(self, threads: int) -> tuple:
+        """
+        Pool of the threads, and the semaphore bounding the parts read ahead of it.
+        """
+        with self._poolLock:
+            if threads not in self._pools:
+                self._pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="peg-part")
+                self._readAhead[threads] = threading.BoundedSemaphore(threads * 2)
+            return self._pools[threads], self._readAhead[threads]
+
+    def _putParts(self, stream, size: int, putPart, callbackProgress=None, partSize=None) -> list:
+        """
+        Put the parts of a stream in the shared pool, parts read ahead of the pool are bounded for all the files.
+        :param stream: binary file-like object, bytes consumed of a CompressedReader are reported as the progress
+        :param size: bytes of the file streamed, None if unknown as a pipe
+        :param putPart: function called with (part number, bytes) in the pool, returning the etag
+        :param callbackProgress: callback function for the progress, called with (uploaded bytes, total bytes)
+        :param partSize: bytes of a part, the one of the job if None
+        :return: list of etags in the order of parts
+        """
+        threads, jobPartSize, _ = self.settings()
+        # a multipart upload has 10000 parts at most
+        partSize = max(partSize or jobPartSize, -(-(size or 0) // 10000))
+        pool, readAhead = self._pooled(threads)
+        uploaded = [0]
+        lock = threading.Lock()
+
+        @WithJob
+        def put(partNumber: int, body: bytes, fileBytes: int) -> str:
+            try:
+                etag = putPart(partNumber, body)
+            finally:
+                readAhead.release()
+            with lock:
+                uploaded[0] += fileBytes
+                if callbackProgress:
+                    callbackProgress(uploaded[0], size)
+            return etag
+
+        def cancel():
+            for future in futures:
+                if future.cancel():
+                    readAhead.release()
+
+        futures = []
+        reported = 0
+        held = False
+        try:
+            readAhead.acquire()
+            held = True
+            body = stream.read(partSize)
+            while True:
+                # one part is looked ahead to tell the last, whose progress covers the rest of the file
+                following = stream.read(partSize) if len(body) == partSize else b""
+                if following or size is None:
+                    fileBytes = getattr(stream, "consumed", reported + len(body)) - reported
+                else:
+                    fileBytes = size - reported
+                reported += fileBytes
+                futures.append(pool.submit(put, len(futures) + 1, body, fileBytes))
+                held = False
+                if not following:
+                    break
+                readAhead.acquire()
+                held = True
+                body = following
+        except BaseException:
+            if held:
+                readAhead.release()
+            cancel()
+            raise
+
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            cancel()
+            raise
+
+    def _copyParts(self, size: int, copyPart) -> list:
+        """
+        Copy the ranges of an object as parts in the shared pool.
+        :param size: bytes of the object
+        :param copyPart: function called with (part number, first byte, last byte) in the pool, returning the etag
+        :return: list of etags in the order of parts
+        """
+        partSize = max(self.COPY_PART_SIZE, -(-size // 10000))
+        futures = [self.pool().submit(WithJob(self._limited), copyPart, x + 1, start, min(start + partSize, size) - 1)
+                   for x, start in enumerate(range(0, size, partSize))]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def prepare(self, bucket, path="") -> None:
+        """
+        Called once set to a bucket, before uploading anything.
+        :param bucket: Bucket object the uploader is set to
+        :param path: key prefix the credentials are scoped to, the whole bucket if empty
+        """
+        pass
+
+    def _limited(self, func, *args, size=0, metered=True, retry=None, idempotent=True, **kwargs):
+        """
+        Call func within the limiter if there is one, once the bandwidth allows size bytes.
+        :param func: function sending the request
+        :param size: bytes sent by the request
+        :param metered: charge size to the bandwidth here, False if func charges the bytes as it sends them
+        :param retry: RetryPolicy of this call, the one of the job or of the limiter if None
+        :param idempotent: false if sending it twice may do it twice, like completing a multipart upload
+        :return: what func returns
+        """
+        # charged before a slot is taken, waiting for bandwidth isn't latency of the request
+        if metered and self.bandwidth is not None:
+            self.bandwidth.consume(size)
+        if self.limiter is None:
+            return func(*args, **kwargs)
+        return self.limiter.run(func, *args, size=size, retry=retry, idempotent=idempotent, **kwargs)
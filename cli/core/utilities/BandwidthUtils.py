@@ -0,0 +1,174 @@
+# -*- coding=utf-8
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+
+from .FormatUtils import ParseSize
+from ..Exception import CliKeyError
+
+logger = logging.getLogger(__name__)
+
+# job the transfers of the current thread are accounted to, bandwidth is shared fairly between jobs
+CURRENT_JOB = contextvars.ContextVar("peg-job", default="default")
+# rates meaning no limit
+UNLIMITED = ("", "0", "off", "none", "unlimited")
+
+
+def ParseRate(rate) -> float:
+    """
+    Parse a rate into bytes per second.
+    :param rate: string like "200M", "50M/s" or "off", a rate of 0 like "0M" is no limit as "0" is
+    :return: bytes per second, None for no limit
+    """
+    rate = str(rate or "").strip()
+    if rate.lower() in UNLIMITED:
+        return None
+    return float(ParseSize(re.sub(r"(/s|ps)$", "", rate, flags=re.IGNORECASE))) or None
+
+
+def ParseSchedule(schedule: str) -> list:
+    """
+    Parse a time-of-day schedule like "09:00-18:00=50M,18:00-09:00=off", windows may span midnight.
+    :param schedule: comma separated HH:MM-HH:MM=rate windows in local time
+    :return: list of tuple(first minute of the day, minute the window ends, bytes per second or None)
+    """
+    windows = []
+    for window in filter(None, (x.strip() for x in str(schedule or "").split(","))):
+        match = re.fullmatch(r"(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(\S+)", window)
+        if not match or int(match.group(1)) > 24 or int(match.group(3)) > 24 \
+                or int(match.group(2)) > 59 or int(match.group(4)) > 59:
+            raise CliKeyError({"schedule": window, "message": "not like HH:MM-HH:MM=rate"})
+        start = int(match.group(1)) * 60 + int(match.group(2))
+        end = int(match.group(3)) * 60 + int(match.group(4))
+        windows.append((start % 1440, end % 1440, ParseRate(match.group(5))))
+    return windows
+
+
+@contextlib.contextmanager
+def BandwidthJob(name: str):
+    """
+    Account the transfers of the current thread, and of the functions bound with WithJob in it, to a job.
+    :param name: job name, jobs waiting for bandwidth are served in turn
+    """
+    token = CURRENT_JOB.set(name)
+    try:
+        yield
+    finally:
+        CURRENT_JOB.reset(token)
+
+
+def WithJob(func):
+    """
+    Bind func to the job of the caller, for running it in a pool whose threads don't know the job.
+    The context of the caller is carried over as a whole, the settings kept in it for the job as well.
+    :param func: function to bind
+    :return: function running func accounted to the job
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # a copy for every call, the bound function may run in several threads at once
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
+
+
+class BandwidthLimiter:
+    """
+    Token bucket of the bytes sent by every transfer of the process, charged once per request before sending.
+    Jobs waiting are served in start-time fair order, so a job with many parts in flight doesn't starve another.
+    """
+
+    def __init__(self, rate=None, schedule=None, burst=1.0):
+        """
+        Initiate the limiter.
+        :param rate: bytes per second, no limit if None
+        :param schedule: list of tuple(first minute, end minute, bytes per second) of ParseSchedule, over rate in them
+        :param burst: seconds of rate saved up while idle at most
+        """
+        self.burst = burst
+        self.rate = None
+        self.schedule = []
+        # read without the lock, transfers skip everything else while unlimited
+        self.limited = False
+
+        self._condition = threading.Condition()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._finish = {}
+        self._virtual = 0.0
+        self.configure(rate, schedule)
+
+    def configure(self, rate=None, schedule=None) -> None:
+        """
+        Set the limit from now on, transfers waiting are woken up to follow it.
+        :param rate: bytes per second, no limit if None or 0
+        :param schedule: list of tuple(first minute, end minute, bytes per second), over rate in the windows
+        """
+        with self._condition:
+            self.rate = rate or None
+            self.schedule = [(start, end, windowRate or None) for start, end, windowRate in schedule or []]
+            self.limited = self.rate is not None or any(x[2] is not None for x in self.schedule)
+            self._condition.notify_all()
+
+    def current(self) -> float:
+        """
+        Rate in effect now, of the schedule window the local time is in or the rate outside them.
+        :return: bytes per second, None for no limit
+        """
+        if self.schedule:
+            now = time.localtime()
+            minute = now.tm_hour * 60 + now.tm_min
+            for start, end, rate in self.schedule:
+                if start <= minute < end or (end <= start and (minute >= start or minute < end)):
+                    return rate
+        return self.rate
+
+    def _refill(self, rate: float):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._last) * rate, rate * self.burst)
+        self._last = now
+
+    def consume(self, size: int, job=None) -> None:
+        """
+        Block until size bytes are allowed to be sent, charged in full even above the burst so the rate holds.
+        :param size: bytes about to be sent
+        :param job: job accounted to, the one of the current thread if None
+        """
+        if not self.limited or size <= 0:
+            return
+        job = job if job is not None else CURRENT_JOB.get()
+        with self._condition:
+            # the tag of a request starts where the job's previous one finished, or now if it was idle
+            start = max(self._virtual, self._finish.get(job, 0.0))
+            self._finish[job] = start + size
+            ticket = (start, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    rate = self.current()
+                    if rate is None:
+                        break
+                    self._refill(rate)
+                    if self._queue[0] is not ticket:
+                        self._condition.wait()
+                    elif self._tokens > 0:
+                        self._tokens -= size
+                        break
+                    else:
+                        # waken at least every second, a schedule window may have changed the rate meanwhile
+                        self._condition.wait(min(max(-self._tokens, 1.0) / rate, 1.0))
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._virtual = max(self._virtual, start)
+                if len(self._finish) > 64:
+                    self._finish = {key: value for key, value in self._finish.items() if value > self._virtual}
+                self._condition.notify_all()
@@ -0,0 +1,186 @@
+# -*- coding=utf-8
+import fnmatch
+import logging
+import os
+import zlib
+from ..Exception import CliUploaderOptionError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# codec -> Content-Encoding the objects are served with
+ENCODINGS = {
+    "gzip": "gzip",
+    "br": "br",
+    "zstd": "zstd",
+}
+
+# MIME patterns and extensions worth compressing, the binary formats are compressed already
+DEFAULT_RULES = (
+    "text/*",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "application/wasm",
+    "image/svg+xml",
+    "image/x-icon",
+    "font/ttf",
+    "font/otf",
+)
+
+# bytes of the head compressed to see if a file is worth it
+SAMPLE_SIZE = 256 * 1024
+
+
+class Compressor:
+    """
+    Streaming compressor of a codec.
+    """
+
+    def __init__(self, codec: str, level=None):
+        """
+        Initiate the compressor, CliUploaderOptionError raises if the codec is not available.
+        :param codec: gzip, br or zstd
+        :param level: compression level, the default of the codec if None
+        """
+        if codec == "gzip":
+            # wbits 31 writes the gzip header and trailer
+            compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+            self._compress, self._finish = compressor.compress, compressor.flush
+        elif codec == "br":
+            if brotli is None:
+                raise CliUploaderOptionError("compression", {"compress": codec, "error": "brotli is not installed"})
+            compressor = brotli.Compressor(quality=6 if level is None else level)
+            self._compress, self._finish = compressor.process, compressor.finish
+        elif codec == "zstd":
+            if zstandard is None:
+                raise CliUploaderOptionError("compression", {"compress": codec, "error": "zstandard is not installed"})
+            compressor = zstandard.ZstdCompressor(level=9 if level is None else level).compressobj()
+            self._compress, self._finish = compressor.compress, compressor.flush
+        else:
+            raise CliUploaderOptionError("compression", {"compress": codec, "error": "unknown codec"})
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def flush(self) -> bytes:
+        return self._finish()
+
+
+class CompressedReader:
+    """
+    Read-only file-like object compressing another one as it is read.
+    """
+
+    def __init__(self, raw, codec: str, head=b"", level=None):
+        """
+        Initiate the reader.
+        :param raw: binary file-like object to compress
+        :param codec: gzip, br or zstd
+        :param head: bytes already read from raw, compressed first
+        :param level: compression level
+        """
+        self.raw = raw
+        self.consumed = 0
+        self._compressor = Compressor(codec, level)
+        self._head = head
+        self._buffer = bytearray()
+        self._done = False
+
+    def read(self, size=-1) -> bytes:
+        """
+        Read compressed bytes.
+        :param size: bytes to read at most, all the rest if negative
+        :return: compressed bytes, empty when the end is reached
+        """
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            if self._head:
+                chunk, self._head = self._head, b""
+            else:
+                chunk = self.raw.read(1024 * 1024)
+            if chunk:
+                self.consumed += len(chunk)
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._done = True
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self.raw.close()
+
+
+class Compression:
+    """
+    Which files are compressed with a codec, by their MIME type or extension and how well their head compresses.
+    """
+
+    def __init__(self, codec: str, rules=None, ratio=0.9, level=None):
+        """
+        Initiate the compression, CliUploaderOptionError raises if the codec is not available.
+        :param codec: gzip, br or zstd
+        :param rules: MIME patterns like text/* and extensions like .js, DEFAULT_RULES if None
+        :param ratio: compressed size of the sample to its size above which files are uploaded as they are
+        :param level: compression level
+        """
+        Compressor(codec, level)
+        self.codec = codec
+        self.encoding = ENCODINGS[codec]
+        self.rules = tuple(rules) if rules else DEFAULT_RULES
+        self.ratio = ratio
+        self.level = level
+
+    def matches(self, name: str, mime: str) -> bool:
+        """
+        Whether the rules cover a file.
+        :param name: filename with extension
+        :param mime: MIME type of the file
+        """
+        extension = os.path.splitext(name)[1].lower()
+        for rule in self.rules:
+            if rule.startswith("."):
+                if rule.lower() == extension:
+                    return True
+            elif fnmatch.fnmatchcase(mime, rule):
+                return True
+        return False
+
+    def applies(self, name: str, mime: str, head: bytes) -> bool:
+        """
+        Whether a file is compressed, covered by the rules and its head compressing well.
+        :param name: filename with extension
+        :param mime: MIME type of the file
+        :param head: leading bytes of the file, the first part already read
+        """
+        if not head or not self.matches(name, mime):
+            return False
+        sample = head[:SAMPLE_SIZE]
+        compressor = Compressor(self.codec, self.level)
+        size = len(compressor.compress(sample)) + len(compressor.flush())
+        logger.debug(f"Sample of {name} compressed {len(sample)} -> {size}")
+        return size <= len(sample) * self.ratio
+
+    def reader(self, raw, head=b"") -> CompressedReader:
+        """
+        Compressed stream of a file.
+        :param raw: binary file-like object positioned after head
+        :param head: bytes already read from raw
+        """
+        return CompressedReader(raw, self.codec, head, self.level)
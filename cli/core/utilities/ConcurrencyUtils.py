@@ -0,0 +1,351 @@
+# -*- coding=utf-8
+import contextlib
+import contextvars
+import email.utils
+import logging
+import random
+import threading
+import time
+import weakref
+
+import httpx as requests
+
+from .BandwidthUtils import WithJob
+from ..Exception import CliThrottledError, CliServerError
+
+logger = logging.getLogger(__name__)
+
+# limits of the job the current thread works for, over the limiter it shares with other jobs
+CURRENT_LIMITS = contextvars.ContextVar("peg-limits", default=None)
+
+# status codes DogeCloud and COS answer with when an account is being rate limited
+THROTTLE_STATUS = (429, 503)
+# status codes of server errors worth sending the request again for
+RETRY_STATUS = (500, 502, 504)
+
+
+def RetryAfter(headers) -> float:
+    """
+    Parse the Retry-After header into seconds to wait.
+    :param headers: response headers, any mapping with get()
+    :return: seconds to wait, None if the header is absent or malformed
+    """
+    value = headers.get("retry-after", None) if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def RaiseForThrottle(response) -> None:
+    """
+    Raise CliThrottledError if the response is a throttling one.
+    :param response: httpx response
+    :return: error raises if throttled
+    """
+    if response.status_code in THROTTLE_STATUS:
+        raise CliThrottledError(response.status_code, response.text, RetryAfter(response.headers))
+
+
+def RaiseForRetry(response) -> None:
+    """
+    Raise CliThrottledError or CliServerError if the response is worth sending again.
+    :param response: httpx response
+    :return: error raises if throttled or failed on the server
+    """
+    RaiseForThrottle(response)
+    if response.status_code in RETRY_STATUS:
+        raise CliServerError(response.status_code, response.text)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for transient errors, retries of a job bounded by a budget.
+    """
+
+    def __init__(self, attempts=5, base=0.2, cap=20.0, budget=100):
+        """
+        Initiate the policy.
+        :param attempts: times a request is tried at most
+        :param base: seconds waited before the first retry at most
+        :param cap: seconds waited before a retry at most
+        :param budget: retries of all the requests of the job, unlimited if None
+        """
+        self.attempts = max(1, attempts)
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def retryable(error: BaseException, idempotent=True) -> bool:
+        """
+        Whether an error is transient, throttled, timed out, reset, or failed on the server.
+        A request which isn't idempotent is only sent again if it surely wasn't processed, throttled or not connected.
+        """
+        if not idempotent:
+            return isinstance(error, (CliThrottledError, requests.ConnectError, requests.ConnectTimeout,
+                                      ConnectionRefusedError))
+        return isinstance(error, (CliThrottledError, CliServerError, requests.TransportError, ConnectionError,
+                                  TimeoutError))
+
+    def allow(self, attempt: int, error: BaseException, idempotent=True) -> bool:
+        """
+        Whether to try again after an attempt failed, spending the budget if so.
+        :param attempt: attempts made, from 1
+        :param error: error the attempt raised
+        :param idempotent: whether the request does the same sent twice, like a move or a completion doesn't
+        """
+        if attempt >= self.attempts or not self.retryable(error, idempotent):
+            return False
+        with self._lock:
+            if self.budget is not None and self.retried >= self.budget:
+                logger.debug(f"Retry budget {self.budget} spent, {error}")
+                return False
+            self.retried += 1
+        return True
+
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before the next attempt, random so failed requests don't come back together.
+        :param attempt: attempts made, from 1
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+class JobLimits:
+    """
+    What a job sets for itself over the limiter it shares with other jobs, its own bound of requests in flight, its
+    retry policy with the budget, and a callback of the decisions of the limiter while it runs.
+    """
+
+    def __init__(self, maximum=None, retry=None, callbackDecision=None):
+        """
+        Initiate the limits.
+        :param maximum: requests of the job in flight at most, under the bound of the limiter, only that one if None
+        :param retry: RetryPolicy of the job, the limiter's if None
+        :param callbackDecision: callback function called with (old, new, reason) when the limit changes meanwhile
+        """
+        self.maximum = maximum
+        self.retry = retry
+        self.callbackDecision = callbackDecision
+        self.active = True
+        self.slots = threading.BoundedSemaphore(maximum) if maximum else None
+
+
+@contextlib.contextmanager
+def LimiterJob(maximum=None, retry=None, callbackDecision=None):
+    """
+    Run the requests of the current thread, and of the functions bound with WithJob in it, within limits of their own.
+    Jobs of a process served by the daemon share its limiter, what one sets this way doesn't change another.
+    :param maximum: requests of the job in flight at most, only the bound of the limiter if None
+    :param retry: RetryPolicy of the job, the one of the job it runs in or of the limiter if None
+    :param callbackDecision: callback function called with (old, new, reason) when the limit changes meanwhile
+    :return: JobLimits object
+    """
+    outer = CURRENT_LIMITS.get()
+    limits = JobLimits(maximum, retry or (outer.retry if outer is not None else None),
+                       WithJob(callbackDecision) if callbackDecision else None)
+    token = CURRENT_LIMITS.set(limits)
+    try:
+        yield limits
+    finally:
+        limits.active = False
+        CURRENT_LIMITS.reset(token)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limiter for in-flight requests, shared by everything talking to the same account.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, backoff=0.5, tolerance=2.0, attempts=5,
+                 callbackDecision=None, retry=None):
+        """
+        Initiate the limiter.
+        :param initial: in-flight requests allowed at the beginning
+        :param minimum: lower bound of in-flight requests
+        :param maximum: upper bound of in-flight requests
+        :param backoff: multiplier applied to the limit when backing off
+        :param tolerance: latency over the best seen latency multiplied by it is considered rising
+        :param attempts: times a call failing transiently is tried before giving up, unless retry is given
+        :param callbackDecision: callback function called with (old, new, reason) when the limit changes
+        :param retry: RetryPolicy of the calls outside of a job, one of attempts without budget if None
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        # budgets are per job, given by LimiterJob, a limiter lives as long as the session
+        self.retry = retry or RetryPolicy(attempts=attempts, budget=None)
+        self.callbackDecision = callbackDecision
+
+        self._condition = threading.Condition()
+        # jobs told about the decisions while they run
+        self._jobs = weakref.WeakSet()
+        self._inflight = 0
+        self._pausedUntil = 0.0
+        self._lastDecrease = 0.0
+        self._latency = None
+        self._bestLatency = None
+        self._lastThroughput = 0.0
+        self._resetWindow()
+
+    def _resetWindow(self):
+        self._windowStart = time.monotonic()
+        self._windowCount = 0
+        self._windowBytes = 0
+
+    def _change(self, limit: float, reason: str):
+        limit = min(max(limit, self.minimum), self.maximum)
+        if int(limit) != int(self.limit):
+            logger.debug(f"Concurrency {int(self.limit)} -> {int(limit)}, {reason}")
+            if self.callbackDecision:
+                self.callbackDecision(int(self.limit), int(limit), reason)
+            for job in [job for job in self._jobs if job.active]:
+                job.callbackDecision(int(self.limit), int(limit), reason)
+        self.limit = limit
+
+    def _decrease(self, reason: str):
+        # only cut once per round trip, a burst of throttled responses is one congestion signal
+        now = time.monotonic()
+        if now - self._lastDecrease < max(self._latency or 0.0, 1.0):
+            return
+        self._lastDecrease = now
+        self._change(self.limit * self.backoff, reason)
+        self._lastThroughput = 0.0
+        self._resetWindow()
+
+    def tune(self, initial=None, maximum=None, callbackDecision=None, retry=None) -> None:
+        """
+        Adjust the limiter for a job run with it.
+        :param initial: in-flight requests allowed from now on, kept if None
+        :param maximum: upper bound of in-flight requests, kept if None
+        :param callbackDecision: callback function called with (old, new, reason) when the limit changes
+        :param retry: RetryPolicy with the budget of the job, kept if None
+        """
+        with self._condition:
+            if retry is not None:
+                self.retry = retry
+            if maximum is not None:
+                self.maximum = max(self.minimum, maximum)
+            if initial is not None:
+                self.limit = float(initial)
+            self.limit = min(max(self.limit, self.minimum), self.maximum)
+            self.callbackDecision = callbackDecision
+            self._condition.notify_all()
+
+    def acquire(self) -> None:
+        """
+        Block until a request is allowed to be sent.
+        """
+        with self._condition:
+            while True:
+                wait = self._pausedUntil - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                elif self._inflight < int(self.limit):
+                    self._inflight += 1
+                    return
+                else:
+                    self._condition.wait()
+
+    def release(self, elapsed: float, size=0, throttled=False, retryAfter=None, failed=False) -> None:
+        """
+        Report a finished request and adjust the limit.
+        :param elapsed: seconds the request took
+        :param size: bytes sent by the request, 0 for requests counted by number
+        :param throttled: whether the request was throttled
+        :param retryAfter: seconds asked to wait by the server
+        :param failed: request failed otherwise, only the slot is given back
+        """
+        with self._condition:
+            self._inflight -= 1
+            if failed:
+                self._condition.notify_all()
+                return
+            if throttled:
+                self._pausedUntil = max(self._pausedUntil, time.monotonic() + (retryAfter or 1.0))
+                self._decrease("throttled" if retryAfter is None else f"throttled, retry after {retryAfter:.1f}s")
+                self._condition.notify_all()
+                return
+
+            # latency per byte for transfers, per request otherwise, so mixed sizes stay comparable
+            latency = elapsed / size if size else elapsed
+            self._latency = latency if self._latency is None else self._latency * 0.8 + latency * 0.2
+            self._bestLatency = latency if self._bestLatency is None else min(self._bestLatency, latency)
+
+            self._windowCount += 1
+            self._windowBytes += size
+            if self._windowCount >= max(int(self.limit) * 2, 8):
+                duration = max(time.monotonic() - self._windowStart, 1e-6)
+                throughput = (self._windowBytes or self._windowCount) / duration
+                if self._latency > self._bestLatency * self.tolerance:
+                    self._decrease("latency rising")
+                elif throughput > self._lastThroughput * 1.05:
+                    self._change(self.limit + 1, f"throughput up to {throughput:.1f}/s")
+                    self._lastThroughput = throughput
+                    self._resetWindow()
+                else:
+                    # plateau, hold the limit and compare the next window with this one
+                    self._lastThroughput = throughput
+                    self._resetWindow()
+            self._condition.notify_all()
+
+    def run(self, func, *args, size=0, retry=None, idempotent=True, **kwargs):
+        """
+        Call func within the limit, calls failing transiently are tried again as the retry policy allows.
+        Arguments are sent again as they are, a part is replayed from its buffer rather than the file restarted.
+        :param func: function sending the request
+        :param size: bytes sent by the request
+        :param retry: RetryPolicy of this call, the one of the job or of the limiter if None
+        :param idempotent: false if sending it twice may do it twice, it's then only sent again if not processed
+        :return: what func returns
+        """
+        limits = CURRENT_LIMITS.get()
+        if limits is not None and limits.callbackDecision is not None and limits not in self._jobs:
+            with self._condition:
+                self._jobs.add(limits)
+        retry = retry or (limits.retry if limits is not None else None) or self.retry
+        # the slot of the job is taken first, a job at its own bound doesn't hold one of the others meanwhile
+        slots = limits.slots if limits is not None else None
+        if slots is not None:
+            slots.acquire()
+        try:
+            return self._run(func, args, kwargs, size, retry, idempotent)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    def _run(self, func, args: tuple, kwargs: dict, size: int, retry: RetryPolicy, idempotent: bool):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except CliThrottledError as e:
+                self.release(time.monotonic() - start, throttled=True, retryAfter=e.retryAfter)
+                # the limiter is paused for as long as the server asked
+                if not retry.allow(attempt, e, idempotent):
+                    raise
+                continue
+            except BaseException as e:
+                self.release(time.monotonic() - start, failed=True)
+                if not retry.allow(attempt, e, idempotent):
+                    raise
+                delay = retry.delay(attempt)
+                logger.debug(f"Attempt {attempt} failed, retry in {delay:.2f}s, {e}")
+                time.sleep(delay)
+                continue
+            self.release(time.monotonic() - start, size=size)
+            return result
@@ -0,0 +1,66 @@
+# -*- coding=utf-8
+import datetime
+import logging
+import re
+
+from ..Exception import CliKeyError
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def ParseSize(size: str) -> int:
+    """
+    Parse a human size into bytes, binary units.
+    :param size: string like "5M", "512K", "1.5G" or "2048"
+    :return: bytes as int
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([BKMGT]?)(?:i?B)?\s*", str(size), re.IGNORECASE)
+    if not match:
+        raise CliKeyError({"size": size, "message": "unrecognized size"})
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def ParseDuration(duration: str) -> int:
+    """
+    Parse a duration into seconds.
+    :param duration: string like "30d", "12h", "2w" or "90" as seconds
+    :return: seconds as int
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", str(duration))
+    if not match:
+        raise CliKeyError({"duration": duration, "message": "unrecognized duration"})
+    return int(float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"])
+
+
+def ParseTime(value) -> int:
+    """
+    Parse the time of a listed file into epoch seconds.
+    :param value: epoch in seconds or milliseconds, or string like "2021-09-01 12:00:00"
+    :return: epoch seconds as int, 0 if unknown
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        value = int(value)
+        # milliseconds are given by some of the APIs
+        return value // 1000 if value > 100000000000 else value
+    try:
+        return int(datetime.datetime.fromisoformat(str(value)).timestamp())
+    except ValueError:
+        logger.debug(f"Unrecognized time {value}")
+        return 0
+
+
+def HumanSize(size: int) -> str:
+    """
+    Format bytes into human size, binary units.
+    :param size: bytes
+    :return: string like "1.50 MiB"
+    """
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if abs(size) < 1024 or unit == "TiB":
+            return f"{size:.2f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
@@ -0,0 +1,86 @@
+# -*- coding=utf-8
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+import magic
+
+logger = logging.getLogger(__name__)
+
+# common web assets, in front of the system table which differs between platforms
+EXTENSION_TABLE = {
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".mjs": "application/javascript",
+    ".json": "application/json",
+    ".map": "application/json",
+    ".xml": "application/xml",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+    ".csv": "text/csv",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".ico": "image/x-icon",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".ttf": "font/ttf",
+    ".otf": "font/otf",
+    ".wasm": "application/wasm",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".mp3": "audio/mpeg",
+    ".pdf": "application/pdf",
+    ".zip": "application/zip",
+    ".gz": "application/gzip",
+    ".tar": "application/x-tar",
+}
+
+# bytes of the head used as the signature of the content kind, enough for the magic numbers
+SIGNATURE_SIZE = 16
+
+# bytes handed to libmagic, as much as it reads from a file itself
+SNIFF_SIZE = 1024 * 1024
+
+# signatures sniffed kept at most, the least recently used one dropped for a new one
+CACHE_SIZE = 4096
+
+_cache = OrderedDict()
+_cacheLock = threading.Lock()
+
+
+def GuessMime(name: str, head: bytes) -> str:
+    """
+    Resolve the MIME type by the extension table, then libmagic on the head of the content, cached by signature.
+    :param name: filename with extension, as index.js
+    :param head: leading bytes of the content, the first slice already read is enough
+    :return: MIME type like "image/png"
+    """
+    extension = os.path.splitext(name)[1].lower()
+    mime = EXTENSION_TABLE.get(extension, None) or mimetypes.types_map.get(extension, None)
+    if mime:
+        return mime
+
+    key = (extension, head[:SIGNATURE_SIZE])
+    with _cacheLock:
+        mime = _cache.get(key, None)
+        if mime:
+            _cache.move_to_end(key)
+    if mime:
+        return mime
+
+    mime = magic.from_buffer(head[:SNIFF_SIZE], mime=True) if head else "application/octet-stream"
+    logger.debug(f"Sniffed {name} as {mime}")
+    with _cacheLock:
+        _cache[key] = mime
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return mime
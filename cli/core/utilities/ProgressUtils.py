@@ -0,0 +1,207 @@
+# -*- coding=utf-8
+import json
+import logging
+import sys
+import threading
+import time
+
+from .FormatUtils import HumanSize
+
+logger = logging.getLogger(__name__)
+
+
+class Progress:
+    """
+    Aggregate progress of a transfer job, renders no more often than the interval.
+    """
+
+    def __init__(self, totalFiles=0, totalBytes=0, stream=None, interval=0.25, active=3):
+        """
+        Initiate the progress.
+        :param totalFiles: files in the job
+        :param totalBytes: bytes in the job
+        :param stream: where to render to, stderr if None
+        :param interval: seconds between renders at least
+        :param active: largest active transfers shown
+        """
+        self.totalFiles = totalFiles
+        self.totalBytes = totalBytes
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.active = active
+
+        self.doneFiles = 0
+        self.failedFiles = 0
+        self.doneBytes = 0
+        self.rate = 0.0
+        self.started = time.monotonic()
+
+        # name -> [bytes done, size]
+        self._transfers = {}
+        self._lock = threading.Lock()
+        self._lastRender = 0.0
+        self._lastBytes = 0
+
+    def callback(self, name: str):
+        """
+        Progress callback for an uploader, called with (consumed bytes, total bytes).
+        :param name: name of the transfer started
+        :return: callback function
+        """
+        return lambda consumed, total: self.update(name, consumed)
+
+    def start(self, name: str, size: int) -> None:
+        with self._lock:
+            self._transfers[name] = [0, size]
+            self._event("start", file=name, size=size)
+
+    def update(self, name: str, done: int) -> None:
+        with self._lock:
+            transfer = self._transfers.get(name, None)
+            if transfer is None or done <= transfer[0]:
+                return
+            self.doneBytes += done - transfer[0]
+            transfer[0] = done
+            self._tick()
+
+    def finish(self, name: str, error=None) -> None:
+        with self._lock:
+            transfer = self._transfers.pop(name, [0, 0])
+            if error is None:
+                self.doneFiles += 1
+                self.doneBytes += transfer[1] - transfer[0]
+                self._event("done", file=name, size=transfer[1])
+            else:
+                self.failedFiles += 1
+                self._event("error", file=name, message=str(error))
+            self._tick()
+
+    def close(self) -> None:
+        with self._lock:
+            self._measure()
+            self._render(final=True)
+
+    def eta(self) -> float:
+        """
+        Seconds to go at the current rate, None if unknown.
+        """
+        if self.rate <= 0:
+            return None
+        return max(0.0, (self.totalBytes - self.doneBytes) / self.rate)
+
+    def largest(self) -> list:
+        """
+        Largest active transfers, list of tuple(name, bytes done, size).
+        """
+        return sorted([(name, done, size) for name, (done, size) in self._transfers.items()],
+                      key=lambda x: x[2], reverse=True)[:self.active]
+
+    def _tick(self):
+        now = time.monotonic()
+        if now - self._lastRender < self.interval:
+            return
+        self._measure(now)
+        self._render()
+
+    def _measure(self, now=None):
+        now = now or time.monotonic()
+        elapsed = now - self._lastRender if self._lastRender else now - self.started
+        if elapsed > 0:
+            rate = (self.doneBytes - self._lastBytes) / elapsed
+            self.rate = rate if self.rate == 0 else self.rate * 0.7 + rate * 0.3
+        self._lastRender = now
+        self._lastBytes = self.doneBytes
+
+    def _event(self, event: str, **kwargs):
+        pass
+
+    def _render(self, final=False):
+        pass
+
+
+class BarProgress(Progress):
+    """
+    One progress display for the job, drawn in place on terminals and as a line now and then otherwise.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(BarProgress, self).__init__(*args, **kwargs)
+        self.isTerminal = hasattr(self.stream, "isatty") and self.stream.isatty()
+        if not self.isTerminal:
+            # logs of CI get a line every few seconds instead of a redraw
+            self.interval = max(self.interval, 5.0)
+        self._drawn = 0
+
+    def _event(self, event: str, **kwargs):
+        if event == "error":
+            self._clear()
+            self.stream.write(f"failed {kwargs['file']}: {kwargs['message']}\n")
+            self._drawn = 0
+
+    def _clear(self):
+        if self.isTerminal and self._drawn:
+            self.stream.write(f"\x1b[{self._drawn}F\x1b[J")
+
+    def _render(self, final=False):
+        eta = self.eta()
+        percent = self.doneBytes / self.totalBytes * 100 if self.totalBytes else 100.0
+        width = 30
+        filled = round(width * percent / 100)
+        lines = [
+            f"[{'#' * filled}{'.' * (width - filled)}] {percent:5.1f}% "
+            f"{HumanSize(self.doneBytes)}/{HumanSize(self.totalBytes)} "
+            f"files {self.doneFiles}/{self.totalFiles}"
+            f"{f' failed {self.failedFiles}' if self.failedFiles else ''} "
+            f"{self.rate / 1024 / 1024:.2f} MB/s "
+            f"ETA {time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None and not final else '--:--:--'}"
+        ]
+        if self.isTerminal and not final:
+            lines += [f"  {done / size * 100 if size else 100:5.1f}% {HumanSize(size):>12} {name}"
+                      for name, done, size in self.largest()]
+        self._clear()
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+        self._drawn = len(lines)
+
+
+class JsonlProgress(Progress):
+    """
+    Machine readable progress, an event a line.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(JsonlProgress, self).__init__(*args, **kwargs)
+        if "stream" not in kwargs:
+            self.stream = sys.stdout
+        self.interval = max(self.interval, 1.0)
+
+    def _write(self, event: dict):
+        self.stream.write(json.dumps(event, separators=(",", ":")) + "\n")
+        self.stream.flush()
+
+    def _event(self, event: str, **kwargs):
+        self._write({"event": event, "time": round(time.time(), 3), **kwargs})
+
+    def _render(self, final=False):
+        self._write({
+            "event": "summary" if final else "progress",
+            "time": round(time.time(), 3),
+            "bytes": self.doneBytes,
+            "totalBytes": self.totalBytes,
+            "files": self.doneFiles,
+            "failed": self.failedFiles,
+            "totalFiles": self.totalFiles,
+            "rate": round(self.rate),
+            "eta": None if final or self.eta() is None else round(self.eta(), 1)
+        })
+
+
+def CreateProgress(mode: str, totalFiles=0, totalBytes=0) -> Progress:
+    """
+    Create a progress of the mode.
+    :param mode: "bar", "jsonl", or "none"
+    :param totalFiles: files in the job
+    :param totalBytes: bytes in the job
+    :return: Progress object
+    """
+    return {"bar": BarProgress, "jsonl": JsonlProgress}.get(mode, Progress)(totalFiles, totalBytes)
@@ -106,3 +106,55 @@ def CompactPairs(obj: dict) -> str:
     keys = list(obj.keys())
     keys.sort()
     return "&".join([f"{key}={obj[key]}" for key in keys])
+
+
+def FileMD5(filePath: str, partSize=0) -> str:
+    """
+    MD5 of a local file, hexed, or the multipart ETag form if partSize given.
+    :param filePath: local file path
+    :param partSize: bytes of a part the object was uploaded with, 0 for a single put
+    :return: string like "9e107d9d372bb6826bd81d3542a419d6" or "9e107d9d372bb6826bd81d3542a419d6-3"
+    """
+    whole = hashlib.md5()
+    parts = []
+    with open(filePath, "rb") as file:
+        while True:
+            chunk = file.read(partSize or 1024 * 1024)
+            if not chunk:
+                break
+            if partSize:
+                parts.append(hashlib.md5(chunk).digest())
+            else:
+                whole.update(chunk)
+    if not partSize:
+        return whole.hexdigest()
+    return f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+
+
+def MatchesHash(filePath: str, size: int, remoteHash: str, hashCache=None) -> bool:
+    """
+    Whether a local file has the content of a remote object by its hash, plain or multipart MD5.
+    :param filePath: local file path
+    :param size: local file size
+    :param remoteHash: hash of the object listed, ETag form
+    :param hashCache: dict of (filePath, partSize) -> hash shared by the calls, reused if given
+    :return: True if identical
+    """
+    remoteHash = (remoteHash or "").strip('"').lower()
+    if not remoteHash:
+        return False
+    hashCache = {} if hashCache is None else hashCache
+
+    if "-" not in remoteHash:
+        candidates = [0]
+    else:
+        # part size is not recorded, the ones SDKs use that give the same part count are tried
+        count = int(remoteHash.rpartition("-")[2] or 0) if remoteHash.rpartition("-")[2].isdigit() else 0
+        candidates = [partSize * 1024 * 1024 for partSize in [1, 2, 4, 5, 8, 16, 32, 64, 128]
+                      if count and -(-size // (partSize * 1024 * 1024)) == count]
+    for partSize in candidates:
+        if (filePath, partSize) not in hashCache:
+            hashCache[(filePath, partSize)] = FileMD5(filePath, partSize)
+        if hashCache[(filePath, partSize)] == remoteHash:
+            return True
+    return False
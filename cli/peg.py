@@ -1,25 +1,75 @@
+import contextlib
 import json
 import logging
 import os
+import itertools
+import signal
+import sys
+import threading
 import time
 import urllib.parse
 from pathlib import Path
 import click
 import httpx as requests
-from tqdm import tqdm
 
-from cli.core.Exception import CliRequestError, CliException
+from cli.core.Exception import CliRequestError, CliException, CliUploaderOptionError
 from cli.core.utilities.PathUtils import NormalizePath, KeySplit
 from cli.core.helpers import LoginHelper
-from cli.core.User import User
-from cli.core.Bucket import Bucket
-from cli.core.File import File
-from cli.core.uploader.CosUploader import CosUploader
+from cli.core.Index import BucketIndex
+from cli.core.Client import PegClient
+from cli.core.Batch import BatchRunner
+from cli.core.Copy import CopyScope
+from cli.core.Daemon import DaemonServer, Forward, SocketPath
+from cli.core.Watcher import WatchJob
+from cli.core.Shard import SHARD_MODES, ParseShard, MergeManifests
+from cli.core.Prune import KEEP_SCOPES
+from cli.core.Snapshot import Snapshot, DiffSnapshots
+from cli.core.Usage import DiskUsage
+from cli.core.utilities.FormatUtils import ParseSize, ParseDuration, HumanSize
+from cli.core.utilities.ProgressUtils import CreateProgress
+from cli.core.utilities.CompressUtils import Compression
+from cli.core.utilities.ConcurrencyUtils import RetryPolicy, LimiterJob
+from cli.core.utilities.BandwidthUtils import BandwidthLimiter, BandwidthJob, ParseRate, ParseSchedule
+from cli.core.uploader import TransferSettings
+from cli.core.uploader.Registry import UPLOADERS
 
 logger = logging.getLogger(__name__)
 
+# clients of the process by token, with the time tokens were last checked valid
+_clients = {}
+_clientLock = threading.Lock()
+_validated = {}
+_serving = threading.local()
+# bandwidth of every transfer of the process, shared by the clients of all the tokens
+_bandwidth = BandwidthLimiter()
+_requests = itertools.count(1)
 
-@click.group()
+# tokens checked valid are trusted for this long without asking again
+TOKEN_VALIDITY = 600
+
+
+class _ForwardingGroup(click.Group):
+    """
+    Commands are run by peg serve when it is running, unless PEG_NO_DAEMON is set.
+    """
+
+    # commands worth forwarding, the interactive and long running ones are run here
+    FORWARDED = {"upload", "pull", "prune", "snapshot", "ls", "cp", "mv", "link", "rm", "mkdir", "index", "find", "du"}
+
+    def invoke(self, ctx):
+        args = [*ctx.protected_args, *ctx.args]
+        # stdin of this process can't be read by the daemon
+        if args and args[0] in self.FORWARDED and "-" not in args and not os.environ.get("PEG_NO_DAEMON") \
+                and not getattr(_serving, "active", False):
+            code = Forward(_absolutePaths(self, args))
+            if code is not None:
+                ctx.exit(code)
+        # every command run, here or served by the daemon, spends a retry budget of its own
+        with LimiterJob(retry=RetryPolicy()):
+            return super(_ForwardingGroup, self).invoke(ctx)
+
+
+@click.group(cls=_ForwardingGroup)
 def main():
     pass
 
@@ -29,15 +79,16 @@ def main():
 )
 @click.option(
     "--file",
-    "-f", type=click.STRING,
+    "-f", type=click.Path(allow_dash=True),
     required=True,
-    help="file/folder path."
+    help="file/folder path, - to read from stdin with the filename in the path."
 )
 @click.option(
     "--bucket",
     "-b", type=click.STRING,
     required=True,
-    help="bucket name as same as ls shows."
+    multiple=True,
+    help="bucket name as same as ls shows, repeatable to upload to several buckets reading the files once."
 )
 @click.option(
     "--path",
@@ -45,10 +96,153 @@ def main():
     required=True,
     help="path from the / of bucket to where the FILE should located."
 )
-def upload(file, bucket, path):
-    if not os.path.exists(file):
+@click.option(
+    "--concurrency",
+    "-c", type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="requests in flight at the beginning, adjusted by throughput and throttling."
+)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=32,
+    show_default=True,
+    help="upper bound of requests in flight."
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="times a request failing transiently, timed out, reset, 5xx or throttled, is tried."
+)
+@click.option(
+    "--retry-budget",
+    type=click.IntRange(min=0),
+    default=1000,
+    show_default=True,
+    help="retries of the whole job at most, so a failing endpoint isn't hammered."
+)
+@click.option(
+    "--show-concurrency",
+    is_flag=True,
+    default=False,
+    help="print every concurrency decision, for tuning."
+)
+@click.option(
+    "--progress",
+    type=click.Choice(["bar", "jsonl", "none"]),
+    default="bar",
+    show_default=True,
+    help="one display for the whole job, jsonl events on stdout, or nothing."
+)
+@click.option(
+    "--dedup",
+    is_flag=True,
+    default=False,
+    help="skip files identical to the objects in the bucket, copy duplicates in the job server side."
+)
+@click.option(
+    "--compress",
+    type=click.Choice(["gzip", "br", "zstd"]),
+    required=False,
+    help="compress text-like files as they are uploaded, served with the Content-Encoding."
+)
+@click.option(
+    "--compress-type",
+    type=click.STRING,
+    multiple=True,
+    help="MIME pattern like text/* or extension like .js to compress, repeatable, web text types by default."
+)
+@click.option(
+    "--uploader",
+    type=click.Choice(["auto", *UPLOADERS]),
+    default="cos",
+    show_default=True,
+    help="backend to upload with, auto probes them once per bucket and picks the fastest by file size."
+)
+@click.option(
+    "--threads",
+    type=click.IntRange(min=1),
+    required=False,
+    help="parts in flight of all the files, transfer.threads of the config or --max-concurrency by default."
+)
+@click.option(
+    "--part-size",
+    type=click.STRING,
+    required=False,
+    help="part size of multipart uploads like 8M, transfer.partSize of the config or the uploader's by default."
+)
+@click.option(
+    "--multipart-threshold",
+    type=click.STRING,
+    required=False,
+    help="size like 16M above which files are uploaded in parts, transfer.threshold of the config by default."
+)
+@click.option(
+    "--shard",
+    type=click.STRING,
+    required=False,
+    help="upload the i-th of N disjoint shares of the files like 2/4, for N hosts sharing the folder."
+)
+@click.option(
+    "--shard-mode",
+    type=click.Choice(SHARD_MODES),
+    default="hash",
+    show_default=True,
+    help="split by the hash of keys, or balance the bytes of shards."
+)
+@click.option(
+    "--manifest",
+    type=click.Path(file_okay=False),
+    required=False,
+    help="folder the completion manifest of the shard is written to, ~/.peg/shards by default."
+)
+@click.option(
+    "--limit-rate",
+    type=click.STRING,
+    required=False,
+    help="bytes per second like 200M of all the transfers of the process, transfer.limitRate of the config by default."
+)
+@click.option(
+    "--limit-schedule",
+    type=click.STRING,
+    required=False,
+    help="rates by local time like 09:00-18:00=50M,18:00-09:00=off, over --limit-rate in the windows."
+)
+def upload(file, bucket, path, concurrency, max_concurrency, retries, retry_budget, show_concurrency, progress, dedup,
+           compress, compress_type, uploader, threads, part_size, multipart_threshold, shard, shard_mode, manifest,
+           limit_rate, limit_schedule):
+    if file != "-" and not os.path.exists(file):
         click.echo(f"file {file} doesn't exist.")
         return
+    if shard and file == "-":
+        click.echo("Uploading stdin can't be sharded.")
+        return
+    if file == "-" and (compress or compress_type or dedup):
+        click.echo("Uploading stdin doesn't support --compress, --compress-type or --dedup.")
+        return
+    try:
+        shardIndex, shardCount = ParseShard(shard) if shard else (None, None)
+    except ValueError as e:
+        click.echo(str(e))
+        return
+    if file == "-" and (str(path).endswith("/") or not KeySplit(path)[1]):
+        click.echo("Uploading stdin needs a path with filename, such as backups/home.tar.zst.")
+        return
+    buckets = list(dict.fromkeys(bucket))
+    if len(buckets) > 1 and (file == "-" or dedup):
+        click.echo("Uploading to several buckets doesn't support stdin or --dedup.")
+        return
+
+    compression = None
+    if compress:
+        try:
+            compression = Compression(compress, rules=compress_type)
+        except CliException as e:
+            click.echo(str(e))
+            return
 
     token = _feastToken()
     if not token:
@@ -57,70 +251,71 @@ def upload(file, bucket, path):
     token = str(token)
 
     try:
-        bucket = Bucket(bucket, User(token))
-    except AssertionError:
-        click.echo("Something went wrong, please check the args.")
-        click.echo("at Bucket.Create/Bucket.List")
-        return
-
-    file = Path(file)
-    if os.path.isdir(file):
-        rootDirAbsPath = NormalizePath(file.absolute().as_posix())
-
-        # find all the files recursively, get the path based on the uploading folder(not including) and filename.
-        files = [(
-            _file.absolute().as_posix().rpartition(_file.name)[0].partition(rootDirAbsPath)[2],
-            _file.name
-        ) for _file in file.resolve().glob('**/*') if _file.is_file()]
-
-        # if --no-root-folder not enabled, append the folder name to the upload path.
-        # selfDirPath = NormalizePath(Path(file).resolve().name)
-    else:
-        # fallback single file to merge the upload action
-        rootDirAbsPath = NormalizePath(file.absolute().parent.as_posix())
-        files = [("", file.name)]
-
-    path = NormalizePath(path)
-    # Apply for upload info
-    response = bucket.session.post(
-        url="/upload/auth.json",
-        json={
-            "scope": f"{bucket.name}:{path}*",
-            "deadline": round(time.time()) + 10000  # 2 hours to upload a folder, maybe enough.
+        transfer = _transferConfig()
+        partSize = part_size or transfer.get("partSize", None)
+        threshold = multipart_threshold or transfer.get("threshold", None)
+        transfer = {
+            "threads": threads or transfer.get("threads", None) or max_concurrency,
+            "partSize": ParseSize(partSize) if partSize else None,
+            "threshold": ParseSize(threshold) if threshold else None
         }
-    )
-    data = response.json()
-    logger.debug(response.request)
-    logger.debug(data)
-    if response.status_code != 200 or data.get("code", 0) != 200:
-        click.echo("Upload token failed.")
+    except (CliException, ValueError) as e:
+        click.echo(f"Invalid transfer settings, {e}")
+        return
+    if not _limitRate(limit_rate, limit_schedule):
+        return
 
-    sessionToken, accessKeyId, secretAccessKey, info = tuple(data["data"]["uploadToken"].split(":"))
-    bucket.setUploader(CosUploader(sessionToken, accessKeyId, secretAccessKey, info))
+    client = _client(token)
+    # the limiter of a daemon is shared by the commands it serves, it's tuned only in a process of its own
+    if not getattr(_serving, "active", False):
+        client.tune(initial=concurrency, maximum=max_concurrency)
+    # the settings are the job's own, commands served at the same time keep theirs
+    with contextlib.ExitStack() as job:
+        job.enter_context(LimiterJob(
+            maximum=max_concurrency,
+            retry=RetryPolicy(attempts=retries, budget=retry_budget),
+            callbackDecision=_echoDecision if show_concurrency else None
+        ))
+        try:
+            job.enter_context(TransferSettings(**transfer))
+            for name in buckets:
+                client.uploader(name, uploader, KeySplit(path)[0] if file == "-" else path)
+        except CliUploaderOptionError as e:
+            click.echo(f"Invalid transfer settings, {e}")
+            return
+        except CliException:
+            click.echo("Something went wrong, please check the args.")
+            click.echo("at Bucket.Create/Upload.Auth")
+            return
 
-    if not files:
-        click.echo(f"No files in the folder {rootDirAbsPath}")
-        return
+        if file == "-":
+            result = client.uploadStream(click.get_binary_stream("stdin"), buckets[0], path,
+                                         progress=CreateProgress(progress), uploader=uploader)
+            _exitIfFailed(result["failed"])
+            return
 
-    for localPath, filename in files:
-        uploadPath = f"{path}/{localPath}"
-        bar = tqdm(total=100, ncols=120, desc=filename, ascii=True)
         try:
-            bucket.upload(
-                file=File(
-                    name=filename,
-                    path=NormalizePath(Path(os.path.join(file, localPath)).absolute().as_posix())
-                    if localPath != ""
-                    else NormalizePath(file.parent.absolute().as_posix()),
-                    _type="file"
-                ),
-                path=uploadPath,
-                callbackProgress=lambda x, y: _progress(bar, progress=round(x / y * 100), message=None)
-            )
-            _progress(bar, progress=100, message=None)
+            result = client.uploadTree(file, buckets, path, progress=CreateProgress(progress), dedup=dedup,
+                                       compression=compression, uploader=uploader, workers=max_concurrency,
+                                       shard=(shardIndex, shardCount) if shard else None, shardMode=shard_mode,
+                                       manifest=manifest)
         except CliException:
             click.echo("Something went wrong, please check the args.")
-            click.echo("at Bucket.Upload")
+            click.echo("at Bucket.List")
+            return
+        if not result["files"] and "manifest" not in result:
+            click.echo(f"No files in the folder {file}")
+            return
+        if shard:
+            click.echo(f"Shard {shardIndex}/{shardCount} of {result['files']} files, manifest {result['manifest']}",
+                       err=True)
+        if len(buckets) > 1:
+            for name, counts in result["buckets"].items():
+                click.echo(f"{name}: {counts['uploaded']} uploaded, {len(counts['failed'])} failed.", err=True)
+        elif dedup:
+            click.echo(f"{result['skipped']} identical in the bucket skipped, "
+                       f"{result['copied']} duplicates copied server side.", err=True)
+        _exitIfFailed(result["failed"])
 
 
 @main.command(
@@ -173,18 +368,18 @@ def ls(bucket, path):
         return
 
     try:
-        bucket = Bucket(bucket, User(token))
+        bucket = _client(token).bucket(bucket)
         path = NormalizePath(path)
-        files = bucket.list(limit=2147483647, path=path)
-    except AssertionError:
+        files = bucket.listBatch(path=path)
+    except CliException:
         click.echo("Something went wrong, please check the args.")
         click.echo("at Bucket.Create/Bucket.List")
         return
     click.echo(f"Directory /{path.rstrip('/')}, {len(files)} files/directories")
-    for file in files:
+    for index in range(len(files)):
         click.echo(
-            f"{file.name.replace(path if path != '/' else '', ''):<60}\t"
-            f"{(int(file.fileSize) / 1024):.2f} KiB"
+            f"{files.key(index).replace(path if path != '/' else '', ''):<60}\t"
+            f"{(files.sizes[index] / 1024):.2f} KiB"
         )
 
 
@@ -235,13 +430,14 @@ def login(method, phone):
 
     click.echo("Token acquired.")
     open(Path.home().as_posix() + "/.peg.config.json", "w").write(json.dumps({
-        "token": user.token
+        "token": user.token,
+        **({"transfer": _transferConfig()} if _transferConfig() else {})
     }))
     click.echo("token saved.")
 
 
 @main.command(
-    help="Overwrite the config file to nothing."
+    help="Overwrite the config file to nothing but the transfer settings."
 )
 def logout():
     """
@@ -249,10 +445,246 @@ def logout():
     :return: None
     """
     if _feastToken():
-        open(Path.home().as_posix() + "/.peg.config.json", "w").write("{}")
+        open(Path.home().as_posix() + "/.peg.config.json", "w").write(json.dumps(
+            {"transfer": _transferConfig()} if _transferConfig() else {}
+        ))
         click.echo("Config overwritten.")
 
 
+@main.command(
+    help="Copy a file, or a folder ending with /, server side within or across buckets."
+)
+@click.option(
+    "--bucket",
+    "-b",
+    type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows, copied from."
+)
+@click.option(
+    "--src",
+    "-s", type=click.STRING,
+    required=True,
+    help="file path, or folder path ending with /, from the / of the bucket."
+)
+@click.option(
+    "--dst",
+    "-d", type=click.STRING,
+    required=True,
+    help="path from the / of bucket to where the FILE should located, a folder if ending with /."
+)
+@click.option(
+    "--dst-bucket",
+    type=click.STRING,
+    required=False,
+    help="bucket name copied to, the same bucket if blank. its credentials must be able to read the source."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+    help="objects copied at the same time."
+)
+def cp(bucket, src, dst, dst_bucket, workers):
+    """
+    Copy objects server side, no content passes through here.
+    :param bucket: bucket name copied from
+    :param src: key or prefix in the bucket
+    :param dst: key or prefix in the destination bucket
+    :param dst_bucket: bucket name copied to
+    :param workers: objects copied concurrently
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+
+    client = _client(token)
+    try:
+        client.uploader(bucket, path=CopyScope(src))
+        client.uploader(dst_bucket or bucket, path=CopyScope(dst))
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Upload.Auth")
+        return
+
+    def echoResult(srcKey: str, dstKey: str, size: int, error):
+        if error:
+            click.echo(f"/{srcKey} -> /{dstKey} failed, {error}", err=True)
+        else:
+            click.echo(f"/{srcKey} -> /{dstKey}\t{HumanSize(size)}")
+
+    try:
+        result = client.copy(bucket, src, dst, dst_bucket, workers=workers, callbackResult=echoResult)
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.List")
+        return
+    click.echo(f"{result['copied']} copied, {HumanSize(result['bytes'])}, {len(result['failed'])} failed.", err=True)
+    if result["failed"]:
+        sys.exit(1)
+
+
+@main.command(
+    help="Mirror a path of a bucket to a local folder, downloading only what is missing or changed."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    default="/",
+    help="path from the / of bucket to mirror, such as /images."
+)
+@click.option(
+    "--file",
+    "-f", type=click.Path(file_okay=False),
+    required=True,
+    help="local folder to mirror to, created if missing."
+)
+@click.option(
+    "--delete",
+    is_flag=True,
+    default=False,
+    help="remove local files whose objects are not in the bucket any more."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="objects downloaded at the same time."
+)
+@click.option(
+    "--progress",
+    type=click.Choice(["bar", "jsonl", "none"]),
+    default="bar",
+    show_default=True,
+    help="one display for the whole job, jsonl events on stdout, or nothing."
+)
+@click.option(
+    "--limit-rate",
+    type=click.STRING,
+    required=False,
+    help="bytes per second like 200M of all the transfers of the process, transfer.limitRate of the config by default."
+)
+@click.option(
+    "--limit-schedule",
+    type=click.STRING,
+    required=False,
+    help="rates by local time like 09:00-18:00=50M,18:00-09:00=off, over --limit-rate in the windows."
+)
+def pull(bucket, path, file, delete, workers, progress, limit_rate, limit_schedule):
+    """
+    Download the objects missing or changed locally, compared through a cache of sizes, times and hashes.
+    :param bucket: bucket name
+    :param path: path from the root of bucket
+    :param file: local folder
+    :param delete: remove local files not in the bucket
+    :param workers: objects downloaded concurrently
+    :param progress: progress display
+    :param limit_rate: bytes per second of the process
+    :param limit_schedule: rates by local time
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+    if not _limitRate(limit_rate, limit_schedule):
+        return
+
+    def echoResult(action: str, key: str, error):
+        if error:
+            click.echo(f"{action} /{key} failed, {error}", err=True)
+        elif action == "delete":
+            click.echo(f"deleted /{key}", err=True)
+
+    try:
+        result = _client(token).pull(bucket, path, file, delete=delete, workers=workers,
+                                     progress=CreateProgress(progress), callbackResult=echoResult)
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Bucket.List")
+        return
+    click.echo(f"{result['downloaded']} downloaded, {HumanSize(result['bytes'])}, {result['skipped']} unchanged, "
+               f"{result['deleted']} deleted, {len(result['failed'])} failed.", err=True)
+    if result["failed"]:
+        sys.exit(1)
+
+
+@main.command(
+    help="Confirm the shards of a sharded upload all arrived, from their manifests."
+)
+@click.option(
+    "--manifest",
+    "-m", type=click.Path(exists=True, file_okay=False),
+    required=False,
+    help="folder of the manifests the shards wrote, ~/.peg/shards by default."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=False,
+    help="bucket uploaded to, to check the keys are there as well."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    default="/",
+    help="path from the / of bucket uploaded to, listed with --bucket."
+)
+def merge_shards(manifest, bucket, path):
+    """
+    Merge the manifests of the shards, exit with 1 if anything is missing.
+    :param manifest: folder of the manifests
+    :param bucket: bucket name to list, None to trust the manifests
+    :param path: path from the root of bucket uploaded to
+    :return: None
+    """
+    remote = None
+    if bucket:
+        token = _feastToken()
+        if not token:
+            click.echo("Need login first.")
+            return
+        token = str(token)
+        try:
+            remote = {file.name for file in _client(token).iterList(bucket, path, recursive=True, workers=8)
+                      if file.type == "file"}
+        except CliException:
+            click.echo("Something went wrong, please check the args.")
+            click.echo("at Bucket.List")
+            return
+
+    try:
+        result = MergeManifests(manifest or (Path.home() / ".peg" / "shards").as_posix(), remote)
+    except CliException as e:
+        click.echo(str(e))
+        sys.exit(1)
+    for index in result["missingShards"]:
+        click.echo(f"shard {index}/{result['shards']} has no manifest")
+    for key in result["failed"]:
+        click.echo(f"/{key} failed")
+    for key in result["missing"]:
+        click.echo(f"/{key} is not in the bucket")
+    click.echo(f"{result['files']}/{result['total']} files, {HumanSize(result['bytes'])} "
+               f"in {result['shards'] - len(result['missingShards'])}/{result['shards']} shards, "
+               f"{'complete' if result['complete'] else 'incomplete'}.", err=True)
+    if not result["complete"]:
+        sys.exit(1)
+
+
 @main.command(
     help="Move a file to the specific directory."
 )
@@ -298,9 +730,10 @@ def mv(bucket, src, dst):
     token = str(token)
 
     try:
-        bucket = Bucket(bucket, User(token))
-        bucket.move(src, dst)
-    except AssertionError:
+        result = _client(token).moveMany(bucket, [(src, dst)])
+    except CliException:
+        result = {"failed": [src]}
+    if result["failed"]:
         click.echo("Something went wrong, please check the args.")
         click.echo("at Bucket.Create/Bucket.Move")
         return
@@ -337,23 +770,22 @@ def link(bucket, file, ssl):
     token = str(token)
 
     try:
-        bucket = Bucket(bucket, User(token))
-    except AssertionError:
+        bucket = _client(token).bucket(bucket)
+    except CliException:
         click.echo("Something went wrong, please check the args.")
         click.echo("at Bucket.Create")
         return
 
     if str(file).endswith("/"):
         try:
-            files = bucket.list(limit=2147483647, path=file[1:] if str(file).startswith("/") else file)
-        except AssertionError:
+            files = bucket.listBatch(path=file[1:] if str(file).startswith("/") else file)
+        except CliException:
             click.echo("Something went wrong, please check the args.")
             click.echo("at Bucket.List")
             return
 
-        for file in files:
-            if file.type == "file":
-                click.echo(f"{'https' if ssl else 'http'}://{bucket.domain}/{urllib.parse.quote(file.name)}")
+        for index in files.select(_type="file"):
+            click.echo(f"{'https' if ssl else 'http'}://{bucket.domain}/{urllib.parse.quote(files.key(index))}")
     else:
         file = file.strip("/").strip()
         click.echo(f"{'https' if ssl else 'http'}://{bucket.domain}/{file}")
@@ -381,24 +813,15 @@ def rm(bucket, file):
         return
     token = str(token)
     try:
-        bucket = Bucket(bucket, User(token))
-        path, name = KeySplit(file)
-        name = NormalizePath(name) if str(file).endswith("/") else name
-        bucket.remove([
-            File(
-                name=name,
-                _type="folder" if name.endswith("/") else "file",
-                path=NormalizePath(path).lstrip("/")
-            )
-        ])
-    except AssertionError:
+        _client(token).removeMany(bucket, [file])
+    except CliException:
         click.echo("Something went wrong, please check the args.")
         click.echo("at Bucket.Create/Bucket.Remove")
         return
 
 
 @main.command(
-    help="As mkdir in linux. Make a directory."
+    help="Remove the objects under a path by age, size and pattern, keeping the latest ones."
 )
 @click.option(
     "--bucket",
@@ -407,33 +830,891 @@ def rm(bucket, file):
     help="bucket name as same as ls shows."
 )
 @click.option(
-    "--fullpath",
-    "-fp", type=click.STRING,
+    "--path",
+    "-p", type=click.STRING,
     required=True,
-    help="folder path from the / of the bucket."
+    help="path from the / of bucket to prune under recursively, such as /builds."
 )
-def mkdir(bucket, fullpath):
+@click.option(
+    "--older-than",
+    type=click.STRING,
+    required=False,
+    help="remove only objects modified before the duration, such as 30d."
+)
+@click.option(
+    "--keep-latest",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="newest objects matched kept whatever their age."
+)
+@click.option(
+    "--keep-per",
+    type=click.Choice(KEEP_SCOPES),
+    default="dir",
+    show_default=True,
+    help="keep the latest of every directory, or of the whole path."
+)
+@click.option(
+    "--match",
+    "-m", type=click.STRING,
+    multiple=True,
+    help="glob the filename should match like '*.zip', or the key under the path if with /, repeatable."
+)
+@click.option(
+    "--min-size",
+    type=click.STRING,
+    required=False,
+    help="leave smaller objects alone, such as 1M."
+)
+@click.option(
+    "--max-size",
+    type=click.STRING,
+    required=False,
+    help="leave larger objects alone, such as 1G."
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="print what would be removed without removing it."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="folders listed and delete requests sent at the same time."
+)
+def prune(bucket, path, older_than, keep_latest, keep_per, match, min_size, max_size, dry_run, workers):
     """
-    Make a directory in the bucket.
+    Stream a recursive listing and remove the objects expired, in batches through delete.json.
     :param bucket: bucket name
-    :param fullpath: fullpath from root of the bucket, directory name needed
+    :param path: path from the root of bucket
+    :param older_than: age objects removed are older than
+    :param keep_latest: newest objects kept
+    :param keep_per: dir or all, where the newest are counted
+    :param match: globs of the objects pruned
+    :param min_size: smallest object pruned
+    :param max_size: largest object pruned
+    :param dry_run: only print the objects
+    :param workers: listing and delete concurrency
     :return: None
     """
+    if not older_than and not keep_latest:
+        click.echo("Need --older-than or --keep-latest, or everything matched would be removed.")
+        return
+    try:
+        olderThan = round(time.time()) - ParseDuration(older_than) if older_than else None
+        minSize = ParseSize(min_size) if min_size else None
+        maxSize = ParseSize(max_size) if max_size else None
+    except CliException as e:
+        click.echo(str(e))
+        return
+
     token = _feastToken()
     if not token:
         click.echo("Need login first.")
         return
     token = str(token)
 
-    fullpath = str(fullpath).strip("/").strip()
+    def echoResult(file, error):
+        if error:
+            click.echo(f"remove /{file.name} failed, {error}", err=True)
+        elif dry_run:
+            click.echo(f"/{file.name:<60}\t{HumanSize(file.fileSize):>12}\t"
+                       f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(file.time))}")
 
     try:
-        bucket = Bucket(bucket, User(token))
-        bucket.mkdir(fullpath)
-    except AssertionError:
+        result = _client(token).prune(bucket, path, olderThan=olderThan, keepLatest=keep_latest, keepPer=keep_per,
+                                      match=match, minSize=minSize, maxSize=maxSize, dryRun=dry_run,
+                                      workers=workers, callbackResult=echoResult)
+    except CliException:
         click.echo("Something went wrong, please check the args.")
-        click.echo("at Bucket.Create/Bucket.Mkdir")
+        click.echo("at Bucket.Create/Bucket.List")
         return
+    click.echo(f"{result['deleted']} {'would be removed' if dry_run else 'removed'}, {HumanSize(result['bytes'])}, "
+               f"{result['kept']} kept of {result['matched']} matched, {len(result['failed'])} failed.", err=True)
+    if result["failed"]:
+        sys.exit(1)
+
+
+@main.command(
+    help="Measure the throughput and latency of uploads, listing and removing against a bucket."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows, objects are put under /.peg-bench and removed afterwards."
+)
+@click.option(
+    "--uploader",
+    type=click.Choice(list(UPLOADERS)),
+    multiple=True,
+    help="backend to measure, repeatable, all of them by default."
+)
+@click.option(
+    "--sizes",
+    type=click.STRING,
+    default="64K,1M,8M,32M",
+    show_default=True,
+    help="object sizes, comma separated."
+)
+@click.option(
+    "--concurrency",
+    type=click.STRING,
+    default="1,8,32",
+    show_default=True,
+    help="uploads in flight, comma separated."
+)
+@click.option(
+    "--part-size",
+    type=click.STRING,
+    required=False,
+    help="part size of multipart uploads like 8M, the uploader's by default."
+)
+@click.option(
+    "--budget",
+    type=click.STRING,
+    default="64M",
+    show_default=True,
+    help="bytes uploaded by a combination of size and concurrency at most."
+)
+@click.option(
+    "--format",
+    "_format",
+    type=click.Choice(["table", "json"]),
+    default="table",
+    show_default=True,
+    help="a row a measure as it's done, or a JSON object a line."
+)
+def bench(bucket, uploader, sizes, concurrency, part_size, budget, _format):
+    """
+    Upload synthetic objects with every backend, size and concurrency, then time listing and removing them.
+    :param bucket: bucket name
+    :param uploader: backends measured
+    :param sizes: object sizes
+    :param concurrency: uploads in flight
+    :param part_size: multipart part size
+    :param budget: bytes a combination uploads at most
+    :param _format: table or json
+    :return: None
+    """
+    try:
+        sizes = [ParseSize(size) for size in sizes.split(",") if size.strip()]
+        concurrencies = [int(x) for x in concurrency.split(",") if x.strip()]
+        partSize = ParseSize(part_size) if part_size else None
+        budget = ParseSize(budget)
+    except (CliException, ValueError) as e:
+        click.echo(f"Invalid bench settings, {e}")
+        return
+    if not sizes or not concurrencies or min(sizes) < 1 or min(concurrencies) < 1:
+        click.echo("Invalid bench settings, sizes and concurrency need positive values.")
+        return
+
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+
+    def echoResult(result: dict):
+        if _format == "json":
+            click.echo(json.dumps(result))
+            return
+        click.echo(f"{result['op']:<14}{result['backend']:<8}{HumanSize(result['size']) if result['size'] else '-':>10}"
+                   f"{result['concurrency']:>6}{result['objects']:>9}{result['failed']:>8}{result['MBps']:>10.2f}"
+                   f"{result['objectsPerSecond']:>10.2f}{result['p50']:>10.1f}{result['p99']:>10.1f}")
+
+    if _format == "table":
+        click.echo(f"{'op':<14}{'backend':<8}{'size':>10}{'conc':>6}{'objects':>9}{'failed':>8}{'MB/s':>10}"
+                   f"{'obj/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    try:
+        _client(token).bench(bucket, backends=uploader or None, sizes=sizes, concurrencies=concurrencies,
+                             partSize=partSize, budget=budget, callbackResult=echoResult)
+    except CliUploaderOptionError as e:
+        click.echo(f"Invalid transfer settings, {e}")
+        return
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Upload.Auth")
+        return
+
+
+@main.command(
+    help="Write a sorted, compressed listing of a path of a bucket, to diff against later."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    default="/",
+    help="path from the / of bucket to list recursively, such as /site."
+)
+@click.option(
+    "--output",
+    "-o", type=click.Path(dir_okay=False),
+    required=True,
+    help="file the snapshot is written to."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="folders listed at the same time."
+)
+def snapshot(bucket, path, output, workers):
+    """
+    List a path recursively into a snapshot file, sorted in runs on disk for large listings.
+    :param bucket: bucket name
+    :param path: path from the root of bucket
+    :param output: snapshot file path
+    :param workers: folders listed concurrently
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+    try:
+        result = _client(token).snapshot(bucket, path, output, workers=workers,
+                                         callbackProgress=lambda listed: click.echo(f"\r{listed} listed", nl=False,
+                                                                                    err=True))
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Bucket.List")
+        return
+    click.echo(f"\r{result['count']} objects, {HumanSize(result['bytes'])}, written to {output}", err=True)
+
+
+@main.command(
+    help="Show the objects added, removed and changed between two snapshots, or a snapshot and the bucket now."
+)
+@click.argument(
+    "old",
+    type=click.Path(exists=True, dir_okay=False)
+)
+@click.argument(
+    "new",
+    type=click.Path(exists=True, dir_okay=False),
+    required=False
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=False,
+    help="bucket compared to when no NEW snapshot is given, the one of OLD by default."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    help="path compared to when no NEW snapshot is given, the one of OLD by default."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="folders listed at the same time, when comparing to the bucket."
+)
+def diff(old, new, bucket, path, workers):
+    """
+    Merge-join the listings in key order, a JSON object a line for every difference.
+    :param old: snapshot compared from
+    :param new: snapshot compared to, the bucket now if not given
+    :param bucket: bucket listed if no new snapshot
+    :param path: path listed if no new snapshot
+    :param workers: listing concurrency
+    :return: None
+    """
+    counts = {"added": 0, "removed": 0, "changed": 0}
+
+    def echoChanges(changes):
+        for change in changes:
+            counts[change["change"]] += 1
+            click.echo(json.dumps(change, ensure_ascii=False))
+
+    try:
+        if new is not None:
+            with Snapshot(old) as before, Snapshot(new) as after:
+                echoChanges(DiffSnapshots(before, after))
+        else:
+            token = _feastToken()
+            if not token:
+                click.echo("Need login first.")
+                return
+            echoChanges(_client(str(token)).diff(old, bucket=bucket, path=path, workers=workers))
+    except CliException as e:
+        click.echo("Something went wrong, please check the args.")
+        click.echo(str(e))
+        return
+    click.echo(f"{counts['added']} added, {counts['removed']} removed, {counts['changed']} changed.", err=True)
+
+
+@main.command(
+    help="As mkdir in linux. Make a directory."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--fullpath",
+    "-fp", type=click.STRING,
+    required=True,
+    help="folder path from the / of the bucket."
+)
+def mkdir(bucket, fullpath):
+    """
+    Make a directory in the bucket.
+    :param bucket: bucket name
+    :param fullpath: fullpath from root of the bucket, directory name needed
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+
+    try:
+        _client(token).mkdir(bucket, fullpath)
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Bucket.Mkdir")
+        return
+
+
+@main.group(
+    help="Mirror the listing of a bucket into a local index for peg find."
+)
+def index():
+    pass
+
+
+@index.command(
+    name="build",
+    help="Build the index of a whole bucket from scratch."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="index database path, ~/.peg/index/BUCKET.sqlite3 by default."
+)
+def indexBuild(bucket, db):
+    _refreshIndex(bucket, None, db)
+
+
+@index.command(
+    name="refresh",
+    help="Refresh the index under a path, entries removed remotely are dropped."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    default="/",
+    help="path from the / of bucket to refresh, such as /images."
+)
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="index database path, ~/.peg/index/BUCKET.sqlite3 by default."
+)
+def indexRefresh(bucket, path, db):
+    _refreshIndex(bucket, path, db)
+
+
+def _refreshIndex(bucket, path, db):
+    """
+    Build or refresh the local index of a bucket.
+    :param bucket: bucket name
+    :param path: path to refresh, None to build from scratch
+    :param db: index database path, default one if None
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+
+    try:
+        remote = _client(token).bucket(bucket)
+        with BucketIndex(bucket, db) as local:
+            progress = lambda count: click.echo(f"\r{count} entries indexed", nl=False)
+            if path is None:
+                count, dropped = local.build(remote, progress)
+            else:
+                count, dropped = local.refresh(remote, path, progress)
+        click.echo(f"\n{count} entries indexed, {dropped} dropped.")
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Bucket.List")
+        return
+
+
+@main.command(
+    help="Find files in the local index built by peg index."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    default="/",
+    help="path from the / of bucket to find under, such as /images."
+)
+@click.option(
+    "--name",
+    "-n", type=click.STRING,
+    required=False,
+    help="glob the filename should match, such as '*.png'."
+)
+@click.option(
+    "--min-size",
+    type=click.STRING,
+    required=False,
+    help="smallest size, such as 5M."
+)
+@click.option(
+    "--max-size",
+    type=click.STRING,
+    required=False,
+    help="largest size, such as 1G."
+)
+@click.option(
+    "--newer",
+    type=click.STRING,
+    required=False,
+    help="modified within the duration, such as 7d."
+)
+@click.option(
+    "--older",
+    type=click.STRING,
+    required=False,
+    help="modified before the duration, such as 30d."
+)
+@click.option(
+    "--type",
+    "-t", "_type",
+    type=click.Choice(["file", "folder", "all"]),
+    default="file",
+    show_default=True,
+    help="kind of entries to find."
+)
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="index database path, ~/.peg/index/BUCKET.sqlite3 by default."
+)
+def find(bucket, path, name, min_size, max_size, newer, older, _type, db):
+    """
+    Query the local index of a bucket.
+    :param bucket: bucket name
+    :param path: path from the root of bucket to find under
+    :param name: glob for the filename
+    :return: None
+    """
+    try:
+        now = round(time.time())
+        with BucketIndex(bucket, db) as local:
+            if not local.prefixes():
+                click.echo(f"No index for bucket {bucket}, run peg index build first.")
+                return
+            for file in local.find(
+                prefix=path,
+                pattern=name,
+                minSize=ParseSize(min_size) if min_size else None,
+                maxSize=ParseSize(max_size) if max_size else None,
+                newer=now - ParseDuration(newer) if newer else None,
+                older=now - ParseDuration(older) if older else None,
+                _type=None if _type == "all" else _type
+            ):
+                click.echo(f"/{file.name:<60}\t{HumanSize(int(file.fileSize)):>12}\t"
+                           f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(file.time)))}")
+    except CliException as e:
+        click.echo(str(e))
+        return
+
+
+@main.command(
+    help="Show storage used per directory, like du."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=False,
+    default="/",
+    help="path from the / of bucket to account for, such as /images."
+)
+@click.option(
+    "--depth",
+    "-d", type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    help="directory levels under the path shown separately."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="directories listed at the same time."
+)
+def du(bucket, path, depth, workers):
+    """
+    Total up sizes and object counts per directory.
+    :param bucket: bucket name
+    :param path: path from the root of bucket to account for
+    :param depth: directory levels shown
+    :param workers: directories listed concurrently
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+
+    try:
+        usage = DiskUsage(_client(token).bucket(bucket), path, depth, workers)
+        totals = usage.run(lambda count: click.echo(f"\r{count} objects counted", nl=False, err=True))
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Bucket.List")
+        return
+
+    # group directories under their parent, siblings sorted by size
+    children = {}
+    for directory in totals:
+        if directory:
+            children.setdefault(directory.rstrip("/").rpartition("/")[0], []).append(directory)
+
+    def show(directory: str, level: int):
+        size, count = totals[directory]
+        click.echo(f"{HumanSize(size):>12}\t{count:>10}\t{'  ' * level}/{usage.base}{directory}")
+        parent = directory.rstrip("/")
+        for child in sorted(children.get(parent, []), key=lambda x: totals[x][0], reverse=True):
+            show(child, level + 1)
+
+    click.echo(f"\r{'size':>12}\t{'objects':>10}\tdirectory")
+    show("", 0)
+
+
+@main.command(
+    help="Run a manifest of operations, a JSON object a line, in one process."
+)
+@click.argument(
+    "manifest",
+    type=click.File("r"),
+    default="-"
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="operations run at the same time."
+)
+@click.option(
+    "--max-concurrency",
+    type=click.IntRange(min=1),
+    default=32,
+    show_default=True,
+    help="upper bound of requests in flight, shared by all the operations."
+)
+@click.option(
+    "--limit-rate",
+    type=click.STRING,
+    required=False,
+    help="bytes per second like 200M of all the transfers of the process, transfer.limitRate of the config by default."
+)
+@click.option(
+    "--limit-schedule",
+    type=click.STRING,
+    required=False,
+    help="rates by local time like 09:00-18:00=50M,18:00-09:00=off, over --limit-rate in the windows."
+)
+def batch(manifest, workers, max_concurrency, limit_rate, limit_schedule):
+    """
+    Run operations like {"id": "a", "op": "upload", "file": "dist", "bucket": "b", "path": "/", "after": []}.
+    upload, cp, mv, rm and mkdir are supported with the arguments named as their options.
+    :param manifest: JSONL file, - for stdin
+    :param workers: operations run concurrently
+    :param max_concurrency: requests in flight at most
+    :param limit_rate: bytes per second of all the operations, shared fairly between them
+    :param limit_schedule: rates by local time
+    :return: None
+    """
+    operations = []
+    for number, line in enumerate(manifest, 1):
+        if not line.strip():
+            continue
+        try:
+            operations.append(json.loads(line))
+        except ValueError:
+            click.echo(f"line {number} of the manifest is not JSON.")
+            sys.exit(2)
+
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+    if not _limitRate(limit_rate, limit_schedule):
+        return
+
+    client = _client(token)
+    client.tune(maximum=max_concurrency)
+    try:
+        results = BatchRunner(
+            client.session,
+            workers=workers,
+            callbackResult=lambda result: click.echo(json.dumps(result, ensure_ascii=False))
+        ).run(operations)
+    except CliException as e:
+        click.echo("Something went wrong, please check the manifest.")
+        click.echo(str(e))
+        sys.exit(2)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+@main.command(
+    help="Watch a folder and upload what changes in it continuously."
+)
+@click.option(
+    "--file",
+    "-f", type=click.Path(exists=True, file_okay=False),
+    required=True,
+    help="folder path to watch."
+)
+@click.option(
+    "--bucket",
+    "-b", type=click.STRING,
+    required=True,
+    help="bucket name as same as ls shows."
+)
+@click.option(
+    "--path",
+    "-p", type=click.STRING,
+    required=True,
+    help="path from the / of bucket to where the folder should located."
+)
+@click.option(
+    "--delete",
+    is_flag=True,
+    default=False,
+    help="remove objects whose local files are removed."
+)
+@click.option(
+    "--debounce",
+    type=click.FloatRange(min=0.1),
+    default=1.0,
+    show_default=True,
+    help="seconds of quiet before a burst of changes is uploaded."
+)
+@click.option(
+    "--workers",
+    "-w", type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="files uploaded at the same time."
+)
+@click.option(
+    "--state",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="file keeping what is uploaded, one under ~/.peg/watch/ by default."
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    default=False,
+    help="poll the folder instead of inotify, for network file systems."
+)
+def watch(file, bucket, path, delete, debounce, workers, state, poll):
+    """
+    Upload what changed since the last run, then what changes until interrupted.
+    :param file: local folder
+    :param bucket: bucket name
+    :param path: path from the root of bucket
+    :param delete: remove objects of the files removed
+    :param debounce: seconds of quiet before uploading
+    :param workers: files uploaded concurrently
+    :param state: state file path
+    :param poll: poll instead of inotify
+    :return: None
+    """
+    token = _feastToken()
+    if not token:
+        click.echo("Need login first.")
+        return
+    token = str(token)
+
+    def echoEvent(action: str, key: str, error):
+        click.echo(f"{action} /{key} failed, {error}" if error else f"{action} /{key}", err=bool(error))
+
+    job = WatchJob(_client(token).session, bucket, file, path, state=state, delete=delete, debounce=debounce,
+                   workers=workers, poll=poll, callbackEvent=echoEvent)
+    click.echo(f"Watching {job.root}, Ctrl-C to stop.")
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        job.run()
+    except KeyboardInterrupt:
+        pass
+    except CliException:
+        click.echo("Something went wrong, please check the args.")
+        click.echo("at Bucket.Create/Upload.Auth")
+        return
+    click.echo("Stopped.")
+
+
+@main.command(
+    help="Keep sessions warm and run the commands forwarded over a unix socket."
+)
+@click.option(
+    "--socket",
+    "socketPath",
+    type=click.Path(dir_okay=False),
+    required=False,
+    help="unix socket to listen on, PEG_SOCKET or ~/.peg.sock by default."
+)
+@click.option(
+    "--limit-rate",
+    type=click.STRING,
+    required=False,
+    help="bytes per second like 200M of all the transfers of the process, transfer.limitRate of the config by default."
+)
+@click.option(
+    "--limit-schedule",
+    type=click.STRING,
+    required=False,
+    help="rates by local time like 09:00-18:00=50M,18:00-09:00=off, over --limit-rate in the windows."
+)
+def serve(socketPath, limit_rate, limit_schedule):
+    """
+    Serve forwarded commands until interrupted, each one a job sharing the bandwidth fairly with the others.
+    :param socketPath: unix socket path
+    :param limit_rate: bytes per second of all the commands served
+    :param limit_schedule: rates by local time
+    :return: None
+    """
+    if not _limitRate(limit_rate, limit_schedule):
+        return
+    try:
+        server = DaemonServer(socketPath or SocketPath(), _runForwarded)
+    except CliException as e:
+        click.echo(str(e))
+        return
+    click.echo(f"Serving on {server.socketPath}, Ctrl-C to stop.")
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    click.echo("Stopped.")
+
+
+def _runForwarded(argv: list, cwd: str) -> int:
+    """
+    Run a command forwarded to the daemon, in the thread of the request.
+    :param argv: arguments of peg, paths in them absolute
+    :param cwd: working directory of the client, unused as paths come absolute
+    :return: exit code
+    """
+    _serving.active = True
+    try:
+        with BandwidthJob(f"request-{next(_requests)}"):
+            code = main.main(args=argv, prog_name="peg", standalone_mode=False)
+        return code if isinstance(code, int) else 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except click.ClickException as e:
+        e.show()
+        return e.exit_code
+    except click.Abort:
+        click.echo("Aborted!", err=True)
+        return 1
+
+
+def _absolutePaths(command: click.Command, args: list) -> list:
+    """
+    Make the values of click.Path options absolute, the daemon runs in another directory.
+    :param command: command or group the args are for
+    :param args: arguments after the command name
+    :return: arguments with paths absolute
+    """
+    args = list(args)
+    if isinstance(command, click.Group):
+        if args and args[0] in command.commands:
+            return [args[0]] + _absolutePaths(command.commands[args[0]], args[1:])
+        return args
+
+    for param in command.params:
+        if not isinstance(param, click.Option) or not isinstance(param.type, click.Path):
+            continue
+        for index, token in enumerate(args):
+            for opt in param.opts:
+                if token == opt and index + 1 < len(args) and args[index + 1] != "-":
+                    args[index + 1] = os.path.abspath(args[index + 1])
+                elif opt.startswith("--") and token.startswith(f"{opt}="):
+                    args[index] = f"{opt}={os.path.abspath(token[len(opt) + 1:])}"
+                elif not opt.startswith("--") and token.startswith(opt) and len(token) > len(opt) \
+                        and not token.startswith("--"):
+                    args[index] = f"{opt}{os.path.abspath(token[len(opt):])}"
+    return args
+
+
+def _client(token: str) -> PegClient:
+    """
+    Client of the token, shared by the commands of the process so a daemon keeps it warm.
+    :param token: user token
+    :return: PegClient object
+    """
+    with _clientLock:
+        if token not in _clients:
+            _clients[token] = PegClient(token, bandwidth=_bandwidth)
+        return _clients[token]
 
 
 def _feastToken():
@@ -450,9 +1731,13 @@ def _feastToken():
         return False
 
     # Config parsed but actually no token there.
-    if config == {}:
+    if not config.get("token", None):
         return False
 
+    # Token checked lately.
+    if time.time() - _validated.get(config["token"], 0) < TOKEN_VALIDITY:
+        return config["token"]
+
     # Token is invalid.
     if requests.get(
             url="https://api.dogecloud.com/console/index.json",
@@ -462,12 +1747,63 @@ def _feastToken():
     ).json().get("code", 0) != 200:
         return False
 
+    _validated[config["token"]] = time.time()
     return config["token"]
 
 
-def _progress(bar: tqdm, message, progress):
-    bar.update(progress - bar.n)
-    bar.set_postfix(etag=message)
+def _transferConfig() -> dict:
+    """
+    Transfer settings in the config file, like {"threads": 16, "partSize": "8M", "limitRate": "200M"}.
+    :return: dict of the settings, empty if none
+    """
+    try:
+        config = json.loads(open(Path.home().as_posix() + "/.peg.config.json", "r").read())
+    except (OSError, ValueError):
+        return {}
+    return config.get("transfer", {}) if isinstance(config.get("transfer", {}), dict) else {}
+
+
+def _limitRate(rate, schedule) -> bool:
+    """
+    Limit the bandwidth of the process by the options, or transfer.limitRate and transfer.limitSchedule of the config.
+    The limit is kept as it is if neither is set, and for the commands forwarded, as it's the one peg serve set.
+    :param rate: bytes per second like 200M
+    :param schedule: rates by local time like 09:00-18:00=50M,18:00-09:00=off
+    :return: false if the settings are invalid
+    """
+    if getattr(_serving, "active", False):
+        if rate or schedule:
+            click.echo("The bandwidth of commands run by peg serve is the one it was started with, "
+                       "--limit-rate and --limit-schedule are ignored.", err=True)
+        return True
+    transfer = _transferConfig()
+    rate = rate or transfer.get("limitRate", None)
+    schedule = schedule or transfer.get("limitSchedule", None)
+    if not rate and not schedule:
+        return True
+    try:
+        _bandwidth.configure(ParseRate(rate), ParseSchedule(schedule))
+    except CliException as e:
+        click.echo(f"Invalid bandwidth limit, {e}")
+        return False
+    return True
+
+
+def _exitIfFailed(failed: list):
+    """
+    List the keys failed to upload and exit with 1, whatever the progress display showed of them.
+    :param failed: keys failed
+    """
+    if not failed:
+        return
+    for key in failed:
+        click.echo(f"/{key} failed to upload.", err=True)
+    click.echo(f"{len(failed)} failed.", err=True)
+    sys.exit(1)
+
+
+def _echoDecision(old: int, new: int, reason: str):
+    click.echo(f"concurrency {old} -> {new}, {reason}", err=True)
 
 
 @main.command(
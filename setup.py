@@ -10,7 +10,7 @@ setup(
     url="https://github.com/lemonprefect/peg",
     packages=["cli", "cli.core", "cli.core.helpers", "cli.core.uploader", "cli.core.utilities"],
     platforms=["all"],
-    install_requires=["boto3", "httpx", "python-magic-bin", "click", "tqdm"],
+    install_requires=["boto3", "httpx", "python-magic-bin", "click"],
     keywords=["cli", "dogecloud"],
     entry_points={
         "console_scripts": ["peg=cli.peg:main"]